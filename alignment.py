@@ -0,0 +1,93 @@
+from vocabulary import utterance_words
+
+INSERTION_SYMBOL = '***'
+
+
+def align_words(reference, hypothesis):
+    """
+    Aligns a hypothesis to a reference with the Levenshtein distance, like the scorer that creates the perutt file.
+    On ties a correct word or a substitution is preferred to a deletion and a deletion to an insertion
+    :param reference: a list of the words in the reference, or an array of word ids
+    :param hypothesis: a list of the words in the hypothesis, or an array of word ids
+    :return: the aligned reference and hypothesis, with INSERTION_SYMBOL where a word is missing,
+             and the C, S, I and D operations of the alignment
+    """
+    n = len(reference)
+    m = len(hypothesis)
+    # distance[i][j] is the edit distance between the first i reference words and the first j hypothesis words
+    distance = [list(range(m + 1))]
+    for i in range(1, n + 1):
+        row = [i] * (m + 1)
+        previous = distance[i - 1]
+        word = reference[i - 1]
+        for j in range(1, m + 1):
+            row[j] = min(previous[j - 1] + (word != hypothesis[j - 1]), previous[j] + 1, row[j - 1] + 1)
+        distance.append(row)
+
+    aligned_reference = []
+    aligned_hypothesis = []
+    ops = []
+    i = n
+    j = m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and distance[i][j] == distance[i - 1][j - 1] + (reference[i - 1] != hypothesis[j - 1]):
+            aligned_reference.append(reference[i - 1])
+            aligned_hypothesis.append(hypothesis[j - 1])
+            ops.append('C' if reference[i - 1] == hypothesis[j - 1] else 'S')
+            i -= 1
+            j -= 1
+        elif i > 0 and distance[i][j] == distance[i - 1][j] + 1:
+            aligned_reference.append(reference[i - 1])
+            aligned_hypothesis.append(INSERTION_SYMBOL)
+            ops.append('D')
+            i -= 1
+        else:
+            aligned_reference.append(INSERTION_SYMBOL)
+            aligned_hypothesis.append(hypothesis[j - 1])
+            ops.append('I')
+            j -= 1
+
+    aligned_reference.reverse()
+    aligned_hypothesis.reverse()
+    ops.reverse()
+    return aligned_reference, aligned_hypothesis, ops
+
+
+def count_operations(ops):
+    """
+    :param ops: the operations of an alignment
+    :return: the number of correct words, substitutions, insertions and deletions, as on the #csid line
+    """
+    return ops.count('C'), ops.count('S'), ops.count('I'), ops.count('D')
+
+
+def align_utterances(references, hypotheses):
+    """
+    Aligns the hypothesis of every utterance to its reference
+    :param references: a dictionary of the references, strings or arrays of word ids
+    :param hypotheses: a dictionary of the hypotheses, strings or arrays of word ids
+    :return: a dictionary of the aligned reference, aligned hypothesis and operations of each utterance
+    """
+    alignments = {}
+    for utt_id in references:
+        alignments[utt_id] = align_words(utterance_words(references[utt_id]), utterance_words(hypotheses[utt_id]))
+    return alignments
+
+
+def write_per_utt_file(filename, alignments, vocabulary=None):
+    """
+    Writes alignments in the perutt format with a ref, hyp, op and #csid line per utterance
+    :param filename: name of file to write to
+    :param alignments: a dictionary of alignments from align_utterances
+    :param vocabulary: the Vocabulary of the word ids if the utterances were aligned as arrays of word ids
+    """
+    with open(filename, 'w') as out_file:
+        for utt_id in alignments:
+            aligned_reference, aligned_hypothesis, ops = alignments[utt_id]
+            if vocabulary is not None:
+                aligned_reference = [word if word == INSERTION_SYMBOL else vocabulary.word(word) for word in aligned_reference]
+                aligned_hypothesis = [word if word == INSERTION_SYMBOL else vocabulary.word(word) for word in aligned_hypothesis]
+            out_file.write(utt_id + ' ref ' + ' '.join(aligned_reference) + '\n')
+            out_file.write(utt_id + ' hyp ' + ' '.join(aligned_hypothesis) + '\n')
+            out_file.write(utt_id + ' op ' + ' '.join(ops) + '\n')
+            out_file.write(utt_id + ' #csid ' + ' '.join(str(count) for count in count_operations(ops)) + '\n')
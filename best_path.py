@@ -1,28 +1,135 @@
 import argparse
+import gzip
+import heapq
+import io
+import logging
+import mmap
 import os
 import errno
+import queue
+import sys
+import threading
 import time
 
+from array import array
 from pathlib import Path
 
+from kaldi_lattice import CompactLattice, is_binary_archive, read_compact_lattices, read_symbol_table
+from lattice_pipeline import DEFAULT_QUEUE_SIZE, PrefetchPipeline, map_tasks
+from memory_profile import MB, MemoryProfile, current_rss
+from result_cache import DEFAULT_CACHE_SIZE, ResultCache, cache_key
+from vocabulary import WORD_ID_TYPE, is_epsilon, utterance_words
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 INF = float('Inf')
 NBEST_HYPOTHESIS_FILENAME = '/words_text.txt'
+SEARCH_ENGINES = ('dfs', 'astar', 'batch', 'auto')
+# thresholds of the auto search, lattices with at most this many arcs are scanned, and lattices with at least this
+# many arcs or a state with this many arcs are searched with A* within a beam
+DEFAULT_SCAN_ARCS = 500
+DEFAULT_BEAM_ARCS = 20000
+DEFAULT_BEAM_OUT_DEGREE = 1000
+# the beam around the cost of the cheapest path through the lattice, corrected paths that cost more are not searched
+DEFAULT_BEAM = 50.0
+# number of lattices the batch search relaxes together
+DEFAULT_BATCH_SIZE = 256
+# number of lattices read between two checks of the memory against --max-memory
+MEMORY_CHECK_INTERVAL = 64
+# number of expansions of a search between two checks of the clock against its time budget
+TIME_CHECK_INTERVAL = 64
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# size hint in bytes of the blocks of lines handed over by the decompression thread
+DECOMPRESSED_BLOCK_SIZE = 1 << 20
+DECOMPRESSED_QUEUE_SIZE = 8
+NEWLINE = ord('\n')
+
+logger = logging.getLogger('best_path')
 
 
 class GraphStatistics:
     def __init__(self):
+        # the cost of the cheapest path with the correct start, per state the correct start ends in. The search after
+        # the correct start goes on from that state, so the states on the path to it are not kept
         self.correct_paths = {}
         self.correct_path_words = []
         self.correction_not_in_fst = {}
         self.new_hyp = {}
         self.old_hyp = {}
+        # the states on the path the depth first search is at
+        self.on_path = set()
 
-    def add_to_correct_paths(self, cost, path, edge):
-        new_path = path + [edge]
-        self.correct_paths[edge] = (new_path, cost)
+    def add_to_correct_paths(self, cost, edge):
+        # the legacy search kept the last path it found to the state, so it did not always find the cheapest path
+        if cost < self.correct_paths.get(edge, INF):
+            self.correct_paths[edge] = cost
 
 
-def init_graph(lattice):
+class SearchBudget:
+    """
+    Limits the time and the number of expansions of the search of every utterance. A search over its budget stops
+    and gives the best path with the correct start it found so far, the hypothesis is kept if it found none.
+    The utterances whose search was over the budget are listed in limited
+    """
+    def __init__(self, seconds=None, expansions=None):
+        """
+        :param seconds: the time budget of a search, not limited if not given
+        :param expansions: the number of states the search may expand, paths followed by the dfs search and nodes
+                           popped by the A* search, not limited if not given
+        """
+        self.seconds = seconds
+        self.expansions = expansions
+        self.limited = []
+        self.exceeded = False
+        self.expanded = 0
+        self.deadline = None
+
+    def start(self):
+        """
+        Starts the budget of the search of the next utterance
+        """
+        self.exceeded = False
+        self.expanded = 0
+        self.deadline = None if self.seconds is None else time.perf_counter() + self.seconds
+
+    def spend(self):
+        """
+        Counts an expansion of the search
+        :return: True if the search is over its budget and has to stop
+        """
+        self.expanded += 1
+        if self.expansions is not None and self.expanded > self.expansions:
+            self.exceeded = True
+        elif self.deadline is not None and self.expanded % TIME_CHECK_INTERVAL == 0 and \
+                time.perf_counter() > self.deadline:
+            self.exceeded = True
+        return self.exceeded
+
+    def write(self, out_file):
+        out_file.write('# over the search budget: ' + str(len(self.limited)) + ' utterances\n')
+
+
+def init_graph(lattice, vocabulary=None):
+    """
+    Creates a weighted graph from a lattice
+    :param lattice: the lines of a text FST or a CompactLattice
+    :param vocabulary: a Vocabulary to intern the words on the arcs with, the arcs are labelled with word ids
+                       if it is given and with the words if not
+    :return: the graph, the start state and the end state
+    """
+    if isinstance(lattice, CompactLattice):
+        return lattice.to_graph(vocabulary)
+
     graph = {}
     start = -1
     end = -1
@@ -34,10 +141,11 @@ def init_graph(lattice):
             acoustic_cost, graph_cost, ids = transition_id.split(',')
             acoustic_cost = float(acoustic_cost)
             graph_cost = float(graph_cost)
+            label = str(word) if vocabulary is None else vocabulary.intern(word)
             if _start_state in graph:
-                graph[_start_state].append((_end_state, acoustic_cost + graph_cost, str(word)))
+                graph[_start_state].append((_end_state, acoustic_cost + graph_cost, label))
             else:
-                graph[_start_state] = [(_end_state, acoustic_cost + graph_cost, str(word))]
+                graph[_start_state] = [(_end_state, acoustic_cost + graph_cost, label)]
 
             if is_start:
                 start = _start_state
@@ -50,99 +158,849 @@ def init_graph(lattice):
     return graph, start, end
 
 
-def find_best_path(hypothesis, lattice, reference):
-    graph, start, end = init_graph(lattice)
+def find_best_path(hypothesis, lattice, reference, search='dfs', vocabulary=None, cache=None, budget=None):
+    """
+    Finds the cheapest path through the lattice that starts with the reference up to and including its first error
+    :param hypothesis: the hypothesis
+    :param lattice: the lattice of the utterance
+    :param reference: the reference
+    :param search: dfs, astar, batch, auto or an AutoSearch
+    :param vocabulary: a Vocabulary, if given the hypothesis and the reference are arrays of word ids from it,
+                       the words on the arcs are interned and the new hypothesis is an array of word ids
+    :param cache: a ResultCache to look the search up in before searching, and to store the result in
+    :param budget: a SearchBudget, it is started here and tells afterwards if the search was over it
+    :return: the new hypothesis, or the hypothesis if no path starts with the correct words
+    """
+    if budget is not None:
+        budget.start()
+    mismatch, correct_start = find_correct_start(utterance_words(reference), utterance_words(hypothesis))
+
+    if len(correct_start) == 0:
+        return hypothesis
+
+    if cache is None:
+        new_hypothesis, cost = search_correct_start(correct_start, lattice, search, vocabulary, budget)
+    else:
+        new_hypothesis = cached_search_correct_start(cache, correct_start, lattice, search, vocabulary, budget)
+    return hypothesis if new_hypothesis is None else new_hypothesis
+
 
+def search_correct_start(correct_start, lattice, search='dfs', vocabulary=None, budget=None):
+    """
+    Searches the lattice for the cheapest path that starts with correct_start
+    :param correct_start: the words, or word ids from the vocabulary, the path has to start with
+    :param budget: a started SearchBudget of the dfs and A* searches, the batch search and the scan of the auto search
+                   relax every arc once and are not limited
+    :return: the new hypothesis, None if no path starts with correct_start, and the cost of the path if the search
+             gives it
+    """
+    if search == 'auto':
+        search = AutoSearch()
+    if isinstance(search, AutoSearch):
+        return search.search_correct_start(correct_start, lattice, vocabulary, budget)
+    if search == 'batch':
+        return batch_search_with_correct_starts([(correct_start, lattice)], vocabulary, budget)[0]
+
+    graph, start, end = init_graph(lattice, vocabulary)
+
+    if search == 'astar':
+        try:
+            words, cost = a_star_search_with_correct_start(correct_start, graph, start, end, budget=budget)
+        except CyclicLatticeError as exc:
+            logger.debug('%s, searched with dfs', exc)
+            return dfs_search_correct_start(correct_start, graph, start, end, budget)
+        if words is None:
+            return None, None
+        return (' '.join(words) if vocabulary is None else array(WORD_ID_TYPE, words)), cost
+
+    return dfs_search_correct_start(correct_start, graph, start, end, budget)
+
+
+def dfs_search_correct_start(correct_start, graph, start, end, budget=None):
+    """
+    Searches the graph of a lattice with the depth first search, also the lattices with a cycle that the other
+    searches can not order
+    :return: the new hypothesis, None if no path starts with correct_start, and None for the cost
+    """
     graph_info = GraphStatistics()
+    find_path_with_correct_start(correct_start, graph, start, end, graph_info, budget=budget)
+    return construct_new_hypothesis(graph, end, graph_info, correct_start, init_best_arcs(graph), budget), None
 
-    mismatch, correct_start = find_correct_start(reference.split(), hypothesis.split())
 
-    if len(correct_start) != 0:
-        find_path_with_correct_start(correct_start, graph, start, end, graph_info, '', 0.0)
-        new_hypothesis = construct_new_hypothesis(hypothesis, graph, end, graph_info, correct_start)
-    else:
-        new_hypothesis = hypothesis
+def cached_search_correct_start(cache, correct_start, lattice, search='dfs', vocabulary=None, budget=None):
+    """
+    Looks the search up in the cache, and searches and stores the result if it is not there.
+    The cache keeps the words, so it can be used with any vocabulary. The result of a search over its budget
+    is not stored, it may not be the best path
+    :return: the new hypothesis, None if no path starts with correct_start
+    """
+    words = correct_start if vocabulary is None else [vocabulary.word(word) for word in correct_start]
+    key = cache_key(lattice, words, search)
+    found, new_hypothesis = cache.lookup(key)
+    if found:
+        if new_hypothesis is not None and vocabulary is not None:
+            return vocabulary.encode(new_hypothesis)
+        return new_hypothesis
 
+    new_hypothesis, cost = search_correct_start(correct_start, lattice, search, vocabulary, budget)
+    if budget is not None and budget.exceeded:
+        return new_hypothesis
+    if new_hypothesis is not None and vocabulary is not None:
+        cache.store(key, vocabulary.decode(new_hypothesis), cost)
+    else:
+        cache.store(key, new_hypothesis, cost)
     return new_hypothesis
 
 
-def construct_new_hypothesis(hypothesis, graph, end, graph_info, correct_start):
+def construct_new_hypothesis(graph, end, graph_info, correct_start, best_arcs, budget=None):
     if len(graph_info.correct_paths) == 0:
-        return hypothesis
+        return None
     else:
-        hypothesized_end = find_shortest_paths_among_possible_paths(graph_info.correct_paths, graph, end)
-        new_hypothesis = ''
-        for word in correct_start:
-            new_hypothesis += word if len(new_hypothesis) == 0 else ' ' + word
-        new_hypothesis += ' ' + hypothesized_end
-        return new_hypothesis
+        hypothesized_end = find_shortest_paths_among_possible_paths(graph_info.correct_paths, graph, end, best_arcs,
+                                                                    budget)
+        if isinstance(correct_start, array):
+            return correct_start + array(WORD_ID_TYPE, hypothesized_end)
+        return ' '.join(correct_start) + ' ' + ' '.join(hypothesized_end)
 
 
-def find_shortest_paths_among_possible_paths(paths, graph, end):
+def find_shortest_paths_among_possible_paths(paths, graph, end, best_arcs, budget=None):
     """
 
     :param paths:
     :param graph:
     :param end:
-    :return:
+    :param best_arcs: the cheapest arc between each pair of states, from init_best_arcs
+    :param budget: a SearchBudget, every path searched to the end counts as an expansion, and when it is exceeded
+                   the cheapest of the paths searched so far is taken
+    :return: the words on the cheapest path from the end of a correct start to the end state
     """
     shortest_path = []
     shortest_path_cost = INF
     shortest_path_start_state = '0'
     for edge in paths:
+        if budget is not None and shortest_path_cost < INF and budget.spend():
+            break
         distance, came_from = bellman_ford_search(graph, edge)
-        path_cost = paths[edge][1] + distance[end]
+        path_cost = paths[edge] + distance[end]
 
-        # tmp_path, tmp_new_hypothesis = reconstruct_path(came_from, edge, end, graph)
+        # tmp_path, tmp_new_hypothesis = reconstruct_path(came_from, edge, end, best_arcs)
         # print(tmp_new_hypothesis, path_cost)
 
         if path_cost < shortest_path_cost:
             shortest_path_cost = path_cost
             shortest_path = came_from
             shortest_path_start_state = edge
-    best_path, test_new_hypothesis = reconstruct_path(shortest_path, shortest_path_start_state, end, graph)
-    return test_new_hypothesis
-
-
-def find_path_with_correct_start(correct_start, graph, start, end, graph_info, words_so_far, cost_so_far, path=[],
-                                 words='', cost=0.0):
-    tmp_path = path + [start]
-    words += words_so_far
-    cost += cost_so_far
-    if start == end:
-        return [tmp_path], words, cost
-    if start not in graph:
-        return [], '', 0.0
-    paths = []
-    words_arr = ''
-    total_cost = 0.0
+    best_path, hypothesized_end = reconstruct_path(shortest_path, shortest_path_start_state, end, best_arcs)
+    return hypothesized_end
+
+
+def find_path_with_correct_start(correct_start, graph, start, end, graph_info, position=0, cost=0.0, budget=None):
+    """
+    Depth first search for the paths whose words begin with correct_start. The state where such a path matches
+    the last word of correct_start is added to the correct paths of graph_info, with the cost of the cheapest path.
+    Only the number of matched words and the cost are carried along the path, so checking the next word is a single
+    comparison, and only the states on the current path are kept, to not go around a cycle
+    :param position: the number of words of correct_start matched on the path to start
+    :param cost: the cost of the path to start
+    :param budget: a SearchBudget, every state the search goes to counts as an expansion, and when it is exceeded
+                   the search stops with the correct paths found so far
+    """
+    if budget is not None and budget.spend():
+        return
+    if start == end or start not in graph:
+        return
+    graph_info.on_path.add(start)
     for node in graph[start]:
-        if node[0] not in tmp_path:
+        if node[0] not in graph_info.on_path:
             # if node is not in the path find all paths from the node to the end state
-            path_words = '' if node[2] == '<eps>' else ' ' + node[2]
-            tmp_words = words + path_words
-            words_so_far = tmp_words.split()
+            if is_epsilon(node[2]):
+                next_position = position
+            elif node[2] == correct_start[position]:
+                next_position = position + 1
+            else:
+                continue
 
-            path_cost = node[1]
-            cost_so_far = cost + path_cost
+            cost_so_far = cost + node[1]
 
-            if correct_start == words_so_far:
-                graph_info.add_to_correct_paths(cost_so_far, tmp_path, node[0])
-                graph_info.correct_path_words = words_so_far
+            if next_position == len(correct_start):
+                graph_info.add_to_correct_paths(cost_so_far, node[0])
+                graph_info.correct_path_words = correct_start
                 continue
-            if correct_start[:len(words_so_far)] != words_so_far:
+
+            find_path_with_correct_start(correct_start, graph, node[0], end, graph_info, next_position, cost_so_far,
+                                         budget)
+
+    graph_info.on_path.discard(start)
+
+
+class CyclicLatticeError(ValueError):
+    """
+    A lattice with a cycle has no topological order, only the dfs search, which never follows a path
+    back to a state on it, can search it
+    """
+
+
+def topological_order(graph):
+    """
+    Orders the states of a lattice so that every arc goes from an earlier state to a later one
+    :param graph: a weighted graph as created by init_graph
+    :return: a list of all states, including states that only appear as arc destinations
+    :raises CyclicLatticeError: if the lattice has a cycle, then the states on it can not be ordered
+    """
+    in_degree = {}
+    for state in graph:
+        in_degree.setdefault(state, 0)
+        for edge in graph[state]:
+            if edge[0] != state:
+                in_degree[edge[0]] = in_degree.get(edge[0], 0) + 1
+
+    order = []
+    queue = [state for state in in_degree if in_degree[state] == 0]
+    while queue:
+        state = queue.pop()
+        order.append(state)
+        for edge in graph.get(state, []):
+            if edge[0] != state:
+                in_degree[edge[0]] -= 1
+                if in_degree[edge[0]] == 0:
+                    queue.append(edge[0])
+    if len(order) < len(in_degree):
+        cycle = sorted(state for state in in_degree if in_degree[state] > 0)
+        raise CyclicLatticeError('The lattice has a cycle, states ' + ' '.join(str(state) for state in cycle) +
+                                 ' are on it or only reached through it')
+    return order
+
+
+def compute_cost_to_end(graph, end, order=None):
+    """
+    Computes the exact cost of the cheapest path from every state to the end state,
+    relaxing the arcs backwards in reverse topological order
+    :param graph: a weighted graph as created by init_graph
+    :param end: the end state of the lattice
+    :param order: the topological order of the states, computed if not given
+    :return: a dictionary of the remaining cost of each state, INF if the end state can not be reached
+    """
+    if order is None:
+        order = topological_order(graph)
+    cost_to_end = {state: INF for state in order}
+    cost_to_end[end] = 0.0
+    for state in reversed(order):
+        if state == end:
+            continue
+        for edge in graph.get(state, []):
+            cost = edge[1] + cost_to_end[edge[0]]
+            if cost < cost_to_end[state]:
+                cost_to_end[state] = cost
+    return cost_to_end
+
+
+def a_star_search_with_correct_start(correct_start, graph, start, end, cost_to_end=None, beam=None, budget=None):
+    """
+    Best-first search for the cheapest path through the lattice whose words begin with correct_start,
+    the correct start is a single island of corrections anchored at the first word
+    :param correct_start: the words the path has to start with
+    :param graph: a weighted graph as created by init_graph
+    :param start: the start state of the lattice
+    :param end: the end state of the lattice
+    :param cost_to_end: the reverse cost table from compute_cost_to_end, computed if not given
+    :param beam: only search paths that cost at most this much more than the cheapest path through the lattice
+    :param budget: a SearchBudget, see a_star_search_with_constraints
+    :return: the words on the best path and its cost, or None and INF if no path starts with correct_start
+    """
+    return a_star_search_with_constraints(constraint_islands([(0, correct_start)]), graph, start, end, cost_to_end,
+                                          beam, budget)
+
+
+def constraint_islands(corrections):
+    """
+    Creates the islands of a constrained search from corrections. A correction is a (position, word) pair, where
+    position is the index of the word in the new hypothesis, or a (position, words) island of consecutive words
+    starting at that position. An island with None as its position can start anywhere after the previous island
+    :param corrections: the corrections, in the order they appear in the utterance
+    :return: a tuple of (position, tuple of words) islands, without empty islands
+    """
+    islands = []
+    next_free_position = 0
+    for position, words in corrections:
+        words = (words,) if isinstance(words, (str, int)) else tuple(words)
+        if len(words) == 0:
+            continue
+        if position is not None:
+            if position < next_free_position:
+                raise ValueError('Correction at position ' + str(position) + ' overlaps or comes before the previous one')
+            next_free_position = position + len(words)
+        islands.append((position, words))
+    return tuple(islands)
+
+
+def a_star_search_with_constraints(islands, graph, start, end, cost_to_end=None, beam=None, budget=None):
+    """
+    Best-first search for the cheapest path through the lattice that is consistent with every island of corrections.
+    A search node is a state together with the progress through the constraints, the current island, the number of
+    its words matched and the position of the next word on the path, so all islands are matched in one search
+    instead of one search per path. The position stops counting after the last anchored word, since no constraint
+    depends on it there. Nodes are expanded in order of cost so far plus the exact remaining cost to the end state,
+    which never overestimates, so the first complete path that is popped is the best one
+    :param islands: the islands from constraint_islands
+    :param graph: a weighted graph as created by init_graph
+    :param start: the start state of the lattice
+    :param end: the end state of the lattice
+    :param cost_to_end: the reverse cost table from compute_cost_to_end, computed if not given
+    :param beam: only search paths that cost at most this much more than the cheapest path through the lattice,
+                 which saves the queue from the nodes that can not be on a good enough path
+    :param budget: a SearchBudget, every node popped counts as an expansion. When it is exceeded the cheapest node
+                   found so far that has matched every island is completed with the cheapest path to the end state
+    :return: the words on the best path and its cost, or None and INF if no path is consistent with the islands
+             within the beam
+    """
+    if cost_to_end is None:
+        cost_to_end = compute_cost_to_end(graph, end)
+
+    number_of_islands = len(islands)
+    last_position = max([position + len(words) for position, words in islands if position is not None], default=0)
+    start_node = (start, 0, 0, 0)
+    if cost_to_end.get(start, INF) == INF:
+        return None, INF
+    bound = INF if beam is None else cost_to_end[start] + beam
+
+    cost_so_far = {start_node: 0.0}
+    came_from = {start_node: None}
+    expanded = set()
+    # the counter breaks ties between equal estimates in the order the nodes were found
+    frontier = [(cost_to_end[start], 0, start_node)]
+    counter = 1
+    while frontier:
+        _, _, node = heapq.heappop(frontier)
+        if node in expanded:
+            continue
+        expanded.add(node)
+        if budget is not None and budget.spend():
+            return complete_cheapest_path(graph, end, cost_to_end, cost_so_far, came_from, number_of_islands)
+        state, island, matched, position = node
+        if state == end:
+            if island == number_of_islands:
+                return reconstruct_words(came_from, node), cost_so_far[node]
+            continue
+
+        for edge in graph.get(state, []):
+            if edge[0] == state:
+                # the self loop of a final state
                 continue
+            next_state, weight, word = edge
+            remaining_cost = cost_to_end.get(next_state, INF)
+            if remaining_cost == INF:
+                continue
+
+            if is_epsilon(word):
+                progress = ((island, matched, position),)
             else:
-                path = tmp_path
+                next_position = position + 1 if position < last_position else position
+                if island == number_of_islands:
+                    progress = ((island, 0, next_position),)
+                else:
+                    anchor, words = islands[island]
+                    if matched > 0 or anchor == position:
+                        # inside an island or at its anchor only the next word of the island can follow
+                        if word != words[matched]:
+                            continue
+                        progress = (next_island_progress(words, island, matched, next_position),)
+                    elif anchor is None and word == words[0]:
+                        # a floating island can start at this word or later
+                        progress = ((island, 0, next_position),
+                                    next_island_progress(words, island, matched, next_position))
+                    else:
+                        progress = ((island, 0, next_position),)
+
+            cost = cost_so_far[node] + weight
+            if cost + remaining_cost > bound:
+                continue
+            for next_island, next_matched, next_position in progress:
+                next_node = (next_state, next_island, next_matched, next_position)
+                if next_node not in expanded and cost < cost_so_far.get(next_node, INF):
+                    cost_so_far[next_node] = cost
+                    came_from[next_node] = (node, word)
+                    heapq.heappush(frontier, (cost + remaining_cost, counter, next_node))
+                    counter += 1
+
+    return None, INF
+
+
+def complete_cheapest_path(graph, end, cost_to_end, cost_so_far, came_from, number_of_islands):
+    """
+    Completes the cheapest path found by a search that has matched every island, following the cheapest arcs
+    to the end state, since no constraint is left on the rest of the path
+    :return: the words on the path and its cost, or None and INF if no path found has matched every island
+    """
+    candidates = [node for node in cost_so_far if node[1] == number_of_islands]
+    if len(candidates) == 0:
+        return None, INF
+    node = min(candidates, key=lambda candidate: cost_so_far[candidate] + cost_to_end[candidate[0]])
+    words = reconstruct_words(came_from, node)
+    cost = cost_so_far[node]
+    state = node[0]
+    while state != end:
+        next_state, weight, word = min((edge for edge in graph[state] if edge[0] != state),
+                                       key=lambda edge: edge[1] + cost_to_end.get(edge[0], INF))
+        if not is_epsilon(word):
+            words.append(word)
+        cost += weight
+        state = next_state
+    return words, cost
+
+
+def next_island_progress(words, island, matched, next_position):
+    """
+    :return: the progress after matching the next word of the island, the next island if it was the last word
+    """
+    if matched + 1 == len(words):
+        return island + 1, 0, next_position
+    return island, matched + 1, next_position
+
+
+def find_best_path_with_corrections(lattice, corrections, vocabulary=None):
+    """
+    Finds the cheapest path through the lattice that is consistent with all corrections at once, e.g.
+    [(0, 'the'), (3, ['black', 'cat']), (None, 'today')] for the first word, the fourth and fifth word and a word
+    anywhere after them
+    :param lattice: the lattice of the utterance
+    :param corrections: (position, word) pairs or (position, words) islands, see constraint_islands
+    :param vocabulary: a Vocabulary, if given the corrections are word ids from it and the new hypothesis is
+                       an array of word ids
+    :return: the new hypothesis, None if no path is consistent with the corrections, and the cost of the path
+    """
+    graph, start, end = init_graph(lattice, vocabulary)
+    words, cost = a_star_search_with_constraints(constraint_islands(corrections), graph, start, end)
+    if words is None:
+        return None, None
+    return (' '.join(words) if vocabulary is None else array(WORD_ID_TYPE, words)), cost
+
+
+def reconstruct_words(came_from, node):
+    """
+    Follows the predecessor arcs of a search node back to the start of the search
+    :param came_from: a dictionary of the previous node and the word on the arc leading to each node
+    :param node: the node the path ends in
+    :return: the words on the path, without epsilons
+    """
+    words = []
+    while came_from[node] is not None:
+        node, word = came_from[node]
+        if not is_epsilon(word):
+            words.append(word)
+    words.reverse()
+    return words
+
+
+class LatticeBatch:
+    """
+    Many lattices packed into one ragged array layout for the batch search. Every lattice is expanded into its graph
+    of (state, number of correct_start words matched) nodes, like the nodes of the A* search, and the arcs of all
+    lattices are concatenated with the offsets of each lattice. The arcs of a lattice are in topological order of
+    their source nodes, and the level of a node is the length of the longest path to it, so all arcs leaving one
+    level can be relaxed at once for every lattice in the batch
+    """
+    def __init__(self):
+        self.sources = array('q')
+        self.destinations = array('q')
+        self.weights = array('d')
+        self.words = []
+        self.levels = array('q')
+        # per lattice: the offset of its first arc, its start node and its goal node, -1 if the goal can not be reached
+        self.arc_offsets = array('q')
+        self.start_nodes = array('q')
+        self.goal_nodes = array('q')
+
+    def __len__(self):
+        return len(self.start_nodes)
+
+    def add_text_lattice(self, correct_start, lattice, vocabulary=None):
+        """
+        Expands a text FST lattice like add in a single pass over its lines, without creating its graph and ordering
+        its states, when the lattice is topologically sorted as Kaldi prints it, with the arcs in the order of their
+        source states and every arc going to a later state, the order bellman_ford_search relaxes the states in.
+        Only the weights of arcs from states the search reaches are parsed
+        :param correct_start: the words the path has to start with
+        :param lattice: the lines of a text FST
+        :param vocabulary: a Vocabulary to intern the words on the arcs with, as for init_graph
+        :return: whether the lattice was added, a lattice in another order, or with arcs leaving a final state,
+                 which init_graph drops, is not added and has to be added with add
+        """
+        sizes = [len(self.sources), len(self.levels), len(self.arc_offsets)]
+        prefix_length = len(correct_start)
+        levels = self.levels
+        sources = self.sources
+        destinations = self.destinations
+        weights = self.weights
+        words = self.words
+        # per state, the node of every number of correct_start words matched on a path to it
+        reached = {}
+        finals = set()
+        end = None
+        source = -1
+        self.arc_offsets.append(len(sources))
+        for line in lattice:
+            info = line.split()
+            state = int(info[0])
+            if len(info) != 4:
+                # a final state, the last one is the end state as for init_graph
+                if state <= source:
+                    return self.drop(sizes)
+                finals.add(state)
+                end = state
+                continue
+            next_state = int(info[1])
+            if state < source or next_state <= state or state in finals:
+                return self.drop(sizes)
+            if source == -1:
+                # the start state is the source of the first arc
+                reached[state] = {0: len(levels)}
+                self.start_nodes.append(len(levels))
+                levels.append(0)
+            source = state
+
+            nodes = reached.get(state)
+            if nodes is None:
+                continue
+            word = info[2] if vocabulary is None else vocabulary.intern(info[2])
+            acoustic_cost, graph_cost, ids = info[3].split(',')
+            weight = float(acoustic_cost) + float(graph_cost)
+            epsilon = is_epsilon(word)
+            for position, node in nodes.items():
+                if epsilon or position == prefix_length:
+                    next_position = position
+                elif word == correct_start[position]:
+                    next_position = position + 1
+                else:
+                    continue
+
+                next_nodes = reached.setdefault(next_state, {})
+                next_node = next_nodes.get(next_position)
+                if next_node is None:
+                    next_node = len(levels)
+                    next_nodes[next_position] = next_node
+                    levels.append(levels[node] + 1)
+                elif levels[node] + 1 > levels[next_node]:
+                    levels[next_node] = levels[node] + 1
+
+                sources.append(node)
+                destinations.append(next_node)
+                weights.append(weight)
+                words.append(word)
+
+        if source == -1:
+            # a lattice without arcs
+            return self.drop(sizes)
+        self.goal_nodes.append(reached.get(end, {}).get(prefix_length, -1))
+        return True
+
+    def drop(self, sizes):
+        """
+        Drops what was added of a lattice since the arrays had these sizes
+        :param sizes: the number of arcs, nodes and lattices
+        :return: False
+        """
+        arcs, nodes, lattices = sizes
+        del self.sources[arcs:], self.destinations[arcs:], self.weights[arcs:], self.words[arcs:]
+        del self.levels[nodes:]
+        del self.arc_offsets[lattices:], self.start_nodes[lattices:], self.goal_nodes[lattices:]
+        return False
+
+    def add(self, correct_start, graph, start, end):
+        """
+        Expands a lattice into the nodes of the search with correct_start and adds its arcs to the batch
+        :param correct_start: the words the path has to start with
+        :param graph: a weighted graph as created by init_graph
+        :param start: the start state of the lattice
+        :param end: the end state of the lattice
+        :raises CyclicLatticeError: if the lattice has a cycle, nothing is added then
+        """
+        order = topological_order(graph)
+        prefix_length = len(correct_start)
+        self.arc_offsets.append(len(self.sources))
+        node_ids = {(start, 0): len(self.levels)}
+        positions = {start: [0]}
+        self.start_nodes.append(len(self.levels))
+        self.levels.append(0)
+
+        for state in order:
+            if state not in positions:
+                continue
+            for position in positions[state]:
+                node = node_ids[(state, position)]
+                for edge in graph.get(state, []):
+                    if edge[0] == state:
+                        # the self loop of a final state
+                        continue
+                    next_state, weight, word = edge
+                    if is_epsilon(word) or position == prefix_length:
+                        next_position = position
+                    elif word == correct_start[position]:
+                        next_position = position + 1
+                    else:
+                        continue
+
+                    next_node = node_ids.get((next_state, next_position))
+                    if next_node is None:
+                        next_node = len(self.levels)
+                        node_ids[(next_state, next_position)] = next_node
+                        positions.setdefault(next_state, []).append(next_position)
+                        self.levels.append(0)
+                    if self.levels[node] + 1 > self.levels[next_node]:
+                        self.levels[next_node] = self.levels[node] + 1
+
+                    self.sources.append(node)
+                    self.destinations.append(next_node)
+                    self.weights.append(weight)
+                    self.words.append(word)
+
+        self.goal_nodes.append(node_ids.get((end, prefix_length), -1))
+
+    def relax(self, vectorized=True):
+        """
+        Finds the cheapest path to every node from the start node of its lattice
+        :param vectorized: relax the arcs level by level with NumPy if it is installed, which only pays off
+                           for a batch of many lattices
+        :return: the cost of each node, and the arc the cheapest path to each node ends with, -1 for start nodes
+                 and nodes that can not be reached
+        """
+        if numpy is None or not vectorized or len(self.levels) == 0:
+            # an empty batch, e.g. when every lattice had a cycle and was searched with dfs, has no level to relax
+            return self.relax_in_order()
+        return self.relax_by_level()
+
+    def relax_in_order(self):
+        # the arcs are in topological order of their sources, so relaxing each arc once in order is enough
+        cost = [INF] * len(self.levels)
+        best_arc = [-1] * len(self.levels)
+        for node in self.start_nodes:
+            cost[node] = 0.0
+        sources = self.sources
+        destinations = self.destinations
+        weights = self.weights
+        for arc in range(len(sources)):
+            arc_cost = cost[sources[arc]] + weights[arc]
+            if arc_cost < cost[destinations[arc]]:
+                cost[destinations[arc]] = arc_cost
+                best_arc[destinations[arc]] = arc
+        return cost, best_arc
+
+    def relax_by_level(self):
+        # a node gets its final cost once the arcs from every lower level are relaxed, so the arcs leaving a level
+        # are relaxed together for all lattices, with a single segment minimum per level
+        sources = numpy.frombuffer(self.sources, dtype=numpy.int64)
+        destinations = numpy.frombuffer(self.destinations, dtype=numpy.int64)
+        weights = numpy.frombuffer(self.weights, dtype=numpy.float64)
+        levels = numpy.frombuffer(self.levels, dtype=numpy.int64)
+
+        cost = numpy.full(len(levels), INF)
+        cost[numpy.frombuffer(self.start_nodes, dtype=numpy.int64)] = 0.0
+        arc_levels = levels[sources]
+        order = numpy.argsort(arc_levels, kind='stable')
+        level_offsets = numpy.searchsorted(arc_levels[order], numpy.arange(int(levels.max()) + 2))
+        for level in range(len(level_offsets) - 1):
+            arcs = order[level_offsets[level]:level_offsets[level + 1]]
+            if len(arcs) != 0:
+                numpy.minimum.at(cost, destinations[arcs], cost[sources[arcs]] + weights[arcs])
+
+        # the first arc that gives the cheapest cost of a node, the same arc relaxing in order keeps
+        best_arc = numpy.full(len(levels), -1, dtype=numpy.int64)
+        reached = cost[sources] < INF
+        tight = numpy.nonzero(reached & (cost[sources] + weights == cost[destinations]))[0]
+        nodes, first = numpy.unique(destinations[tight], return_index=True)
+        best_arc[nodes] = tight[first]
+        return cost.tolist(), best_arc.tolist()
+
+    def best_paths(self, vectorized=True):
+        """
+        :param vectorized: relax the arcs with NumPy, see relax
+        :return: a list of the words on the best path of each lattice and its cost, or None and INF if no path
+                 starts with the correct start, in the order the lattices were added
+        """
+        cost, best_arc = self.relax(vectorized)
+        paths = []
+        for lattice in range(len(self)):
+            node = self.goal_nodes[lattice]
+            if node == -1 or cost[node] == INF:
+                paths.append((None, INF))
+                continue
+            words = []
+            start_node = self.start_nodes[lattice]
+            while node != start_node:
+                arc = best_arc[node]
+                if not is_epsilon(self.words[arc]):
+                    words.append(self.words[arc])
+                node = self.sources[arc]
+            words.reverse()
+            paths.append((words, cost[self.goal_nodes[lattice]]))
+        return paths
+
+
+def batch_search_with_correct_starts(searches, vocabulary=None, budget=None):
+    """
+    Searches many lattices at once for their cheapest path that starts with a correct start,
+    the lattices with a cycle are searched one by one with the dfs search
+    :param searches: a list of correct starts and their lattices
+    :param vocabulary: a Vocabulary, if given the correct starts are word ids from it and the new hypotheses are
+                       arrays of word ids
+    :param budget: a started SearchBudget of the dfs search of a lattice with a cycle
+    :return: a list of the new hypothesis, None if no path starts with the correct start, and the cost of each search
+    """
+    batch = LatticeBatch()
+    results = []
+    for correct_start, lattice in searches:
+        if not isinstance(lattice, CompactLattice) and batch.add_text_lattice(correct_start, lattice, vocabulary):
+            results.append(None)
+            continue
+        graph, start, end = init_graph(lattice, vocabulary)
+        try:
+            batch.add(correct_start, graph, start, end)
+            results.append(None)
+        except CyclicLatticeError as exc:
+            logger.debug('%s, searched with dfs', exc)
+            results.append(dfs_search_correct_start(correct_start, graph, start, end, budget))
+
+    paths = iter(batch.best_paths())
+    for i in range(len(results)):
+        if results[i] is not None:
+            continue
+        words, cost = next(paths)
+        if words is None:
+            results[i] = (None, None)
+        else:
+            results[i] = ((' '.join(words) if vocabulary is None else array(WORD_ID_TYPE, words)), cost)
+    return results
+
 
-            new_paths, words_arr, total_cost = find_path_with_correct_start(correct_start, graph, node[0], end,
-                                                                            graph_info, path_words, path_cost, path,
-                                                                            words, cost)
+class LatticeShape:
+    def __init__(self, states, arcs, depth, max_out_degree, epsilon_arcs):
+        self.states = states
+        self.arcs = arcs
+        # the number of arcs on the longest path from the start state
+        self.depth = depth
+        self.max_out_degree = max_out_degree
+        self.epsilon_fraction = epsilon_arcs / arcs if arcs else 0.0
 
-            for newpath in new_paths:
-                paths.append(newpath)
+    def __str__(self):
+        return ('states ' + str(self.states) + ', arcs ' + str(self.arcs) + ', depth ' + str(self.depth) +
+                ', max out-degree ' + str(self.max_out_degree) + ', epsilon fraction %.2f' % self.epsilon_fraction)
 
-    return paths, words_arr, total_cost
+
+def lattice_shape(graph, order=None):
+    """
+    Measures the shape of a lattice in a single pass over its arcs
+    :param graph: a weighted graph as created by init_graph
+    :param order: the topological order of the states, computed if not given
+    :return: a LatticeShape
+    """
+    if order is None:
+        order = topological_order(graph)
+    depth = {state: 0 for state in order}
+    arcs = 0
+    epsilon_arcs = 0
+    max_out_degree = 0
+    for state in order:
+        out_degree = 0
+        for edge in graph.get(state, []):
+            if edge[0] == state:
+                # the self loop of a final state
+                continue
+            out_degree += 1
+            if is_epsilon(edge[2]):
+                epsilon_arcs += 1
+            if depth[state] + 1 > depth[edge[0]]:
+                depth[edge[0]] = depth[state] + 1
+        arcs += out_degree
+        max_out_degree = max(max_out_degree, out_degree)
+    return LatticeShape(len(order), arcs, max(depth.values(), default=0), max_out_degree, epsilon_arcs)
+
+
+class AutoSearch:
+    """
+    Picks the search of every lattice from its shape. Small lattices are scanned, relaxing every arc once like the
+    batch search, larger ones are searched with A*, and the largest or densest ones with A* within a beam, which
+    is searched again without the beam if no corrected path is inside it. Lattices with a cycle are searched with
+    dfs. Every choice and its time is logged at debug level and counted per engine
+    """
+    def __init__(self, scan_arcs=DEFAULT_SCAN_ARCS, beam_arcs=DEFAULT_BEAM_ARCS, beam_out_degree=DEFAULT_BEAM_OUT_DEGREE,
+                 beam=DEFAULT_BEAM):
+        """
+        :param scan_arcs: lattices with at most this many arcs are scanned
+        :param beam_arcs: lattices with at least this many arcs are searched within the beam
+        :param beam_out_degree: lattices with a state with at least this many arcs are searched within the beam
+        :param beam: the beam around the cost of the cheapest path through the lattice
+        """
+        self.scan_arcs = scan_arcs
+        self.beam_arcs = beam_arcs
+        self.beam_out_degree = beam_out_degree
+        self.beam = beam
+        # per engine: the number of lattices and the total time in seconds
+        self.engines = {}
+        self.beam_misses = 0
+
+    def __str__(self):
+        # the name in cache keys, every engine finds the cheapest path
+        return 'auto'
+
+    def choose(self, shape):
+        """
+        :param shape: the LatticeShape of the lattice
+        :return: the engine, scan, astar or astar-beam, and the beam, None if the engine does not use one
+        """
+        if shape.arcs <= self.scan_arcs:
+            return 'scan', None
+        if shape.arcs >= self.beam_arcs or shape.max_out_degree >= self.beam_out_degree:
+            return 'astar-beam', self.beam
+        return 'astar', None
+
+    def search_correct_start(self, correct_start, lattice, vocabulary=None, budget=None):
+        """
+        Searches the lattice with the engine chosen from its shape, like search_correct_start
+        :param budget: a started SearchBudget of the A* searches
+        :return: the new hypothesis, None if no path starts with correct_start, and the cost of the path
+        """
+        start_time = time.perf_counter()
+        graph, start, end = init_graph(lattice, vocabulary)
+        try:
+            order = topological_order(graph)
+            shape = lattice_shape(graph, order)
+            engine, beam = self.choose(shape)
+        except CyclicLatticeError as exc:
+            # only the dfs search can search a lattice with a cycle
+            order = None
+            shape = exc
+            engine, beam = 'dfs', None
+
+        if engine == 'dfs':
+            new_hypothesis, cost = dfs_search_correct_start(correct_start, graph, start, end, budget)
+            words = None if new_hypothesis is None else utterance_words(new_hypothesis)
+        elif engine == 'scan':
+            batch = LatticeBatch()
+            batch.add(correct_start, graph, start, end)
+            words, cost = batch.best_paths(vectorized=False)[0]
+        else:
+            cost_to_end = compute_cost_to_end(graph, end, order)
+            words, cost = a_star_search_with_correct_start(correct_start, graph, start, end, cost_to_end, beam, budget)
+            if words is None and beam is not None and not (budget is not None and budget.exceeded):
+                self.beam_misses += 1
+                words, cost = a_star_search_with_correct_start(correct_start, graph, start, end, cost_to_end,
+                                                               budget=budget)
+
+        elapsed = time.perf_counter() - start_time
+        count, total = self.engines.get(engine, (0, 0.0))
+        self.engines[engine] = (count + 1, total + elapsed)
+        logger.debug('%s in %.3f ms, %s', engine, elapsed * 1000, shape)
+
+        if words is None:
+            return None, None
+        return (' '.join(words) if vocabulary is None else array(WORD_ID_TYPE, words)), cost
+
+    def write(self, out_file):
+        for engine in sorted(self.engines):
+            count, total = self.engines[engine]
+            out_file.write('# ' + engine + ': ' + str(count) + ' lattices in %.3f s, %.3f ms per lattice\n'
+                           % (total, total * 1000 / count))
+        if self.beam_misses:
+            out_file.write('# searched again without the beam: ' + str(self.beam_misses) + ' lattices\n')
 
 
 def find_correct_utterance_start(reference, mismatch):
@@ -187,16 +1045,32 @@ def created_other_errors(start, end, ref, new_hyp):
     return created_new_errors
 
 
-def find_new_hypotheses(references, hypotheses, lattices):
+def find_new_hypotheses(references, hypotheses, lattices, search='dfs', vocabulary=None, cache=None, budget=None):
+    """
+    Finds a new hypothesis for every utterance with a lattice
+    :param vocabulary: a Vocabulary, if given the references and hypotheses are arrays of word ids from it
+                       and so are the new hypotheses
+    :param cache: a ResultCache of earlier searches
+    :param budget: a SearchBudget of the search of every utterance, the utterances whose search was over it
+                   are added to its limited utterances. The batch search is not limited
+    :return: the new hypotheses, and the new and old hypotheses the method was applied to
+    """
+    if search == 'batch':
+        return find_new_hypotheses_batched(references, hypotheses, lattices, vocabulary, cache)
+
     new_hypotheses_method_applied_to = {}
     old_hypotheses_method_applied_to = {}
     new_hypotheses = {}
 
     for utt_id in lattices:
-        if " ".join(references[utt_id].split()) != " ".join(hypotheses[utt_id].split()):
-            new_hypothesis = find_best_path(hypotheses[utt_id], lattices[utt_id], references[utt_id])
+        hypothesis = utterance_words(hypotheses[utt_id])
+        if utterance_words(references[utt_id]) != hypothesis:
+            new_hypothesis = find_best_path(hypotheses[utt_id], lattices[utt_id], references[utt_id], search, vocabulary,
+                                            cache, budget)
+            if budget is not None and budget.exceeded:
+                budget.limited.append(utt_id)
             new_hypotheses[utt_id] = new_hypothesis
-            if new_hypothesis.split() != hypotheses[utt_id].split():
+            if utterance_words(new_hypothesis) != hypothesis:
                 new_hypotheses_method_applied_to[utt_id] = new_hypothesis
                 old_hypotheses_method_applied_to[utt_id] = hypotheses[utt_id]
         else:
@@ -205,47 +1079,226 @@ def find_new_hypotheses(references, hypotheses, lattices):
     return new_hypotheses, new_hypotheses_method_applied_to, old_hypotheses_method_applied_to
 
 
-def get_utterance_words(path, graph):
-    words = ''
-    for i in range(0, len(path)):
-        if path[i] == path[-1]:
-            break
-        else:
-            start_state = path[i]
-            end_state = path[i + 1]
-            count = 0
-            for edge in graph[start_state]:
-                if edge[0] == end_state:
-                    count += 1
-                    # This is possible because the states are ordered
-                    # So if two or more states are identical the first state
-                    # in the graph file is always the state with the lowest cost
-                    if edge[2] != '<eps>' and count < 2:
-                        words += edge[2] if len(words) == 0 else ' ' + edge[2]
-    return words
+def find_new_hypotheses_batched(references, hypotheses, lattices, vocabulary=None, cache=None,
+                                batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Finds a new hypothesis for every utterance with a lattice like find_new_hypotheses, but searches the lattices
+    of batch_size utterances together with the batch search
+    :return: the new hypotheses, and the new and old hypotheses the method was applied to
+    """
+    found = {}
+    searches = []
+    for utt_id in lattices:
+        reference = utterance_words(references[utt_id])
+        hypothesis = utterance_words(hypotheses[utt_id])
+        if reference == hypothesis:
+            continue
+        mismatch, correct_start = find_correct_start(reference, hypothesis)
+        if len(correct_start) == 0:
+            continue
 
+        key = None
+        if cache is not None:
+            words = correct_start if vocabulary is None else [vocabulary.word(word) for word in correct_start]
+            key = cache_key(lattices[utt_id], words, 'batch')
+            in_cache, new_hypothesis = cache.lookup(key)
+            if in_cache:
+                if new_hypothesis is not None and vocabulary is not None:
+                    new_hypothesis = vocabulary.encode(new_hypothesis)
+                found[utt_id] = new_hypothesis
+                continue
+        searches.append((utt_id, correct_start, key))
+
+    for batch_start in range(0, len(searches), batch_size):
+        batch = searches[batch_start:batch_start + batch_size]
+        results = batch_search_with_correct_starts([(correct_start, lattices[utt_id]) for utt_id, correct_start, key in batch],
+                                                   vocabulary)
+        for (utt_id, correct_start, key), (new_hypothesis, cost) in zip(batch, results):
+            found[utt_id] = new_hypothesis
+            if key is not None:
+                if new_hypothesis is not None and vocabulary is not None:
+                    cache.store(key, vocabulary.decode(new_hypothesis), cost)
+                else:
+                    cache.store(key, new_hypothesis, cost)
 
-def get_words(path, wfst):
-    words = ''
-    for i in range(0, len(path)):
-        if path[i] == path[-1]:
-            break
-        else:
-            start_state = path[i]
-            end_state = path[i + 1]
-            count = 0
-            for state in wfst:
-                if state[0] == int(start_state) and state[1] == int(end_state):
-                    count += 1
-                    # This is possible because the states are ordered
-                    # So if two or more states are identical the first state
-                    # in the fsts file is always the state with the lowest cost
-                    if state[2] != '<eps>' and count < 2:
-                        words += state[2] if len(words) == 0 else ' ' + state[2]
+    new_hypotheses_method_applied_to = {}
+    old_hypotheses_method_applied_to = {}
+    new_hypotheses = {}
+    for utt_id in lattices:
+        new_hypothesis = found.get(utt_id)
+        if new_hypothesis is None:
+            new_hypothesis = hypotheses[utt_id]
+        new_hypotheses[utt_id] = new_hypothesis
+        if utterance_words(new_hypothesis) != utterance_words(hypotheses[utt_id]):
+            new_hypotheses_method_applied_to[utt_id] = new_hypothesis
+            old_hypotheses_method_applied_to[utt_id] = hypotheses[utt_id]
+
+    return new_hypotheses, new_hypotheses_method_applied_to, old_hypotheses_method_applied_to
+
+
+def find_new_hypothesis(task):
+    """
+    Finds the new hypothesis of a single utterance, the task of a search worker
+    :param task: the utterance id, hypothesis, lattice, reference, search, vocabulary, cache and budget
+    :return: the utterance id, the new hypothesis and whether the search was over its budget
+    """
+    utt_id, hypothesis, lattice, reference, search, vocabulary, cache, budget = task
+    new_hypothesis = find_best_path(hypothesis, lattice, reference, search, vocabulary, cache, budget)
+    return utt_id, new_hypothesis, budget is not None and budget.exceeded
+
+
+def search_correct_start_task(task):
+    """
+    Searches the lattice of a single utterance for a path with a correct start, the task of a search worker
+    when the results are cached in the main process
+    :param task: the utterance id, correct start, lattice, search and budget
+    :return: the utterance id, the new hypothesis or None, the cost and whether the search was over its budget
+    """
+    utt_id, correct_start, lattice, search, budget = task
+    if budget is not None:
+        budget.start()
+    new_hypothesis, cost = search_correct_start(correct_start, lattice, search, budget=budget)
+    return utt_id, new_hypothesis, cost, budget is not None and budget.exceeded
+
+
+def find_new_hypotheses_prefetched(references, hypotheses, lattice_file, search='dfs', word_symbols=None, subset=False,
+                                   readers=1, workers=0, queue_size=DEFAULT_QUEUE_SIZE, out_file=None, vocabulary=None,
+                                   cache=None, budget=None):
+    """
+    Finds the new hypotheses while the lattices are still being read. Reader threads split the archives into the
+    lattices of each utterance and put them in a bounded queue that the search takes them from
+    :param references: a dictionary of references
+    :param hypotheses: a dictionary of hypotheses
+    :param lattice_file: a file containing word FST or a folder containing archives of word FST files
+    :param search: the search used by find_best_path
+    :param word_symbols: a dictionary from word id to word for binary lattice archives
+    :param subset: only read the lattices of utterances in the references
+    :param readers: number of reader threads
+    :param workers: number of search worker processes, 0 searches in this process
+    :param queue_size: maximum number of utterance lattices waiting for the search
+    :param out_file: where to write the queue and stall statistics of the pipeline, not written if not given
+    :param vocabulary: a Vocabulary, if given the references and hypotheses are arrays of word ids from it.
+                       Worker processes search with the words, since they can not add words to the vocabulary
+    :param cache: a ResultCache of earlier searches, with worker processes it is looked up before the lattice
+                  is sent to a worker and only the searches that are not in it are sent
+    :param budget: a SearchBudget of the search of every utterance, a copy of it is sent to the workers
+    :return: the new hypotheses, and the new and old hypotheses the method was applied to, like find_new_hypotheses
+    """
+    new_hypotheses_method_applied_to = {}
+    old_hypotheses_method_applied_to = {}
+    new_hypotheses = {}
+
+    keep = (lambda utt_id: utt_id in references) if subset else None
+    pipeline = PrefetchPipeline(lattice_archives(lattice_file), lambda archive: iter_archive_lattices(archive, word_symbols),
+                                readers, queue_size, keep)
+
+    # the cache keys of the searches sent to the workers
+    cache_keys = {}
+
+    def add_new_hypothesis(utt_id, new_hypothesis, limited=False):
+        if limited:
+            budget.limited.append(utt_id)
+        if new_hypothesis is None:
+            new_hypothesis = hypotheses[utt_id]
+        if vocabulary is not None and isinstance(new_hypothesis, str):
+            new_hypothesis = vocabulary.encode(new_hypothesis)
+        new_hypotheses[utt_id] = new_hypothesis
+        if utterance_words(new_hypothesis) != utterance_words(hypotheses[utt_id]):
+            new_hypotheses_method_applied_to[utt_id] = new_hypothesis
+            old_hypotheses_method_applied_to[utt_id] = hypotheses[utt_id]
+
+    def lattices():
+        # the lattice of an utterance can be split over archives, like init_lattices joins them. The pipeline gives
+        # the parts in the order of the archives, a part without the end state is held back until the rest of the
+        # lattice is read, and a part after the end state can not be joined any more
+        held_back = {}
+        searched = set()
+        for utt_id, lattice in pipeline:
+            if utt_id in searched:
+                raise ValueError('The lattice of ' + utt_id + ' has a part in an archive after the part with its end '
+                                 'state, it can only be joined when all lattices are read first, run without --readers')
+            if utt_id in held_back:
+                lattice = held_back.pop(utt_id) + lattice
+            if not has_end_state(lattice):
+                held_back[utt_id] = lattice
+                continue
+            searched.add(utt_id)
+            yield utt_id, lattice
+        # searched as init_lattices keeps them, without an end state
+        yield from held_back.items()
+
+    def tasks():
+        for utt_id, lattice in lattices():
+            if utterance_words(references[utt_id]) == utterance_words(hypotheses[utt_id]):
+                new_hypotheses[utt_id] = hypotheses[utt_id]
+            elif cache is not None and workers > 0:
+                mismatch, correct_start = find_correct_start(utterance_words(references[utt_id]),
+                                                             utterance_words(hypotheses[utt_id]))
+                if vocabulary is not None:
+                    correct_start = [vocabulary.word(word) for word in correct_start]
+                if len(correct_start) == 0:
+                    new_hypotheses[utt_id] = hypotheses[utt_id]
+                    continue
+                key = cache_key(lattice, correct_start, search)
+                found, new_hypothesis = cache.lookup(key)
+                if found:
+                    add_new_hypothesis(utt_id, new_hypothesis)
+                else:
+                    cache_keys[utt_id] = key
+                    yield utt_id, correct_start, lattice, search, budget
+            elif vocabulary is None:
+                yield utt_id, hypotheses[utt_id], lattice, references[utt_id], search, None, cache, budget
+            elif workers > 0:
+                yield (utt_id, vocabulary.decode(hypotheses[utt_id]), lattice, vocabulary.decode(references[utt_id]),
+                       search, None, None, budget)
+            else:
+                yield utt_id, hypotheses[utt_id], lattice, references[utt_id], search, vocabulary, cache, budget
+
+    if cache is not None and workers > 0:
+        for utt_id, new_hypothesis, cost, limited in map_tasks(search_correct_start_task, tasks(), workers, queue_size):
+            key = cache_keys.pop(utt_id)
+            if not limited:
+                cache.store(key, new_hypothesis, cost)
+            add_new_hypothesis(utt_id, new_hypothesis, limited)
+    else:
+        for utt_id, new_hypothesis, limited in map_tasks(find_new_hypothesis, tasks(), workers, queue_size):
+            add_new_hypothesis(utt_id, new_hypothesis, limited)
+
+    if out_file is not None:
+        pipeline.statistics.write(out_file)
+
+    return new_hypotheses, new_hypotheses_method_applied_to, old_hypotheses_method_applied_to
+
+
+def init_best_arcs(graph):
+    """
+    Creates a table of the cheapest arc between every pair of connected states, so the words on a path
+    can be looked up directly instead of scanning the arcs of each state
+    :param graph: a weighted graph as created by init_graph
+    :return: a dictionary from (start state, end state) to the cost and the word of the cheapest arc
+    """
+    best_arcs = {}
+    for state in graph:
+        for edge in graph[state]:
+            if edge[0] == state:
+                # the self loop of a final state
+                continue
+            arc = (state, edge[0])
+            if arc not in best_arcs or edge[1] < best_arcs[arc][0]:
+                best_arcs[arc] = (edge[1], edge[2])
+    return best_arcs
+
+
+def get_utterance_words(path, best_arcs):
+    words = []
+    for i in range(len(path) - 1):
+        word = best_arcs[(path[i], path[i + 1])][1]
+        if not is_epsilon(word):
+            words.append(word)
     return words
 
 
-def reconstruct_path(came_from, start, goal, graph):
+def reconstruct_path(came_from, start, goal, best_arcs):
     path = []
     current = goal
     while current != start and current is not None:
@@ -253,7 +1306,7 @@ def reconstruct_path(came_from, start, goal, graph):
         current = came_from[current]
     path.append(start)
     path.reverse()
-    words = get_utterance_words(path, graph)
+    words = get_utterance_words(path, best_arcs)
     return path, words
 
 
@@ -292,42 +1345,347 @@ def bellman_ford_search(graph, start):
     return distance, predecessor
 
 
-def combine_fst_files(lattice_input):
-    print(lattice_input)
+def lattice_archives(lattice_input):
+    """
+    Lists the lattice archives to read
+    :param lattice_input: a file containing word FST or a folder containing archives of word FST files
+    :return: a list of archive paths
+    """
+    logger.info('lattices from %s', lattice_input)
     p = Path(lattice_input)
-    lattice_list = []
     if p.is_dir():
-        for arch in p.iterdir():
-            q = str(arch)
-            print(q)
-            with open(q) as f:
-                lattice_list += f.readlines()
+        return [str(arch) for arch in p.iterdir()]
+    return [str(lattice_input)]
+
+
+def open_lattice_archive(archive):
+    """
+    Opens a lattice archive, plain or compressed with gzip or zstd
+    :param archive: path to the archive
+    :return: a buffered binary stream over the decompressed archive and whether the archive is compressed
+    """
+    with open(archive, 'rb') as f:
+        magic = f.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(archive, 'rb'), True
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ImportError('The zstandard package is needed to read the zstd compressed archive ' + archive)
+        reader = zstandard.ZstdDecompressor().stream_reader(open(archive, 'rb'), closefd=True)
+        return io.BufferedReader(reader), True
+    return open(archive, 'rb'), False
+
+
+def read_decompressed_lines(stream):
+    """
+    Reads the lines of a compressed stream, decompressing on a background thread so
+    decompression overlaps with parsing the lines already read
+    :param stream: a text stream over a compressed archive
+    :return: a generator of lines
+    """
+    blocks = queue.Queue(maxsize=DECOMPRESSED_QUEUE_SIZE)
+
+    def decompress():
+        try:
+            while True:
+                block = stream.readlines(DECOMPRESSED_BLOCK_SIZE)
+                if not block:
+                    break
+                blocks.put(block)
+            blocks.put(None)
+        except Exception as exc:
+            blocks.put(exc)
+        finally:
+            stream.close()
+
+    threading.Thread(target=decompress, daemon=True).start()
+    while True:
+        block = blocks.get()
+        if block is None:
+            return
+        if isinstance(block, Exception):
+            raise block
+        yield from block
+
+
+def read_lattice_lines(stream, compressed):
+    """
+    Reads the lines of a text lattice archive
+    :param stream: a buffered binary stream over the archive
+    :param compressed: whether the archive is compressed, then the lines are decompressed on a background thread
+    :return: a generator of lines
+    """
+    stream = io.TextIOWrapper(stream)
+    if compressed:
+        yield from read_decompressed_lines(stream)
     else:
-        with open(str(lattice_input)) as f:
-            lattice_list += f.readlines()
+        with stream:
+            yield from stream
+
+
+def read_lattice_archive(archive):
+    """
+    Reads the lines of a single text lattice archive, which can be compressed
+    :param archive: path to the archive
+    :return: a generator of lines
+    """
+    logger.info('reading %s', archive)
+    stream, compressed = open_lattice_archive(archive)
+    yield from read_lattice_lines(stream, compressed)
+
+
+def combine_fst_files(lattice_input):
+    lattice_list = []
+    for archive in lattice_archives(lattice_input):
+        lattice_list += read_lattice_archive(archive)
     return lattice_list
 
 
-def init_lattices(lattice_file):
-    lattice_list = combine_fst_files(lattice_file)
-    lattices = {}
-    first = True
+def iter_text_lattices(lines):
     utt_id = None
-    for line in lattice_list:
+    lattice = []
+    first = True
+    for line in lines:
         if line == '\n':
             first = True
             continue
         if first:
+            if len(lattice) != 0:
+                yield utt_id, lattice
             utt_id = line.strip()
+            lattice = []
             first = False
         else:
-            if utt_id in lattices:
-                lattices[utt_id].append(line.strip())
-            else:
-                lattices[utt_id] = [line.strip()]
+            lattice.append(line.strip())
+    if len(lattice) != 0:
+        yield utt_id, lattice
+
+
+def iter_archive_lattices(archive, word_symbols=None):
+    """
+    Iterates over the lattices of every utterance in a single archive, a text FST archive or
+    a Kaldi binary lattice archive, plain or compressed with gzip or zstd
+    :param archive: path to the archive
+    :param word_symbols: a dictionary from word id to word for binary archives, see read_symbol_table
+    :return: a generator of utterance ids and their lattices, the lines of the text FST or a CompactLattice
+    """
+    logger.info('reading %s', archive)
+    stream, compressed = open_lattice_archive(archive)
+    if is_binary_archive(stream):
+        with stream:
+            yield from read_compact_lattices(stream, word_symbols)
+    else:
+        yield from iter_text_lattices(read_lattice_lines(stream, compressed))
+
+
+def iter_lattices(lattice_input, word_symbols=None):
+    """
+    Iterates over the lattices of every utterance in a lattice file or a folder of archives
+    :param lattice_input: a file containing word FST or a folder containing archives of word FST files
+    :param word_symbols: a dictionary from word id to word for binary archives, see read_symbol_table
+    :return: a generator of utterance ids and their lattices, the lines of the text FST or a CompactLattice
+    """
+    for archive in lattice_archives(lattice_input):
+        yield from iter_archive_lattices(archive, word_symbols)
+
+
+def lattice_size(lattice):
+    """
+    :param lattice: the lines of a text FST or a CompactLattice
+    :return: the number of arcs in the lattice, an estimate of the time and memory it takes to search it
+    """
+    if isinstance(lattice, CompactLattice):
+        return lattice.size()
+    return len(lattice)
+
+
+def has_end_state(lattice):
+    """
+    :param lattice: the lines of a text FST or a CompactLattice
+    :return: whether the lattice has its end state, the last part of a lattice split over archives has it
+    """
+    if isinstance(lattice, CompactLattice):
+        return any(lattice.finals)
+    # the end state is printed last
+    return any(len(line.split()) != 4 for line in reversed(lattice))
+
+
+def find_new_hypotheses_within_budget(references, hypotheses, lattice_file, search='dfs', word_symbols=None, subset=False,
+                                      max_memory=None, vocabulary=None, cache=None, budget=None):
+    """
+    Reads the lattices like init_lattices and searches them like find_new_hypotheses, but when the resident memory
+    grows over max_memory the lattices read so far are searched and dropped before reading on. The number of arcs
+    read until then is the size of every later chunk, since the memory of the dropped lattices is reused instead of
+    given back, so the resident memory stays about the same after the first chunk. The lattices of the utterances
+    without an error are not kept
+    :param max_memory: the memory budget in bytes, None reads all lattices before searching
+    :param subset: only read the lattices of utterances in the references
+    :return: the new hypotheses, and the new and old hypotheses the method was applied to, like find_new_hypotheses
+    """
+    results = ({}, {}, {})
+    searched = set()
+    lattices = {}
+    chunk_arcs = 0
+    chunk_arcs_limit = None
+    chunks = 0
+
+    def search_chunk():
+        for result, chunk_result in zip(results, find_new_hypotheses(references, hypotheses, lattices, search, vocabulary,
+                                                                     cache, budget)):
+            result.update(chunk_result)
+        searched.update(lattices)
+        lattices.clear()
+
+    searches = needs_search(references, hypotheses)
+    for read, (utt_id, lattice) in enumerate(iter_lattices(lattice_file, word_symbols), 1):
+        if subset and utt_id not in references:
+            continue
+        if not searches(utt_id):
+            # the lattices of the utterances without an error are not kept, as LatticeIndex does not keep them
+            results[0][utt_id] = hypotheses[utt_id]
+            continue
+        if utt_id in searched:
+            raise ValueError('The lattice of ' + utt_id + ' is split over archives and its first part was already '
+                             'searched, run without --max-memory')
+        if utt_id in lattices:
+            # a new lattice, the parts can be a CompactLattice
+            lattices[utt_id] = lattices[utt_id] + lattice
+        else:
+            lattices[utt_id] = lattice
+        chunk_arcs += lattice_size(lattice)
+
+        if chunk_arcs_limit is not None:
+            over_budget = chunk_arcs >= chunk_arcs_limit
+        elif max_memory is not None and read % MEMORY_CHECK_INTERVAL == 0:
+            rss = current_rss()
+            over_budget = rss is not None and rss > max_memory
+            if over_budget:
+                chunk_arcs_limit = chunk_arcs
+        else:
+            over_budget = False
+        if over_budget:
+            search_chunk()
+            chunk_arcs = 0
+            chunks += 1
+
+    if chunks > 0:
+        logger.warning('over the memory budget, searched the lattices in %d chunks of %d arcs', chunks + 1,
+                       chunk_arcs_limit)
+    search_chunk()
+    return results
+
+
+def init_lattices(lattice_file, word_symbols=None):
+    lattices = {}
+    for utt_id, lattice in iter_lattices(lattice_file, word_symbols):
+        if utt_id in lattices:
+            # a new lattice, the parts can be a CompactLattice
+            lattices[utt_id] = lattices[utt_id] + lattice
+        else:
+            lattices[utt_id] = lattice
     return lattices
 
 
+def text_lattice_ranges(data):
+    """
+    Finds the lattice of every utterance in the bytes of a plain text FST archive without decoding them,
+    the lattices are separated by an empty line like iter_text_lattices reads them
+    :param data: the bytes of the archive, e.g. a memory map
+    :return: a generator of utterance ids and the offset and length of the utterance id line and the lattice lines
+    """
+    position = 0
+    size = len(data)
+    while position < size:
+        if data[position] == NEWLINE:
+            position += 1
+            continue
+        block_end = data.find(b'\n\n', position)
+        block_end = size if block_end == -1 else block_end + 1
+        id_end = data.find(b'\n', position, block_end)
+        if id_end != -1 and id_end + 1 < block_end:
+            # an utterance id without lattice lines is skipped, as by iter_text_lattices
+            yield data[position:id_end].strip().decode(), position, block_end - position
+        position = block_end
+
+
+class LatticeIndex:
+    """
+    The lattices of a lattice file or a folder of archives by utterance id, read and parsed only when a lattice is
+    looked up. A lattice of a plain text archive is kept as the byte range of its lines in the archive, so loading
+    only scans for the empty lines between the lattices. Compressed and binary archives can not be read from the
+    middle, they are read through and only the lattices that can be looked up are kept
+    """
+    def __init__(self, lattice_input, word_symbols=None, utt_ids=None, searched=None):
+        """
+        :param lattice_input: a file containing word FST or a folder containing archives of word FST files
+        :param word_symbols: a dictionary from word id to word for binary archives, see read_symbol_table
+        :param utt_ids: only the utterances with these ids are listed, all are listed if not given
+        :param searched: a function of an utterance id that tells if its lattice will be looked up, the other
+                         utterances are listed without their lattice, e.g. the utterances without an error
+        """
+        self.word_symbols = word_symbols
+        # the parts of the lattice of every utterance, split over archives, None for a lattice that is not kept
+        self.parts = {}
+        for archive in lattice_archives(lattice_input):
+            stream, compressed = open_lattice_archive(archive)
+            with stream:
+                binary = is_binary_archive(stream)
+            if compressed or binary:
+                for utt_id, lattice in iter_archive_lattices(archive, word_symbols):
+                    self.add(utt_id, lattice, utt_ids, searched)
+                continue
+
+            logger.info('indexing %s', archive)
+            if os.path.getsize(archive) == 0:
+                continue
+            with open(archive, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for utt_id, offset, length in text_lattice_ranges(data):
+                    self.add(utt_id, (archive, offset, length), utt_ids, searched)
+
+    def add(self, utt_id, part, utt_ids, searched):
+        if utt_ids is None or utt_id in utt_ids:
+            kept = searched is None or searched(utt_id)
+            self.parts.setdefault(utt_id, []).append(part if kept else None)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __contains__(self, utt_id):
+        return utt_id in self.parts
+
+    def __getitem__(self, utt_id):
+        """
+        :return: the lines of the text FST of the utterance or a CompactLattice, as init_lattices keeps them
+        """
+        lattice = None
+        for part in self.parts[utt_id]:
+            if part is None:
+                raise KeyError('The lattice of ' + utt_id + ' was not kept')
+            if isinstance(part, tuple):
+                archive, offset, length = part
+                with open(archive, 'rb') as f:
+                    f.seek(offset)
+                    part = next(iter_text_lattices(io.StringIO(f.read(length).decode())))[1]
+            if lattice is None:
+                lattice = part
+            else:
+                # a new lattice, the stored parts are looked up again and must not grow
+                lattice = lattice + part
+        return lattice
+
+
+def needs_search(references, hypotheses):
+    """
+    :return: a function of an utterance id that tells if the hypothesis of the utterance has an error,
+             only then its lattice is searched by find_new_hypotheses
+    """
+    return lambda utt_id: utt_id in references and \
+        utterance_words(references[utt_id]) != utterance_words(hypotheses[utt_id])
+
+
 def init_references(reference_file):
     references = {}
     hypothesis = {}
@@ -415,32 +1773,23 @@ def init_references_n_or_more_errors(reference_file, n_error, find_n_or_more=Fal
     return n_error_references, n_error_hypothesis, error_details
 
 
-def init_lattices_with_n_errors(lattice_file, references_n_errors):
+def init_lattices_with_n_errors(lattice_file, references_n_errors, word_symbols=None):
     """
     Creates a list of lattices that all have a specific number of errors
-    :param lattice_file: a file containing word FST or an folder containing an archive of word FST files
+    :param lattice_file: a file containing word FST or an folder containing an archive of word FST files,
+                         plain text or compressed with gzip or zstd
     :param references_n_errors: specifies the number of errors per utterance you want to have in your new lattice file
+    :param word_symbols: a dictionary from word id to word for binary lattice archives
     :return: a list of all lattices containing n_errors
     """
-    lattice_list = combine_fst_files(lattice_file)
     lattices_with_n_errors = {}
-    first = True
-    utt_id = None
-    cnt = 0
-    for line in lattice_list:
-        if line == '\n':
-            first = True
-            continue
-        if first:
-            utt_id = line.strip()
-            first = False
-        else:
-            if utt_id in references_n_errors:
-                cnt += 1
-                if utt_id in lattices_with_n_errors:
-                    lattices_with_n_errors[utt_id].append(line.strip())
-                else:
-                    lattices_with_n_errors[utt_id] = [line.strip()]
+    for utt_id, lattice in iter_lattices(lattice_file, word_symbols):
+        if utt_id in references_n_errors:
+            if utt_id in lattices_with_n_errors:
+                # a new lattice, the parts can be a CompactLattice
+                lattices_with_n_errors[utt_id] = lattices_with_n_errors[utt_id] + lattice
+            else:
+                lattices_with_n_errors[utt_id] = lattice
     return lattices_with_n_errors
 
 
@@ -461,10 +1810,28 @@ def write_utterances_to_file(filename, out_dir, utterances):
 
 
 def create_new_hypothesises_and_reference_files_with_n_errors(references_with_n_errors, hypothesis_with_n_errors,
-                                                              lattice_file, number_of_errors, out_dir):
-    lattices = init_lattices_with_n_errors(lattice_file, references_with_n_errors)
+                                                              lattice_file, number_of_errors, out_dir, search='dfs',
+                                                              word_symbols=None, readers=0, workers=0, cache=None,
+                                                              max_memory=None, profile=None, budget=None):
+    if readers > 0:
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses_prefetched(
+            references_with_n_errors, hypothesis_with_n_errors, lattice_file, search, word_symbols, True, readers, workers,
+            out_file=sys.stdout, cache=cache, budget=budget)
+    elif max_memory is not None:
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses_within_budget(
+            references_with_n_errors, hypothesis_with_n_errors, lattice_file, search, word_symbols, True, max_memory,
+            cache=cache, budget=budget)
+    else:
+        lattices = LatticeIndex(lattice_file, word_symbols, references_with_n_errors,
+                                needs_search(references_with_n_errors, hypothesis_with_n_errors))
+        if profile is not None:
+            profile.stage('lattices')
 
-    new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses(references_with_n_errors, hypothesis_with_n_errors, lattices)
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses(references_with_n_errors, hypothesis_with_n_errors, lattices, search,
+                                                                             cache=cache, budget=budget)
+    if profile is not None:
+        # with --readers or --max-memory the lattices are read while the search runs, a single stage
+        profile.stage('search' if readers <= 0 and max_memory is None else 'lattices and search')
 
     combined_hypotheses_file_name = 'new_hypotheses_' + str(number_of_errors) + '_errors.txt'
     reference_file_name = 'references_' + str(number_of_errors) + '_errors.txt'
@@ -474,6 +1841,8 @@ def create_new_hypothesises_and_reference_files_with_n_errors(references_with_n_
     applied_to_old_filename = 'applied_to_old_' + str(number_of_errors) + '_errors.txt'
     write_utterances_to_file(applied_to_new_filename, out_dir, applied_to_new)
     write_utterances_to_file(applied_to_old_filename, out_dir, applied_to_old)
+    if budget is not None:
+        write_budget_limited(budget, 'budget_limited_' + str(number_of_errors) + '_errors.txt', out_dir, new_hypotheses)
 
     # write the references with n errors to file
     write_utterances_to_file(combined_hypotheses_file_name, out_dir, new_hypotheses)
@@ -485,6 +1854,14 @@ def create_new_hypothesises_and_reference_files_with_n_errors(references_with_n_
     write_utterances_to_file(old_hypotheses_file_name, out_dir, hypothesis_with_n_errors)
 
 
+def write_budget_limited(budget, filename, out_dir, new_hypotheses):
+    """
+    Writes the new hypotheses of the utterances whose search was over its budget, the best path found before
+    the search stopped or the hypothesis
+    """
+    write_utterances_to_file(filename, out_dir, {utt_id: new_hypotheses[utt_id] for utt_id in sorted(budget.limited)})
+
+
 def write_new_hypothesis(error_details, mismatch, hypothesis):
     if error_details[0][0] == 'S':
         # If substitution error, replace the word
@@ -501,11 +1878,12 @@ def write_new_hypothesis(error_details, mismatch, hypothesis):
     return new_hypothesis
 
 
-def fix_first_error(references, hypotheses, error_details, lattice_file, filename, out_dir, only_utt_method_is_applied_to=False):
+def fix_first_error(references, hypotheses, error_details, lattice_file, filename, out_dir, only_utt_method_is_applied_to=False,
+                    search='dfs', word_symbols=None):
     first_error_fixed_hypotheses = {}
 
-    lattices = init_lattices_with_n_errors(lattice_file, references)
-    new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses(references, hypotheses, lattices)
+    lattices = init_lattices_with_n_errors(lattice_file, references, word_symbols)
+    new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses(references, hypotheses, lattices, search)
 
     for utt_id in references:
         reference = references[utt_id].split()
@@ -527,17 +1905,33 @@ def fix_first_error(references, hypotheses, error_details, lattice_file, filenam
     return first_error_fixed_hypotheses
 
 
-def create_new_hypothesises_and_reference_files(references, hypotheses, lattice_file, out_dir, subset=False):
-    if subset:
-        lattices = init_lattices_with_n_errors(lattice_file, references)
+def create_new_hypothesises_and_reference_files(references, hypotheses, lattice_file, out_dir, subset=False, search='dfs',
+                                                word_symbols=None, readers=0, workers=0, cache=None, max_memory=None,
+                                                profile=None, budget=None):
+    if readers > 0:
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses_prefetched(
+            references, hypotheses, lattice_file, search, word_symbols, subset, readers, workers, out_file=sys.stdout,
+            cache=cache, budget=budget)
+    elif max_memory is not None:
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses_within_budget(
+            references, hypotheses, lattice_file, search, word_symbols, subset, max_memory, cache=cache, budget=budget)
     else:
-        lattices = init_lattices(lattice_file)
-
-    new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses(references, hypotheses, lattices)
+        # the lattices of the utterances without an error are never read
+        lattices = LatticeIndex(lattice_file, word_symbols, references if subset else None,
+                                needs_search(references, hypotheses))
+        if profile is not None:
+            profile.stage('lattices')
+
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses(references, hypotheses, lattices, search,
+                                                                             cache=cache, budget=budget)
+    if profile is not None:
+        # with --readers or --max-memory the lattices are read while the search runs, a single stage
+        profile.stage('search' if readers <= 0 and max_memory is None else 'lattices and search')
 
     result_file_name = 'new_hypotheses.txt'
     reference_file_name = 'references.txt'
     old_hypotheses_file_name = 'old_hypotheses.txt'
+    budget_limited_file_name = 'budget_limited.txt'
 
     if subset:
         result_file_name = 'new_hypotheses_one_or_more_errors.txt'
@@ -545,9 +1939,13 @@ def create_new_hypothesises_and_reference_files(references, hypotheses, lattice_
         old_hypotheses_file_name = 'old_hypotheses_one_or_more_errors.txt'
         applied_to_new_filename = 'applied_to_new_one_or_more_errors.txt'
         applied_to_old_filename = 'applied_to_old_one_or_more_errors.txt'
+        budget_limited_file_name = 'budget_limited_one_or_more_errors.txt'
         write_utterances_to_file(applied_to_new_filename, out_dir, applied_to_new)
         write_utterances_to_file(applied_to_old_filename, out_dir, applied_to_old)
 
+    if budget is not None:
+        write_budget_limited(budget, budget_limited_file_name, out_dir, new_hypotheses)
+
     # write the references with n errors to file
     write_utterances_to_file(result_file_name, out_dir, new_hypotheses)
 
@@ -562,9 +1960,53 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Best path in lattices',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('r', type=argparse.FileType('r'), help='Reference file')
-    parser.add_argument('w', type=str, help='Kaldi word lattice file or OR a directory of archives of word lattices')
+    parser.add_argument('w', type=str, help='Kaldi word lattice file or OR a directory of archives of word lattices, '
+                                            'text FST or Kaldi binary lattice archives, plain or compressed with gzip or zstd')
     parser.add_argument('-o', type=str, default='kaldi_new_best_path', help='Output directory')
     parser.add_argument('-n', type=str, default=0, help='Number of errors to look at')
+    parser.add_argument('-s', '--search', type=str, default='dfs', choices=SEARCH_ENGINES,
+                        help='Search used to find the best path with a correct start, dfs enumerates every path that '
+                             'matches the correct start, astar expands the cheapest paths first, batch relaxes '
+                             'many lattices together, with NumPy if it is installed, and auto picks a search per '
+                             'lattice from its size. Every search finds the cheapest path, which is not always the '
+                             'path of the search before these were added, see equivalence.py')
+    parser.add_argument('--scan-arcs', type=int, default=DEFAULT_SCAN_ARCS,
+                        help='With the auto search, lattices with at most this many arcs are scanned arc by arc')
+    parser.add_argument('--beam-arcs', type=int, default=DEFAULT_BEAM_ARCS,
+                        help='With the auto search, lattices with at least this many arcs are searched within the beam')
+    parser.add_argument('--beam-out-degree', type=int, default=DEFAULT_BEAM_OUT_DEGREE,
+                        help='With the auto search, lattices with a state with at least this many arcs are searched '
+                             'within the beam')
+    parser.add_argument('--beam', type=float, default=DEFAULT_BEAM,
+                        help='With the auto search, the beam around the cost of the cheapest path through the lattice')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log the lattice archives read, and the search chosen for every lattice by the auto '
+                             'search and its time')
+    parser.add_argument('--words', type=str, default=None,
+                        help='Symbol table (words.txt) to map the word ids in Kaldi binary lattice archives to words')
+    parser.add_argument('--readers', type=int, default=0,
+                        help='Number of reader threads that prefetch the lattices while the search runs, '
+                             '0 reads all lattices before searching')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of search worker processes when prefetching, 0 searches in the main process')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Database file of earlier search results, a search of the same lattice with the same '
+                             'correct start is looked up instead of searched again')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE >> 20,
+                        help='Maximum size of the cache in MB, the least recently used results are removed')
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='Memory budget in MB, when the lattices read take more the ones read so far are searched '
+                             'and dropped before reading on instead of reading all lattices first')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='Time budget of the search of an utterance in seconds, a search over it stops and gives '
+                             'the best path with the correct start found so far, or keeps the hypothesis. Not used by '
+                             'the batch search')
+    parser.add_argument('--expansion-budget', type=int, default=None,
+                        help='Number of states the search of an utterance may expand, like --time-budget')
+    parser.add_argument('--memory-profile', action='store_true',
+                        help='Trace the memory after reading the references, reading the lattices, searching and writing, '
+                             'and write the peak resident memory and the largest allocators of each stage. With '
+                             '--readers or --max-memory reading the lattices and searching are one stage')
 
     return parser.parse_args()
 
@@ -579,6 +2021,15 @@ def main():
     # w: a word lattice file or a directory of archived word lattices
     # - o: the output directory for the new lattices
     # - n: the number of errors to look at. So if 4 is given the script will find all lattices with error count equal to 4 and find a new path through those lattices
+    # - s: the search used to find the new best path, dfs, astar, batch or auto, which picks one for every lattice
+    #      from its shape, see scan-arcs, beam-arcs, beam-out-degree and beam
+    # - words: the symbol table of the word ids when w contains Kaldi binary lattice archives
+    # - readers, workers: read the lattices on reader threads while worker processes search them
+    # - cache: reuse the results of earlier runs on the same lattices, only the changed searches are run
+    # - max-memory: search the lattices in chunks instead of reading them all when they take more memory than this
+    # - memory-profile: write the memory after each stage and where it was allocated
+    # - time-budget, expansion-budget: stop the search of an utterance that takes longer, the utterances are written
+    #   to budget_limited.txt
 
     args = parse_args()
     reference_file = args.r
@@ -599,15 +2050,48 @@ def main():
             raise
         pass
 
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(name)s: %(message)s')
+    search = args.search
+    if search == 'auto':
+        search = AutoSearch(args.scan_arcs, args.beam_arcs, args.beam_out_degree, args.beam)
+
     number_of_errors = int(args.n)
+    word_symbols = read_symbol_table(args.words) if args.words is not None else None
+    cache = ResultCache(args.cache, args.cache_size << 20) if args.cache is not None else None
+    max_memory = args.max_memory * MB if args.max_memory is not None else None
+    profile = MemoryProfile() if args.memory_profile else None
+    budget = None
+    if args.time_budget is not None or args.expansion_budget is not None:
+        budget = SearchBudget(args.time_budget, args.expansion_budget)
 
     if number_of_errors == 0:
         references, hypotheses, error_details = init_references(reference_file)
-        create_new_hypothesises_and_reference_files(references, hypotheses, lattice_file, out_dir)
+        if profile is not None:
+            profile.stage('references')
+        create_new_hypothesises_and_reference_files(references, hypotheses, lattice_file, out_dir, search=search,
+                                                    word_symbols=word_symbols, readers=args.readers, workers=args.workers,
+                                                    cache=cache, max_memory=max_memory, profile=profile, budget=budget)
     else:
         references_with_n_errors, hypotheses_with_n_errors, error_details = init_references_n_or_more_errors(reference_file, number_of_errors)
+        if profile is not None:
+            profile.stage('references')
         create_new_hypothesises_and_reference_files_with_n_errors(references_with_n_errors, hypotheses_with_n_errors,
-                                                                  lattice_file, number_of_errors, out_dir)
+                                                                  lattice_file, number_of_errors, out_dir, search,
+                                                                  word_symbols, args.readers, args.workers, cache,
+                                                                  max_memory, profile, budget)
+
+    if cache is not None:
+        cache.write(sys.stdout)
+        cache.close()
+    if isinstance(search, AutoSearch):
+        # only the searches in this process are counted, not the ones of worker processes
+        search.write(sys.stdout)
+    if budget is not None:
+        budget.write(sys.stdout)
+    if profile is not None:
+        profile.stage('writing')
+        profile.write(sys.stdout)
 
 
 if __name__ == '__main__':
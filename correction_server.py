@@ -0,0 +1,232 @@
+import argparse
+import json
+import time
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from best_path import CyclicLatticeError, a_star_search_with_constraints, compute_cost_to_end, constraint_islands, \
+    init_graph, init_lattices
+from kaldi_lattice import read_symbol_table
+
+DEFAULT_PORT = 8000
+DEFAULT_LATTICE_CACHE_SIZE = 1024
+# upper bounds of the latency histogram buckets in milliseconds, the last bucket has no upper bound
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, milliseconds):
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and milliseconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.total += milliseconds
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        :param q: a quantile between 0 and 1
+        :return: the upper bound of the bucket the quantile falls in, in milliseconds, None for the last bucket
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket in range(len(self.counts)):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else None
+        return None
+
+    def to_dict(self):
+        buckets = {('<=' + str(bound) + 'ms'): count for bound, count in zip(LATENCY_BUCKETS, self.counts)}
+        buckets['>' + str(LATENCY_BUCKETS[-1]) + 'ms'] = self.counts[-1]
+        return {'count': self.count, 'mean_ms': self.total / self.count if self.count else 0.0,
+                'p50_ms': self.quantile(0.5), 'p90_ms': self.quantile(0.9), 'p99_ms': self.quantile(0.99),
+                'buckets': buckets}
+
+
+class CorrectionService:
+    """
+    Finds new hypotheses for corrected prefixes or corrections anywhere in the utterance. The lattices are read once, and the graph and the reverse cost table
+    of the most recently used lattices are kept, so a correction of a lattice in the cache is a single A* search
+    """
+    def __init__(self, lattices, cache_size=DEFAULT_LATTICE_CACHE_SIZE):
+        """
+        :param lattices: a dictionary of the lattice of each utterance, from init_lattices
+        :param cache_size: the number of lattices to keep the graph and cost table of
+        """
+        self.lattices = lattices
+        self.cache_size = cache_size
+        self.graphs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.latencies = {'correct': LatencyHistogram(), 'graph': LatencyHistogram(), 'search': LatencyHistogram()}
+
+    def graph(self, utt_id):
+        """
+        :return: the graph, start state, end state and reverse cost table of the lattice of the utterance
+        """
+        if utt_id in self.graphs:
+            self.graphs.move_to_end(utt_id)
+            self.hits += 1
+            return self.graphs[utt_id]
+
+        self.misses += 1
+        start_time = time.perf_counter()
+        graph, start, end = init_graph(self.lattices[utt_id])
+        entry = (graph, start, end, compute_cost_to_end(graph, end))
+        self.latencies['graph'].add((time.perf_counter() - start_time) * 1000)
+
+        self.graphs[utt_id] = entry
+        if len(self.graphs) > self.cache_size:
+            self.graphs.popitem(last=False)
+        return entry
+
+    def correct(self, utt_id, corrections):
+        """
+        Finds the cheapest path through the lattice of the utterance that is consistent with all corrections,
+        a corrected prefix is the single correction (0, prefix)
+        :param utt_id: the utterance id
+        :param corrections: (position, word) pairs or (position, words) islands, see constraint_islands
+        :return: a dictionary with the new hypothesis, None if no path is consistent with the corrections, its cost
+                 and the latency
+        """
+        start_time = time.perf_counter()
+        islands = constraint_islands(corrections)
+        graph, start, end, cost_to_end = self.graph(utt_id)
+
+        search_time = time.perf_counter()
+        words, cost = a_star_search_with_constraints(islands, graph, start, end, cost_to_end)
+        end_time = time.perf_counter()
+        self.latencies['search'].add((end_time - search_time) * 1000)
+        self.latencies['correct'].add((end_time - start_time) * 1000)
+
+        return {'utt_id': utt_id, 'corrections': [[position, list(words)] for position, words in islands],
+                'hypothesis': None if words is None else ' '.join(words),
+                'cost': None if words is None else cost,
+                'latency_ms': (end_time - start_time) * 1000}
+
+    def statistics(self):
+        return {'lattices': len(self.lattices), 'cached_lattices': len(self.graphs),
+                'cache_hits': self.hits, 'cache_misses': self.misses,
+                'latency': {name: self.latencies[name].to_dict() for name in self.latencies}}
+
+
+class CorrectionRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /correct?utt_id=...&prefix=... or POST /correct with a JSON object with utt_id and prefix,
+    the prefix is the corrected words separated by spaces. A POST can give corrections instead of a prefix,
+    a list of [position, word] or [position, [words]] pairs where the position can be null, see constraint_islands.
+    GET /stats gives the cache statistics and latencies
+    """
+    def send_json(self, status, content):
+        body = json.dumps(content, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer_correction(self, utt_id, corrections):
+        service = self.server.service
+        if utt_id is None or corrections is None:
+            self.send_json(400, {'error': 'utt_id and a prefix or corrections are required'})
+        elif utt_id not in service.lattices:
+            self.send_json(404, {'error': 'no lattice for ' + utt_id})
+        else:
+            try:
+                self.send_json(200, service.correct(utt_id, corrections))
+            except CyclicLatticeError as exc:
+                self.send_json(422, {'error': 'the lattice of ' + utt_id + ' can not be searched: ' + str(exc)})
+            except (TypeError, ValueError) as exc:
+                self.send_json(400, {'error': 'invalid corrections: ' + str(exc)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.send_json(200, self.server.service.statistics())
+        elif url.path == '/correct':
+            query = parse_qs(url.query)
+            prefix = query.get('prefix', [None])[0]
+            self.answer_correction(query.get('utt_id', [None])[0], None if prefix is None else [(0, prefix.split())])
+        else:
+            self.send_json(404, {'error': 'unknown path ' + url.path})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/correct':
+            self.send_json(404, {'error': 'unknown path ' + self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {'error': 'invalid Content-Length ' + str(self.headers.get('Content-Length'))})
+            return
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_json(400, {'error': 'the body is not JSON'})
+            return
+        if not isinstance(request, dict):
+            self.send_json(400, {'error': 'the body is not a JSON object'})
+            return
+        utt_id = request.get('utt_id')
+        prefix = request.get('prefix')
+        if (utt_id is not None and not isinstance(utt_id, str)) or (prefix is not None and not isinstance(prefix, str)):
+            self.send_json(400, {'error': 'utt_id and prefix must be strings'})
+            return
+        corrections = request.get('corrections')
+        if corrections is None and prefix is not None:
+            corrections = [(0, prefix.split())]
+        self.answer_correction(utt_id, corrections)
+
+    def log_message(self, format, *args):
+        # every request is counted in the latency histograms instead
+        pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Correction server, finds the new best path for corrected words',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('w', type=str, help='Kaldi word lattice file or OR a directory of archives of word lattices')
+    parser.add_argument('--words', type=str, default=None,
+                        help='Symbol table (words.txt) to map the word ids in Kaldi binary lattice archives to words')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_LATTICE_CACHE_SIZE,
+                        help='Number of lattices to keep the graph and reverse cost table of')
+
+    return parser.parse_args()
+
+
+def main():
+    # Reads the lattices once and answers corrections over HTTP until it is stopped, e.g.
+    # curl 'http://127.0.0.1:8000/correct?utt_id=utt0001&prefix=the+first+words'
+    # curl -d '{"utt_id": "utt0001", "corrections": [[0, "the"], [4, ["black", "cat"]]]}' http://127.0.0.1:8000/correct
+    # curl 'http://127.0.0.1:8000/stats'
+
+    args = parse_args()
+    word_symbols = read_symbol_table(args.words) if args.words is not None else None
+    service = CorrectionService(init_lattices(args.w, word_symbols), args.cache_size)
+
+    server = HTTPServer((args.host, args.port), CorrectionRequestHandler)
+    server.service = service
+    print('Serving corrections of ' + str(len(service.lattices)) + ' lattices on ' + args.host + ':' + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
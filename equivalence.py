@@ -0,0 +1,381 @@
+import argparse
+import os
+import errno
+import random
+import sys
+import time
+
+import legacy
+
+from alignment import align_words
+from best_path import INF, SEARCH_ENGINES, CyclicLatticeError, find_correct_start, init_graph, \
+    init_lattices_with_n_errors, init_references, search_correct_start, topological_order
+from structured_output import write_jsonl
+from total_error_statistics import CORRECTION_NOT_IN_LATTICE, ALL_ERRORS_FIXED, NEXT_ERROR_FIXED, NEXT_ERROR_NOT_FIXED, \
+    NEW_ERRORS_ADDED, N_ERRORS_FIXED, N_ERRORS_NOT_FIXED, NEXT_ERROR_FIXED_NO_NEW_ERRORS, NEXT_ERROR_FIXED_NEW_ERRORS, \
+    NEXT_ERROR_NOT_FIXED_NO_NEW_ERRORS, NEXT_ERROR_NOT_FIXED_NEW_ERRORS, N_ERRORS_FIXED_NO_NEW_ERRORS, \
+    N_ERRORS_FIXED_NEW_ERRORS, N_ERRORS_NOT_FIXED_NO_NEW_ERRORS, N_ERRORS_NOT_FIXED_NEW_ERRORS, \
+    ERRORS_ADDED_BEFORE_NEXT_ERROR, classify_utterance, find_error_details
+from vocabulary import is_epsilon
+
+# the frozen search of legacy.py, as it was before the faster engines were added
+LEGACY_ENGINE = 'legacy'
+# costs closer than this are the same cost, a mismatch between paths of the same cost is a tie
+COST_TOLERANCE = 1e-6
+OUTCOMES = ('same', 'tie', 'candidate cheaper', 'legacy cheaper', 'only legacy found a path',
+            'only candidate found a path', 'different without a cost')
+DEFAULT_SYNTHETIC_WORDS = 5
+# the statistics of legacy.ErrorAnalysisStatistics every category is counted in, and the ones its sum is added to
+LEGACY_CATEGORIES = {
+    CORRECTION_NOT_IN_LATTICE: 'number_of_correction_not_contained_in_lattice',
+    ALL_ERRORS_FIXED: 'all_errors_fixed_in_utterances_per_error',
+    NEXT_ERROR_FIXED: 'next_error_fixed_in_utt_per_error',
+    NEXT_ERROR_NOT_FIXED: 'next_error_NOT_fixed_in_utt_per_error',
+    NEW_ERRORS_ADDED: 'new_errors_added_in_utt_per_error',
+    N_ERRORS_FIXED: 'n_errors_fixed_in_utt_per_error',
+    N_ERRORS_NOT_FIXED: 'n_errors_NOT_fixed_in_utt_per_error',
+    NEXT_ERROR_FIXED_NO_NEW_ERRORS: 'next_error_fixed_no_new_errors',
+    NEXT_ERROR_FIXED_NEW_ERRORS: 'next_error_fixed_new_errors',
+    NEXT_ERROR_NOT_FIXED_NO_NEW_ERRORS: 'next_error_not_fixed_no_new_errors',
+    NEXT_ERROR_NOT_FIXED_NEW_ERRORS: 'next_error_not_fixed_new_errors',
+    N_ERRORS_FIXED_NO_NEW_ERRORS: 'n_errors_fixed_no_new_errors',
+    N_ERRORS_FIXED_NEW_ERRORS: 'n_errors_fixed_new_errors',
+    N_ERRORS_NOT_FIXED_NO_NEW_ERRORS: 'n_errors_not_fixed_no_new_errors',
+    N_ERRORS_NOT_FIXED_NEW_ERRORS: 'n_errors_not_fixed_new_errors',
+    ERRORS_ADDED_BEFORE_NEXT_ERROR: 'number_of_errors_added_before_second_error'}
+LEGACY_SUMS = {category: LEGACY_CATEGORIES[category] + '_no_errors'
+               for category in (NEXT_ERROR_FIXED_NO_NEW_ERRORS, NEXT_ERROR_FIXED_NEW_ERRORS,
+                                NEXT_ERROR_NOT_FIXED_NO_NEW_ERRORS, NEXT_ERROR_NOT_FIXED_NEW_ERRORS,
+                                N_ERRORS_FIXED_NO_NEW_ERRORS, N_ERRORS_FIXED_NEW_ERRORS,
+                                N_ERRORS_NOT_FIXED_NO_NEW_ERRORS, N_ERRORS_NOT_FIXED_NEW_ERRORS)}
+
+
+def word_sequence_cost(graph, start, end, words):
+    """
+    Finds the cost of the cheapest path through the lattice with exactly these words, so the hypotheses of
+    engines that do not give a cost, like the legacy search, can be compared by cost
+    :param graph: a weighted graph as created by init_graph
+    :param words: the words on the path
+    :return: the cost, INF if no path has these words
+    """
+    cost = {(start, 0): 0.0}
+    for state in topological_order(graph):
+        for position in range(len(words) + 1):
+            node_cost = cost.get((state, position))
+            if node_cost is None:
+                continue
+            for edge in graph.get(state, []):
+                if edge[0] == state:
+                    # the self loop of a final state
+                    continue
+                if is_epsilon(edge[2]):
+                    next_node = (edge[0], position)
+                elif position < len(words) and edge[2] == words[position]:
+                    next_node = (edge[0], position + 1)
+                else:
+                    continue
+                if node_cost + edge[1] < cost.get(next_node, INF):
+                    cost[next_node] = node_cost + edge[1]
+    return cost.get((end, len(words)), INF)
+
+
+def timed_search(correct_start, lattice, search):
+    """
+    :param search: one of SEARCH_ENGINES, or LEGACY_ENGINE for the frozen search of legacy.py
+    :return: the new hypothesis, None if no path starts with correct_start, and the time of the search
+    """
+    start_time = time.perf_counter()
+    if search == LEGACY_ENGINE:
+        new_hypothesis = legacy.search_correct_start(correct_start, lattice)
+    else:
+        new_hypothesis, cost = search_correct_start(correct_start, lattice, search)
+    return new_hypothesis, time.perf_counter() - start_time
+
+
+def compare_outcome(legacy_hypothesis, candidate_hypothesis, legacy_cost, candidate_cost):
+    if legacy_hypothesis is None and candidate_hypothesis is None:
+        return 'same'
+    if candidate_hypothesis is None:
+        return 'only legacy found a path'
+    if legacy_hypothesis is None:
+        return 'only candidate found a path'
+    if legacy_hypothesis.split() == candidate_hypothesis.split():
+        # the words are compared, the legacy search leaves a space at the end when the correct start is all there is
+        return 'same'
+    if legacy_cost is None or candidate_cost is None:
+        # the cost of a path through a lattice with a cycle is not computed
+        return 'different without a cost'
+    if abs(legacy_cost - candidate_cost) <= COST_TOLERANCE * max(1.0, abs(legacy_cost)):
+        return 'tie'
+    return 'candidate cheaper' if candidate_cost < legacy_cost else 'legacy cheaper'
+
+
+def classification_of(reference, hypothesis, new_hypothesis):
+    """
+    Classifies a new hypothesis like total_error_statistics.py, aligning both hypotheses to the reference
+    :return: the classification from classify_utterance
+    """
+    reference_words = reference.split()
+    old_errors = find_error_details(align_words(reference_words, hypothesis.split())[2])
+    new_errors = find_error_details(align_words(reference_words, new_hypothesis.split())[2], True)
+    return classify_utterance(len(old_errors), reference, hypothesis, new_hypothesis, old_errors, new_errors)
+
+
+def statistics_of(classification):
+    """
+    :param classification: a classification from classify_utterance
+    :return: the statistics of legacy.ErrorAnalysisStatistics the classification counts the utterance in, with the
+             counts and sums, and the word of the correction not in the lattice and of the next error not fixed
+    """
+    categories, word_not_in_lattice, word_next_error_not_fixed = classification
+    statistics = {}
+    for category, error_cnt in categories:
+        name = LEGACY_CATEGORIES[category]
+        statistics[name] = statistics.get(name, 0) + 1
+        if category in LEGACY_SUMS:
+            statistics[LEGACY_SUMS[category]] = statistics.get(LEGACY_SUMS[category], 0) + error_cnt
+    if word_not_in_lattice is not None:
+        statistics['words_not_in_lattice'] = word_not_in_lattice
+    if word_next_error_not_fixed is not None:
+        statistics['words_next_error_not_fixed'] = word_next_error_not_fixed
+    return statistics
+
+
+def legacy_statistics_of(reference, hypothesis, new_hypothesis):
+    """
+    Classifies a new hypothesis with the frozen error analysis of legacy.py
+    :return: the statistics the utterance is counted in, like statistics_of
+    """
+    reference_words = reference.split()
+    error_stats, error = legacy.classify_utterance(reference, hypothesis, new_hypothesis,
+                                                   align_words(reference_words, hypothesis.split())[2],
+                                                   align_words(reference_words, new_hypothesis.split())[2])
+    statistics = {}
+    for name in list(LEGACY_CATEGORIES.values()) + list(LEGACY_SUMS.values()):
+        if error in getattr(error_stats, name):
+            statistics[name] = getattr(error_stats, name)[error]
+    for word in error_stats.words_not_in_lattice:
+        statistics['words_not_in_lattice'] = word
+    if error_stats.words_next_error_not_fixed_arr:
+        statistics['words_next_error_not_fixed'] = error_stats.words_next_error_not_fixed_arr[0]
+    return statistics
+
+
+def compare_engines(references, hypotheses, lattices, candidate, legacy=LEGACY_ENGINE, statistics=False):
+    """
+    Runs the legacy search and the candidate search on every utterance with an error and a lattice
+    :param references: a dictionary of references
+    :param hypotheses: a dictionary of hypotheses
+    :param lattices: a dictionary of lattices
+    :param candidate: the candidate search, one of SEARCH_ENGINES
+    :param legacy: the search the candidate has to agree with
+    :param statistics: also classify the new hypotheses of both searches like total_error_statistics.py
+    :return: a list of a row for every search, with the hypotheses, costs, times and outcome
+    """
+    rows = []
+    for utt_id in sorted(lattices):
+        reference = references[utt_id].split()
+        hypothesis = hypotheses[utt_id].split()
+        if reference == hypothesis:
+            continue
+        mismatch, correct_start = find_correct_start(reference, hypothesis)
+        if len(correct_start) == 0:
+            continue
+
+        legacy_hypothesis, legacy_time = timed_search(correct_start, lattices[utt_id], legacy)
+        candidate_hypothesis, candidate_time = timed_search(correct_start, lattices[utt_id], candidate)
+
+        graph, start, end = init_graph(lattices[utt_id])
+        try:
+            legacy_cost = None if legacy_hypothesis is None else word_sequence_cost(graph, start, end,
+                                                                                    legacy_hypothesis.split())
+            candidate_cost = None if candidate_hypothesis is None else word_sequence_cost(graph, start, end,
+                                                                                          candidate_hypothesis.split())
+        except CyclicLatticeError:
+            # every search falls back to dfs on a lattice with a cycle, so only the words are compared
+            legacy_cost = candidate_cost = None
+        row = {'utt_id': utt_id, 'outcome': compare_outcome(legacy_hypothesis, candidate_hypothesis, legacy_cost,
+                                                            candidate_cost),
+               'legacy_hypothesis': legacy_hypothesis, 'candidate_hypothesis': candidate_hypothesis,
+               'legacy_cost': legacy_cost, 'candidate_cost': candidate_cost,
+               'legacy_time': legacy_time, 'candidate_time': candidate_time}
+        if statistics:
+            candidate_statistics = statistics_of(classification_of(references[utt_id], hypotheses[utt_id],
+                                                                   candidate_hypothesis or hypotheses[utt_id]))
+            legacy_statistics = legacy_statistics_of(references[utt_id], hypotheses[utt_id],
+                                                     legacy_hypothesis or hypotheses[utt_id])
+            # the new classifier on the hypothesis of the candidate against the legacy classifier on the legacy one,
+            # and the classifiers against each other on the hypothesis of the candidate
+            row['same_classification'] = candidate_statistics == legacy_statistics
+            row['classifiers_agree'] = candidate_statistics == legacy_statistics_of(
+                references[utt_id], hypotheses[utt_id], candidate_hypothesis or hypotheses[utt_id])
+        rows.append(row)
+    return rows
+
+
+def median(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def write_summary(out_file, candidate, legacy, rows):
+    outcomes = {outcome: 0 for outcome in OUTCOMES}
+    for row in rows:
+        outcomes[row['outcome']] += 1
+    legacy_time = sum(row['legacy_time'] for row in rows)
+    candidate_time = sum(row['candidate_time'] for row in rows)
+    cost_differences = [row['candidate_cost'] - row['legacy_cost'] for row in rows
+                        if row['outcome'] in ('candidate cheaper', 'legacy cheaper')]
+
+    out_file.write('# ' + candidate + ' against ' + legacy + ': ' + str(len(rows)) + ' searches\n')
+    for outcome in OUTCOMES:
+        out_file.write('#   ' + outcome + ': ' + str(outcomes[outcome]) + '\n')
+    if cost_differences:
+        out_file.write('#   cost differences of the mismatches, candidate - legacy: min %.4f, median %.4f, max %.4f\n'
+                       % (min(cost_differences), median(cost_differences), max(cost_differences)))
+    if 'same_classification' in (rows[0] if rows else {}):
+        out_file.write('#   classified differently: ' +
+                       str(sum(1 for row in rows if not row['same_classification'])) + '\n')
+        out_file.write('#   classified differently by the legacy classifier: ' +
+                       str(sum(1 for row in rows if not row['classifiers_agree'])) + '\n')
+    if candidate_time > 0:
+        out_file.write('#   time: legacy %.3f s, candidate %.3f s, speedup %.2f, median speedup per utterance %.2f\n'
+                       % (legacy_time, candidate_time, legacy_time / candidate_time,
+                          median([row['legacy_time'] / row['candidate_time'] for row in rows if row['candidate_time'] > 0])))
+
+
+def synthetic_lattice(rng, length, branch, words):
+    """
+    Creates a lattice of states in topological order, where every state has arcs to the next state and up to branch
+    arcs that skip ahead, some of them parallel arcs between the same two states and some of them epsilons
+    :return: the lines of a text FST
+    """
+    lines = []
+    for state in range(length):
+        destinations = [state + 1] + [rng.randint(state + 1, min(state + 3, length))
+                                      for alternative in range(rng.randint(0, branch))]
+        for destination in destinations:
+            for parallel in range(2 if rng.random() < 0.3 else 1):
+                word = '<eps>' if rng.random() < 0.1 else rng.choice(words)
+                lines.append('%d %d %s %.4f,%.4f,' % (state, destination, word, rng.uniform(-2, 8), rng.uniform(0, 5)))
+    lines.append(str(length))
+    return lines
+
+
+def random_path(rng, lattice):
+    """
+    :return: the words of a path through the lattice that takes a random arc out of every state
+    """
+    graph, start, end = init_graph(lattice)
+    state = start
+    words = []
+    while state != end:
+        edge = rng.choice([edge for edge in graph[state] if edge[0] != state])
+        if not is_epsilon(edge[2]):
+            words.append(edge[2])
+        state = edge[0]
+    return words
+
+
+def synthetic_corpus(number_of_utterances, seed=0, max_length=12, branch=3, number_of_words=DEFAULT_SYNTHETIC_WORDS):
+    """
+    Creates lattices with a random path through each as the hypothesis, and a reference with a few words
+    of the hypothesis substituted, deleted or inserted. The vocabulary is small so many paths share a correct start
+    :return: dictionaries of the references, hypotheses and lattices
+    """
+    rng = random.Random(seed)
+    words = ['w' + str(i) for i in range(number_of_words)]
+    references = {}
+    hypotheses = {}
+    lattices = {}
+    for utterance in range(number_of_utterances):
+        utt_id = 'synthetic%06d' % utterance
+        lattice = synthetic_lattice(rng, rng.randint(2, max_length), branch, words)
+        hypothesis = random_path(rng, lattice)
+        reference = list(hypothesis)
+        for edit in range(rng.randint(0, 3)):
+            position = rng.randrange(len(reference) + 1)
+            operation = rng.random()
+            if operation < 0.6 and position < len(reference):
+                reference[position] = rng.choice(words)
+            elif operation < 0.8 and position < len(reference):
+                reference.pop(position)
+            else:
+                reference.insert(position, rng.choice(words))
+        references[utt_id] = ' '.join(reference)
+        hypotheses[utt_id] = ' '.join(hypothesis)
+        lattices[utt_id] = lattice
+    return references, hypotheses, lattices
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the new hypotheses of a candidate search with the legacy search',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('r', type=argparse.FileType('r'), nargs='?', default=None, help='Reference file')
+    parser.add_argument('w', type=str, nargs='?', default=None,
+                        help='Kaldi word lattice file or OR a directory of archives of word lattices')
+    parser.add_argument('-c', '--candidates', type=str, nargs='+', default=['dfs', 'astar'], choices=SEARCH_ENGINES,
+                        help='The searches to compare with the legacy search')
+    parser.add_argument('--legacy', type=str, default=LEGACY_ENGINE, choices=(LEGACY_ENGINE,) + tuple(SEARCH_ENGINES),
+                        help='The search the candidates have to agree with, legacy is the frozen search of legacy.py')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='Compare on this many synthetic lattices instead of a reference file and lattices')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic lattices')
+    parser.add_argument('--max-length', type=int, default=12, help='Maximum number of words of a synthetic lattice')
+    parser.add_argument('--branch', type=int, default=3,
+                        help='Maximum number of arcs that skip ahead from a state of a synthetic lattice')
+    parser.add_argument('--words', type=int, default=DEFAULT_SYNTHETIC_WORDS,
+                        help='Number of words in the vocabulary of the synthetic lattices')
+    parser.add_argument('--statistics', action='store_true',
+                        help='Also check that the new hypotheses are classified the same by total_error_statistics.py '
+                             'as by the legacy error analysis of legacy.py')
+    parser.add_argument('--allow-cheaper', action='store_true',
+                        help='Do not fail on a candidate that finds a cheaper path than the legacy search')
+    parser.add_argument('-o', type=str, default=None,
+                        help='Output directory for a JSON Lines file of every search that did not give the same '
+                             'hypothesis, per candidate')
+
+    return parser.parse_args()
+
+
+def main():
+    # Runs the legacy search and every candidate on the same utterances and writes a summary per candidate:
+    # how many hypotheses are the same, ties of the same cost, mismatches where either search found the cheaper path,
+    # and the speedup. Exits with status 1 if a candidate gives a different hypothesis that is not a tie, or with
+    # --allow-cheaper a path that is not as cheap
+
+    args = parse_args()
+    if args.synthetic > 0:
+        references, hypotheses, lattices = synthetic_corpus(args.synthetic, args.seed, args.max_length, args.branch,
+                                                             args.words)
+    elif args.r is not None and args.w is not None:
+        references, hypotheses, error_details = init_references(args.r)
+        lattices = init_lattices_with_n_errors(args.w, references)
+    else:
+        raise ValueError('Give a reference file and lattices, or --synthetic')
+
+    if args.o is not None:
+        try:
+            os.mkdir(args.o)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    equivalent = True
+    for candidate in args.candidates:
+        rows = compare_engines(references, hypotheses, lattices, candidate, args.legacy, args.statistics)
+        write_summary(sys.stdout, candidate, args.legacy, rows)
+        mismatches = [row for row in rows if row['outcome'] != 'same']
+        if args.o is not None:
+            write_jsonl(os.path.join(args.o, 'mismatches-' + candidate + '.jsonl'), mismatches)
+        accepted = ('tie', 'candidate cheaper') if args.allow_cheaper else ('tie',)
+        if any(row['outcome'] not in accepted for row in mismatches):
+            equivalent = False
+    sys.exit(0 if equivalent else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import heapq
+
+DEFAULT_CAPACITY = 1000
+
+
+class SpaceSaving:
+    """
+    Counts the most frequent items of a stream in fixed memory with the Space-Saving algorithm. At most capacity
+    items are counted, a new item replaces the least frequent one and takes over its count, which is kept as the
+    error of the new item, so a count is never below the true count and at most error above it. The counts are
+    exact as long as there are no more distinct items than the capacity
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # (count, item) of the counted items, with outdated entries that are skipped when the minimum is taken
+        self.heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def push(self, item):
+        heapq.heappush(self.heap, (self.counts[item], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def pop_least_frequent(self):
+        while True:
+            count, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:
+                del self.counts[item]
+                return item, count, self.errors.pop(item)
+
+    def minimum(self):
+        """
+        :return: the smallest count, an upper bound of the count of every item that is not counted,
+                 0 while the sketch is not full
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        while self.counts.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0]
+
+    def add(self, item, count=1):
+        """
+        :param item: a hashable item, e.g. a word
+        :param count: the number of times the item was seen, negative to remove an item that was added before.
+                      An item that is no longer counted can not be removed, and an item is dropped when its count
+                      reaches 0
+        """
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            if self.counts[item] <= 0:
+                del self.counts[item]
+                del self.errors[item]
+            else:
+                self.push(item)
+        elif count > 0:
+            error = 0
+            if len(self.counts) >= self.capacity:
+                # the new item may have been seen as often as the item it replaces
+                replaced, error, replaced_error = self.pop_least_frequent()
+            self.counts[item] = error + count
+            self.errors[item] = error
+            self.push(item)
+
+    def merge(self, other):
+        """
+        Adds the counts of another sketch, e.g. of another shard. An item counted by only one of the sketches
+        may have been seen up to the minimum count of the other one, which is added to its count and its error
+        :param other: a SpaceSaving
+        :return: this sketch
+        """
+        minimum = self.minimum()
+        other_minimum = other.minimum()
+        counts = {}
+        errors = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, minimum) + other.counts.get(item, other_minimum)
+            errors[item] = self.errors.get(item, minimum) + other.errors.get(item, other_minimum)
+
+        kept = heapq.nlargest(self.capacity, counts, key=lambda item: (counts[item], -errors[item]))
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        self.total += other.total
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+        return self
+
+    def top(self, number=None):
+        """
+        :param number: the number of items, all counted items if not given
+        :return: a list of the most frequent items with their count and its error, the most frequent first
+        """
+        items = sorted(self.counts, key=lambda item: (-self.counts[item], self.errors[item], str(item)))
+        if number is not None:
+            items = items[:number]
+        return [(item, self.counts[item], self.errors[item]) for item in items]
@@ -0,0 +1,235 @@
+import struct
+
+FST_MAGIC_NUMBER = 2125659606
+SYMBOL_TABLE_MAGIC_NUMBER = 2125658996
+COMPACT_LATTICE_ARC_TYPE = b'compactlattice44'
+BINARY_MARKER = b'\x00B'
+# header flags telling that symbol tables follow the header
+HAS_ISYMBOLS = 0x1
+HAS_OSYMBOLS = 0x2
+EPSILON = 0
+EPSILON_SYMBOL = '<eps>'
+# the longest utterance id expected when looking for the binary marker at the start of an archive
+MAX_KEY_LENGTH = 1024
+
+INT32 = struct.Struct('<i')
+INT64 = struct.Struct('<q')
+# version, flags, properties, start, number of states and number of arcs
+FST_HEADER = struct.Struct('<iiQqqq')
+# value1 (graph cost), value2 (acoustic cost) and the length of the transition id string
+COMPACT_LATTICE_WEIGHT = struct.Struct('<ffi')
+# input label, output label and the weight of an arc
+COMPACT_LATTICE_ARC = struct.Struct('<iiffi')
+
+
+class CompactLattice:
+    """
+    A Kaldi CompactLattice read from a binary archive, the word ids are kept as labels
+    and the transition ids are dropped because the search does not need them
+    """
+    def __init__(self, start, arcs, finals):
+        # arcs[state] is a list of (next state, graph cost + acoustic cost, word)
+        self.start = start
+        self.arcs = arcs
+        self.finals = finals
+
+    def to_graph(self, vocabulary=None):
+        """
+        Creates the same graph init_graph creates from the printed text form of the lattice,
+        where the start state is printed first and a final state line replaces the arcs of the state
+        :param vocabulary: a Vocabulary to intern the words on the arcs with, as for init_graph
+        :return: the graph, the start state and the end state
+        """
+        graph = {}
+        start = -1
+        end = -1
+        order = [state for state in range(len(self.arcs)) if state != self.start]
+        if self.start >= 0:
+            order.insert(0, self.start)
+        for state in order:
+            if len(self.arcs[state]) != 0:
+                if vocabulary is None:
+                    graph[str(state)] = [(str(next_state), cost, word) for next_state, cost, word in self.arcs[state]]
+                else:
+                    graph[str(state)] = [(str(next_state), cost, vocabulary.intern(word))
+                                         for next_state, cost, word in self.arcs[state]]
+                if start == -1:
+                    start = str(state)
+            if self.finals[state]:
+                end = str(state)
+                graph[end] = [(end, 0.0)]
+        return graph, start, end
+
+    def size(self):
+        return sum(len(state_arcs) for state_arcs in self.arcs)
+
+    def __add__(self, other):
+        """
+        Joins the parts of a lattice split over archives, like the lines of the parts of a text FST are joined.
+        The states of both parts are the same states, so the arcs of a state are the arcs of both parts and
+        a state is final if it is final in either part. Neither part is changed
+        :param other: a CompactLattice, or the lines of a text FST which this lattice is printed in front of
+        :return: a new CompactLattice, or a new list of lines
+        """
+        if isinstance(other, list):
+            return self.to_text_lines() + other
+        if not isinstance(other, CompactLattice):
+            return NotImplemented
+        number_of_states = max(len(self.arcs), len(other.arcs))
+        arcs = [[] for state in range(number_of_states)]
+        finals = [False] * number_of_states
+        for part in (self, other):
+            for state in range(len(part.arcs)):
+                arcs[state] += part.arcs[state]
+                finals[state] = finals[state] or part.finals[state]
+        return CompactLattice(self.start if self.start >= 0 else other.start, arcs, finals)
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + self.to_text_lines()
+        return NotImplemented
+
+    def to_text_lines(self):
+        """
+        Prints the lattice as the lines of a text FST that init_graph reads into the same graph as to_graph creates,
+        the cost of an arc is printed as its acoustic cost and the transition ids are left out
+        :return: a list of lines
+        """
+        lines = []
+        order = [state for state in range(len(self.arcs)) if state != self.start]
+        if self.start >= 0:
+            order.insert(0, self.start)
+        for state in order:
+            for next_state, cost, word in self.arcs[state]:
+                lines.append(str(state) + ' ' + str(next_state) + ' ' + word + ' ' + repr(cost) + ',0,')
+            if self.finals[state]:
+                lines.append(str(state))
+        return lines
+
+
+def read_symbol_table(filename):
+    """
+    Reads a Kaldi symbol table, e.g. words.txt
+    :param filename: a text file with a symbol and its integer id on each line
+    :return: a dictionary from id to symbol
+    """
+    symbols = {}
+    with open(filename) as f:
+        for line in f:
+            info = line.split()
+            if len(info) == 2:
+                symbols[int(info[1])] = info[0]
+    return symbols
+
+
+def is_binary_archive(stream):
+    """
+    Checks if an archive starts with an utterance id followed by the Kaldi binary marker
+    :param stream: a buffered binary stream that supports peek
+    :return: True if the archive is a binary archive
+    """
+    head = stream.peek(MAX_KEY_LENGTH)[:MAX_KEY_LENGTH]
+    key_end = head.find(b' ')
+    if key_end <= 0 or b'\n' in head[:key_end]:
+        return False
+    return head[key_end + 1:key_end + 3] == BINARY_MARKER
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError('Unexpected end of a binary lattice archive')
+    return data
+
+
+def read_string(stream):
+    length = INT32.unpack(read_exactly(stream, INT32.size))[0]
+    return read_exactly(stream, length)
+
+
+def skip_symbol_table(stream):
+    if INT32.unpack(read_exactly(stream, INT32.size))[0] != SYMBOL_TABLE_MAGIC_NUMBER:
+        raise ValueError('Bad symbol table in a binary lattice archive')
+    read_string(stream)
+    available_key, size = struct.unpack('<qq', read_exactly(stream, 16))
+    for i in range(size):
+        read_string(stream)
+        read_exactly(stream, INT64.size)
+
+
+def read_key(stream):
+    """
+    Reads the utterance id of the next entry in the archive
+    :return: the utterance id, or None at the end of the archive
+    """
+    key = bytearray()
+    while True:
+        c = stream.read(1)
+        if len(c) == 0:
+            if len(key.strip()) != 0:
+                raise EOFError('Unexpected end of a binary lattice archive')
+            return None
+        if c == b' ':
+            if len(key.strip()) != 0:
+                return key.strip().decode()
+        else:
+            key += c
+
+
+def read_compact_lattice(stream, word_symbols=None):
+    """
+    Reads a single CompactLattice written in OpenFst binary format
+    :param stream: a binary stream positioned at the start of the FST header
+    :param word_symbols: a dictionary from word id to word, the ids are used as words if not given
+    :return: a CompactLattice
+    """
+    if INT32.unpack(read_exactly(stream, INT32.size))[0] != FST_MAGIC_NUMBER:
+        raise ValueError('Bad FST header in a binary lattice archive')
+    read_string(stream)
+    arc_type = read_string(stream)
+    if arc_type != COMPACT_LATTICE_ARC_TYPE:
+        raise ValueError('Only compact lattices can be read, got arc type ' + arc_type.decode())
+    version, flags, properties, start, number_of_states, number_of_arcs = FST_HEADER.unpack(
+        read_exactly(stream, FST_HEADER.size))
+    if flags & HAS_ISYMBOLS:
+        skip_symbol_table(stream)
+    if flags & HAS_OSYMBOLS:
+        skip_symbol_table(stream)
+
+    words = {EPSILON: EPSILON_SYMBOL}
+    arcs = []
+    finals = []
+    for state in range(number_of_states):
+        graph_cost, acoustic_cost, string_length = COMPACT_LATTICE_WEIGHT.unpack(
+            read_exactly(stream, COMPACT_LATTICE_WEIGHT.size))
+        # the transition ids of the final weight are not needed, skip them with the arc count
+        arc_count = INT64.unpack(read_exactly(stream, 4 * string_length + INT64.size)[-INT64.size:])[0]
+        finals.append(graph_cost != float('inf'))
+
+        state_arcs = []
+        for i in range(arc_count):
+            word_id, output_id, graph_cost, acoustic_cost, string_length = COMPACT_LATTICE_ARC.unpack(
+                read_exactly(stream, COMPACT_LATTICE_ARC.size))
+            next_state = INT32.unpack(read_exactly(stream, 4 * string_length + INT32.size)[-INT32.size:])[0]
+            if word_id not in words:
+                words[word_id] = word_symbols.get(word_id, str(word_id)) if word_symbols is not None else str(word_id)
+            state_arcs.append((next_state, acoustic_cost + graph_cost, words[word_id]))
+        arcs.append(state_arcs)
+
+    return CompactLattice(start, arcs, finals)
+
+
+def read_compact_lattices(stream, word_symbols=None):
+    """
+    Iterates over the lattices in a Kaldi binary lattice archive
+    :param stream: a binary stream over the archive
+    :param word_symbols: a dictionary from word id to word, the ids are used as words if not given
+    :return: a generator of utterance ids and their CompactLattice
+    """
+    while True:
+        utt_id = read_key(stream)
+        if utt_id is None:
+            return
+        if read_exactly(stream, len(BINARY_MARKER)) != BINARY_MARKER:
+            raise ValueError('Only binary lattice archives can be read, ' + utt_id + ' is not binary')
+        yield utt_id, read_compact_lattice(stream, word_symbols)
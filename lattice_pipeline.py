@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+DEFAULT_QUEUE_SIZE = 64
+
+
+class PipelineStatistics:
+    def __init__(self):
+        self.archives_read = 0
+        self.blocks_read = 0
+        self.blocks_searched = 0
+
+        # sampled every time the search takes a block from the queue
+        self.queue_depth_samples = 0
+        self.queue_depth_total = 0
+        self.max_queue_depth = 0
+
+        # time the readers waited on a full queue, the search is the bottleneck
+        self.reader_stall_time = 0.0
+        # time the search waited on an empty queue, reading is the bottleneck
+        self.search_stall_time = 0.0
+
+        self.start_time = None
+        self.end_time = None
+
+    def average_queue_depth(self):
+        if self.queue_depth_samples == 0:
+            return 0.0
+        return self.queue_depth_total / self.queue_depth_samples
+
+    def bottleneck(self):
+        return 'I/O-bound' if self.search_stall_time > self.reader_stall_time else 'CPU-bound'
+
+    def write(self, out_file):
+        wall_time = (self.end_time or time.time()) - (self.start_time or time.time())
+        out_file.write('# archives read: ' + str(self.archives_read) + '\n')
+        out_file.write('# utterance blocks read: ' + str(self.blocks_read) + ', searched: ' + str(self.blocks_searched) + '\n')
+        out_file.write('# queue depth, average: ' + '{:.1f}'.format(self.average_queue_depth()) +
+                       ', max: ' + str(self.max_queue_depth) + '\n')
+        out_file.write('# readers stalled on a full queue: ' + '{:.2f}'.format(self.reader_stall_time) + 's\n')
+        out_file.write('# search stalled on an empty queue: ' + '{:.2f}'.format(self.search_stall_time) + 's\n')
+        out_file.write('# wall time: ' + '{:.2f}'.format(wall_time) + 's, ' + self.bottleneck() + '\n')
+
+
+class PrefetchPipeline:
+    """
+    Reads lattice archives on background reader threads and hands the lattices of each utterance
+    to the search through a bounded queue, so reading overlaps with searching. Every archive has its own queue
+    and the search takes the lattices in the order of the archives, whatever order the readers finish in, so the
+    parts of a lattice split over archives come in the same order as with a single reader
+    """
+    def __init__(self, archives, read_archive, readers=1, queue_size=DEFAULT_QUEUE_SIZE, keep=None):
+        """
+        :param archives: paths of the archives to read
+        :param read_archive: a function that takes an archive path and iterates over its utterance ids and lattices
+        :param readers: number of reader threads
+        :param queue_size: maximum number of utterance blocks of an archive waiting for the search, at most
+                           readers times this many are read ahead
+        :param keep: a function that takes an utterance id and tells if its lattice is needed, all are kept if not given
+        """
+        self.archives = archives
+        self.read_archive = read_archive
+        self.readers = max(1, readers)
+        self.queue_size = queue_size
+        self.keep = keep
+        self.statistics = PipelineStatistics()
+        self.lock = threading.Lock()
+
+    def read(self, archives, blocks):
+        # the archives are taken in order, so the archive the search waits on has always been taken by a reader
+        while True:
+            try:
+                index, archive = archives.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                for utt_id, lattice in self.read_archive(archive):
+                    if self.keep is not None and not self.keep(utt_id):
+                        continue
+                    start = time.time()
+                    blocks[index].put((utt_id, lattice))
+                    with self.lock:
+                        self.statistics.reader_stall_time += time.time() - start
+                        self.statistics.blocks_read += 1
+                with self.lock:
+                    self.statistics.archives_read += 1
+                blocks[index].put(None)
+            except Exception as exc:
+                blocks[index].put(exc)
+
+    def __iter__(self):
+        archives = queue.Queue()
+        blocks = []
+        for index, archive in enumerate(self.archives):
+            archives.put((index, archive))
+            blocks.append(queue.Queue(maxsize=self.queue_size))
+
+        self.statistics.start_time = time.time()
+        for i in range(min(self.readers, len(blocks))):
+            threading.Thread(target=self.read, args=(archives, blocks), daemon=True).start()
+
+        for archive_blocks in blocks:
+            while True:
+                depth = archive_blocks.qsize()
+                start = time.time()
+                block = archive_blocks.get()
+                self.statistics.search_stall_time += time.time() - start
+                if block is None:
+                    break
+                if isinstance(block, Exception):
+                    raise block
+
+                self.statistics.queue_depth_samples += 1
+                self.statistics.queue_depth_total += depth
+                self.statistics.max_queue_depth = max(self.statistics.max_queue_depth, depth)
+                self.statistics.blocks_searched += 1
+                yield block
+        self.statistics.end_time = time.time()
+
+
+def map_tasks(function, tasks, workers=0, max_in_flight=DEFAULT_QUEUE_SIZE):
+    """
+    Applies a function to every task, on worker processes if workers is larger than 0. At most max_in_flight
+    tasks are taken from the task iterator before their results are returned, so a bounded task source
+    stays bounded. The results are returned in the order they finish
+    :param function: a picklable function of a single task
+    :param tasks: an iterator of picklable tasks
+    :param workers: number of worker processes, 0 applies the function in this process
+    :param max_in_flight: maximum number of tasks submitted to the workers at the same time
+    :return: a generator of results
+    """
+    if workers <= 0:
+        for task in tasks:
+            yield function(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for task in tasks:
+            in_flight.add(executor.submit(function, task))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in in_flight:
+            yield future.result()
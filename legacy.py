@@ -0,0 +1,489 @@
+# A frozen copy of the search of best_path.py and the error analysis of total_error_statistics.py as they were before
+# the faster engines and classifiers were added. The equivalence harness runs the new code against it, so it must not
+# be changed, only what the harness needs to call it is added at the end
+INF = float('Inf')
+
+
+class GraphStatistics:
+    def __init__(self):
+        self.correct_paths = {}
+        self.correct_path_words = []
+        self.correction_not_in_fst = {}
+        self.new_hyp = {}
+        self.old_hyp = {}
+
+    def add_to_correct_paths(self, cost, path, edge):
+        new_path = path + [edge]
+        self.correct_paths[edge] = (new_path, cost)
+
+
+def init_graph(lattice):
+    graph = {}
+    start = -1
+    end = -1
+    is_start = True
+    for line in lattice:
+        info = line.split()
+        if len(info) == 4:
+            _start_state, _end_state, word, transition_id = info
+            acoustic_cost, graph_cost, ids = transition_id.split(',')
+            acoustic_cost = float(acoustic_cost)
+            graph_cost = float(graph_cost)
+            if _start_state in graph:
+                graph[_start_state].append((_end_state, acoustic_cost + graph_cost, str(word)))
+            else:
+                graph[_start_state] = [(_end_state, acoustic_cost + graph_cost, str(word))]
+
+            if is_start:
+                start = _start_state
+                is_start = False
+        else:
+            # at the end state
+            end = info[0]
+            graph[info[0]] = [(info[0], 0.0)]
+
+    return graph, start, end
+
+
+def find_best_path(hypothesis, lattice, reference):
+    graph, start, end = init_graph(lattice)
+
+    graph_info = GraphStatistics()
+
+    mismatch, correct_start = find_correct_start(reference.split(), hypothesis.split())
+
+    if len(correct_start) != 0:
+        find_path_with_correct_start(correct_start, graph, start, end, graph_info, '', 0.0)
+        new_hypothesis = construct_new_hypothesis(hypothesis, graph, end, graph_info, correct_start)
+    else:
+        new_hypothesis = hypothesis
+
+    return new_hypothesis
+
+
+def construct_new_hypothesis(hypothesis, graph, end, graph_info, correct_start):
+    if len(graph_info.correct_paths) == 0:
+        return hypothesis
+    else:
+        hypothesized_end = find_shortest_paths_among_possible_paths(graph_info.correct_paths, graph, end)
+        new_hypothesis = ''
+        for word in correct_start:
+            new_hypothesis += word if len(new_hypothesis) == 0 else ' ' + word
+        new_hypothesis += ' ' + hypothesized_end
+        return new_hypothesis
+
+
+def find_shortest_paths_among_possible_paths(paths, graph, end):
+    shortest_path = []
+    shortest_path_cost = INF
+    shortest_path_start_state = '0'
+    for edge in paths:
+        distance, came_from = bellman_ford_search(graph, edge)
+        path_cost = paths[edge][1] + distance[end]
+
+        if path_cost < shortest_path_cost:
+            shortest_path_cost = path_cost
+            shortest_path = came_from
+            shortest_path_start_state = edge
+    best_path, test_new_hypothesis = reconstruct_path(shortest_path, shortest_path_start_state, end, graph)
+    return test_new_hypothesis
+
+
+def find_path_with_correct_start(correct_start, graph, start, end, graph_info, words_so_far, cost_so_far, path=[],
+                                 words='', cost=0.0):
+    tmp_path = path + [start]
+    words += words_so_far
+    cost += cost_so_far
+    if start == end:
+        return [tmp_path], words, cost
+    if start not in graph:
+        return [], '', 0.0
+    paths = []
+    words_arr = ''
+    total_cost = 0.0
+    for node in graph[start]:
+        if node[0] not in tmp_path:
+            # if node is not in the path find all paths from the node to the end state
+            path_words = '' if node[2] == '<eps>' else ' ' + node[2]
+            tmp_words = words + path_words
+            words_so_far = tmp_words.split()
+
+            path_cost = node[1]
+            cost_so_far = cost + path_cost
+
+            if correct_start == words_so_far:
+                graph_info.add_to_correct_paths(cost_so_far, tmp_path, node[0])
+                graph_info.correct_path_words = words_so_far
+                continue
+            if correct_start[:len(words_so_far)] != words_so_far:
+                continue
+            else:
+                path = tmp_path
+
+            new_paths, words_arr, total_cost = find_path_with_correct_start(correct_start, graph, node[0], end,
+                                                                            graph_info, path_words, path_cost, path,
+                                                                            words, cost)
+
+            for newpath in new_paths:
+                paths.append(newpath)
+
+    return paths, words_arr, total_cost
+
+
+def find_correct_utterance_start(reference, mismatch):
+    # remove all hypothesis from n best list that don't match that beginning plus the next word
+    if len(reference) >= mismatch[0]:
+        correct_start = reference[:mismatch[0] + 1]
+    else:
+        correct_start = reference[:mismatch[0]]
+    return correct_start
+
+
+def find_correct_start(reference, hypothesis):
+    mismatch = (0, '')
+    correct_start = reference
+    for i, word in zip(range(len(reference)), reference):
+        if len(hypothesis) >= i + 1 and word != hypothesis[i]:
+            # the words do not match
+            mismatch = (i, word)
+            correct_start = find_correct_utterance_start(reference, mismatch)
+            break
+        elif len(hypothesis) < i + 1 and reference[:len(hypothesis)] == hypothesis:
+            # the hypothesis is shorter than the reference, and everything matches up to the end
+            # so the correct beginning is the hypothesis plus one
+            mismatch = (i, reference[i])
+            correct_start = reference[:len(hypothesis) + 1]
+            break
+    # if the hypothesis is longer than the reference,
+    # and no error has been detected up to the end, the reference is returned
+    return mismatch, correct_start
+
+
+def get_utterance_words(path, graph):
+    words = ''
+    for i in range(0, len(path)):
+        if path[i] == path[-1]:
+            break
+        else:
+            start_state = path[i]
+            end_state = path[i + 1]
+            count = 0
+            for edge in graph[start_state]:
+                if edge[0] == end_state:
+                    count += 1
+                    # This is possible because the states are ordered
+                    # So if two or more states are identical the first state
+                    # in the graph file is always the state with the lowest cost
+                    if edge[2] != '<eps>' and count < 2:
+                        words += edge[2] if len(words) == 0 else ' ' + edge[2]
+    return words
+
+
+def reconstruct_path(came_from, start, goal, graph):
+    path = []
+    current = goal
+    while current != start and current is not None:
+        path.append(current)
+        current = came_from[current]
+    path.append(start)
+    path.reverse()
+    words = get_utterance_words(path, graph)
+    return path, words
+
+
+def bellman_ford_search(graph, start):
+    distance = {}
+    predecessor = {}
+
+    # Initialize the graph
+    for node in graph:
+        # all vertices have a weight of infinity except the first node
+        distance[node] = 0 if node == start else INF
+        predecessor[node] = None
+
+    # Relax edges repeatedly, n-1 times
+    for i in range(len(graph)):
+        if str(i) in graph:
+            node = graph[str(i)]
+            for edge in node:
+                # Apply Ford's rule (relax) if possible
+                weight = edge[1]
+                if distance[str(i)] + weight < distance[edge[0]]:
+                    distance[edge[0]] = distance[str(i)] + weight
+                    predecessor[edge[0]] = str(i)
+
+    return distance, predecessor
+
+
+class ErrorAnalysisStatistics:
+    def __init__(self):
+        self.number_of_utterances_per_error = {}
+
+        self.number_of_correction_not_contained_in_lattice = {}
+
+        self.utterance_average_length = {'total': 0}
+
+        self.utterances_per_error = {}
+
+        self.all_errors_fixed_in_utterances_per_error = {}
+        self.next_error_fixed_in_utt_per_error = {}
+        self.next_error_NOT_fixed_in_utt_per_error = {}
+        self.new_errors_added_in_utt_per_error = {}
+        self.n_errors_fixed_in_utt_per_error = {}
+        self.n_errors_NOT_fixed_in_utt_per_error = {}
+
+        self.next_error_fixed_no_new_errors = {}
+        self.next_error_fixed_no_new_errors_no_errors = {}
+
+        self.next_error_fixed_new_errors = {}
+        self.next_error_fixed_new_errors_no_errors = {}
+
+        self.next_error_not_fixed_no_new_errors = {}
+        self.next_error_not_fixed_no_new_errors_no_errors = {}
+
+        self.next_error_not_fixed_new_errors = {}
+        self.next_error_not_fixed_new_errors_no_errors = {}
+
+        self.n_errors_fixed_no_new_errors = {}
+        self.n_errors_fixed_no_new_errors_no_errors = {}
+
+        self.n_errors_fixed_new_errors = {}
+        self.n_errors_fixed_new_errors_no_errors = {}
+
+        self.n_errors_not_fixed_no_new_errors = {}
+        self.n_errors_not_fixed_no_new_errors_no_errors = {}
+
+        self.n_errors_not_fixed_new_errors = {}
+        self.n_errors_not_fixed_new_errors_no_errors = {}
+
+        self.number_of_errors_added_before_second_error = {}
+
+        self.words_not_in_lattice = {}
+
+        self.words_next_error_not_fixed = {}
+        self.words_next_error_not_fixed_arr = []
+
+
+def are_n_error_fixed(new_error_details, old_error_details):
+    # check if every error in the old error details are fixed
+    number_of_errors_not_fixed = 0
+    for old_error in old_error_details:
+        for new_error in new_error_details:
+            if new_error_details[new_error] == old_error_details[old_error]:
+                number_of_errors_not_fixed += 1
+                break
+    return True if number_of_errors_not_fixed == 0 else False
+
+
+def is_next_error_fixed(new_error_details, next_error):
+    for error in new_error_details:
+        if new_error_details[error] == next_error:
+            return False
+    return True
+
+
+def new_errors_added(new_error_details, old_error_details):
+    if len(new_error_details) > len(old_error_details):
+        return True
+    elif new_error_details == old_error_details:
+        return False
+
+    for new_error in new_error_details:
+        is_new_error = True
+        for old_error in old_error_details:
+            if new_error_details[new_error] == old_error_details[old_error]:
+                is_new_error = False
+                break
+        if is_new_error:
+            # it is enough that one new error is added
+            return True
+    return False
+
+
+def add_error(error_type, error, error_cnt_stats=None, error_cnt=0):
+    if error not in error_type:
+        error_type[error] = 1
+    else:
+        error_type[error] += 1
+
+    if error_cnt_stats is not None:
+        if error not in error_cnt_stats:
+            error_cnt_stats[error] = error_cnt
+        else:
+            error_cnt_stats[error] += error_cnt
+
+
+def error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details):
+    for error in error_stats.utterances_per_error:
+        for utt_id in error_stats.utterances_per_error[error]:
+
+            ref_arr = error_stats.utterances_per_error[error][utt_id].split()
+            new_hyp_arr = new_hypotheses[utt_id].split()
+            hyp_arr = hypotheses[utt_id].split()
+
+            new_hyp_error_cnt = len(new_error_details[utt_id])
+
+            # count all errors fixed
+            if ref_arr == new_hyp_arr:
+                add_error(error_stats.all_errors_fixed_in_utterances_per_error, error)
+
+            # only check if the hypothesis was changed
+            if ref_arr == new_hyp_arr and error > 1:
+                add_error(error_stats.next_error_fixed_in_utt_per_error, error)
+
+                add_error(error_stats.next_error_fixed_no_new_errors, error, error_stats.next_error_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
+
+                add_error(error_stats.n_errors_fixed_in_utt_per_error, error)
+
+                add_error(error_stats.n_errors_fixed_no_new_errors, error, error_stats.n_errors_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
+
+            elif new_hyp_arr != hyp_arr:
+                old_error_details[utt_id].pop(0, None)
+                has_new_error = new_errors_added(new_error_details[utt_id], old_error_details[utt_id])
+                if error > 1:
+                    next_error_in_hyp = old_error_details[utt_id][1]
+                    next_error_fixed = is_next_error_fixed(new_error_details[utt_id], next_error_in_hyp)
+                    if error > 2:
+                        n_errors_fixed = are_n_error_fixed(new_error_details[utt_id], old_error_details[utt_id])
+                    else:
+                        n_errors_fixed = True if next_error_fixed else False
+
+                    # count is next error fixed
+                    if next_error_fixed:
+                        add_error(error_stats.next_error_fixed_in_utt_per_error, error)
+                        # check if other errors are added
+                        if has_new_error:
+                            add_error(error_stats.next_error_fixed_new_errors, error, error_stats.next_error_fixed_new_errors_no_errors, new_hyp_error_cnt)
+                        else:
+                            add_error(error_stats.next_error_fixed_no_new_errors, error, error_stats.next_error_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
+                    else:
+                        add_error(error_stats.next_error_NOT_fixed_in_utt_per_error, error)
+
+                        # check if other errors are added
+                        if has_new_error:
+                            add_error(error_stats.next_error_not_fixed_new_errors, error, error_stats.next_error_not_fixed_new_errors_no_errors, new_hyp_error_cnt)
+                        else:
+                            add_error(error_stats.next_error_not_fixed_no_new_errors, error, error_stats.next_error_not_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
+
+                        # obtain the word at the error index in the reference that is not fixed
+                        # if the reference is shorter than the error index, There is an insertion error at the end
+                        if len(ref_arr)-1 >= next_error_in_hyp[1]:
+                            error_stats.words_next_error_not_fixed_arr.append(ref_arr[next_error_in_hyp[1]])
+
+                    # count if n errors are fixed
+                    if n_errors_fixed:
+                        add_error(error_stats.n_errors_fixed_in_utt_per_error, error)
+                        # check if others were added
+                        if has_new_error:
+                            add_error(error_stats.n_errors_fixed_new_errors, error, error_stats.n_errors_fixed_new_errors_no_errors, new_hyp_error_cnt)
+                        else:
+                            add_error(error_stats.n_errors_fixed_no_new_errors, error, error_stats.n_errors_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
+                    else:
+                        add_error(error_stats.n_errors_NOT_fixed_in_utt_per_error, error)
+                        # check if others were added
+                        if has_new_error:
+                            add_error(error_stats.n_errors_not_fixed_new_errors, error, error_stats.n_errors_not_fixed_new_errors_no_errors, new_hyp_error_cnt)
+                        else:
+                            add_error(error_stats.n_errors_not_fixed_no_new_errors, error, error_stats.n_errors_not_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
+
+                if error > 1:
+                    if check_if_error_added_before_next(new_error_details[utt_id], old_error_details[utt_id]):
+                        add_error(error_stats.number_of_errors_added_before_second_error, error)
+
+                # count if new errors are added
+                compute_new_errors_added_stats(old_error_details[utt_id], new_error_details[utt_id], has_new_error, error_stats, error)
+            elif new_hyp_arr == hyp_arr and ref_arr != hyp_arr:
+                add_error(error_stats.number_of_correction_not_contained_in_lattice, error)
+                # create a list of the words not presented in the lattices
+                mismatch = find_mismatch(ref_arr, hyp_arr)
+                if mismatch[1] not in error_stats.words_not_in_lattice:
+                    error_stats.words_not_in_lattice[mismatch[1]] = 1
+                else:
+                    error_stats.words_not_in_lattice[mismatch[1]] += 1
+
+
+def check_if_error_added_before_next(new_errors, old_errors):
+    first_old_error = old_errors[1][1]
+    for error in new_errors:
+        if new_errors[error][1] < first_old_error:
+            return True
+    return False
+
+
+def find_mismatch(reference, hypothesis):
+    # find_correct_start of total_error_statistics.py
+    mismatch = (0, '')
+    for i, word in zip(range(len(reference)), reference):
+        if len(hypothesis) >= i + 1 and word != hypothesis[i]:
+            # the words do not match
+            mismatch = (i, word)
+        elif len(hypothesis) < i + 1 and reference[:len(hypothesis)] == hypothesis:
+            # the hypothesis is shorter than the reference, and everything matches up to the end
+            # so the correct beginning is the hypothesis plus one
+            mismatch = (i, reference[i])
+    # if the hypothesis is longer than the reference,
+    # and no error has been detected up to the end, the reference is returned
+    return mismatch
+
+
+def compute_new_errors_added_stats(old_error_details, new_error_details, has_new_error, error_stats, error):
+    if len(old_error_details) > len(new_error_details):
+        # if there are fewer errors in the new hyp, check if they are the same or if new were added
+        if has_new_error:
+            add_error(error_stats.new_errors_added_in_utt_per_error, error)
+    elif len(old_error_details) < len(new_error_details):
+        # if the error count in the new hyp is larger, new errors were definetely added
+        add_error(error_stats.new_errors_added_in_utt_per_error, error)
+    elif old_error_details != new_error_details:
+        # if the error count is the same, check if the errors are the same
+        add_error(error_stats.new_errors_added_in_utt_per_error, error)
+
+
+def error_details(ops, isNew=False):
+    """
+    The errors of an utterance as init_references of total_error_statistics.py read them from the op line
+    :param ops: the C, S, I and D operations of the alignment
+    :param isNew: the operations are of a new hypothesis
+    """
+    error_count = 0
+    error_type = {}
+    for i in range(len(ops)):
+        if ops[i] != 'C':
+            if not isNew and error_count >= 1 and error_type[0][0] == 'I':
+                # Only check for this if we are looking at the original errors
+                error_type[error_count] = [ops[i], i-1]
+            elif isNew:
+                # For easier comparison the new error starts at 1 not zero
+                error_type[error_count+1] = [ops[i], i]
+            else:
+                error_type[error_count] = [ops[i], i]
+            error_count += 1
+    return error_type
+
+
+def search_correct_start(correct_start, lattice):
+    """
+    Searches the lattice like find_best_path, for the harness
+    :return: the new hypothesis, None if no path starts with correct_start
+    """
+    graph, start, end = init_graph(lattice)
+    graph_info = GraphStatistics()
+    find_path_with_correct_start(correct_start, graph, start, end, graph_info, '', 0.0)
+    if len(graph_info.correct_paths) == 0:
+        return None
+    return construct_new_hypothesis(None, graph, end, graph_info, correct_start)
+
+
+def classify_utterance(reference, hypothesis, new_hypothesis, old_ops, new_ops):
+    """
+    Runs the error analysis on a single utterance, for the harness
+    :param old_ops: the operations of the alignment of the hypothesis to the reference
+    :param new_ops: the operations of the alignment of the new hypothesis to the reference
+    :return: the ErrorAnalysisStatistics of the utterance and its number of errors
+    """
+    error_stats = ErrorAnalysisStatistics()
+    error = len([op for op in old_ops if op != 'C'])
+    error_stats.utterances_per_error[error] = {'utt': reference}
+    error_analysis(error_stats, {'utt': new_hypothesis}, {'utt': hypothesis}, {'utt': error_details(old_ops)},
+                   {'utt': error_details(new_ops, True)})
+    return error_stats, error
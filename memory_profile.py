@@ -0,0 +1,85 @@
+import os
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_TOP_ALLOCATORS = 10
+MB = 1 << 20
+# allocations of the tracing itself are left out of the largest allocators
+IGNORED_ALLOCATORS = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>')
+
+
+def current_rss():
+    """
+    :return: the resident set size of this process in bytes, None where it can not be read
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """
+    :return: the peak resident set size of this process in bytes, None where it can not be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS and in kilobytes everywhere else
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def megabytes(size):
+    return 'n/a' if size is None else '%.1f MB' % (size / MB)
+
+
+class MemoryProfile:
+    """
+    Records the memory of the process after every stage of a run, the resident set size and, when tracing, the memory
+    allocated by Python at the end of the stage, its peak during the stage and the lines that allocated the most
+    """
+    def __init__(self, trace=True, top=DEFAULT_TOP_ALLOCATORS):
+        """
+        :param trace: trace the allocations with tracemalloc, which makes the run a lot slower
+        :param top: the number of largest allocators to keep for every stage
+        """
+        self.top = top
+        self.stages = []
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name):
+        """
+        Records the memory at the end of a stage
+        :param name: the name of the stage, e.g. lattices or search
+        """
+        record = {'stage': name, 'rss': current_rss(), 'peak_rss': peak_rss()}
+        if record['rss'] is not None and record['peak_rss'] is not None:
+            # the peak is only updated by the kernel now and then, it is never below the current size
+            record['peak_rss'] = max(record['rss'], record['peak_rss'])
+        if tracemalloc.is_tracing():
+            record['traced'], record['traced_peak'] = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, filename) for filename in IGNORED_ALLOCATORS])
+            record['allocators'] = [(str(statistic.traceback[0]), statistic.size, statistic.count)
+                                    for statistic in snapshot.statistics('lineno')[:self.top]]
+            # the peak of the next stage starts from what is allocated now
+            tracemalloc.reset_peak()
+        self.stages.append(record)
+
+    def write(self, out_file):
+        for record in self.stages:
+            line = '# memory after ' + record['stage'] + ': rss ' + megabytes(record['rss']) + \
+                   ', peak rss ' + megabytes(record['peak_rss'])
+            if 'traced' in record:
+                line += ', allocated ' + megabytes(record['traced']) + ', peak allocated in stage ' + \
+                        megabytes(record['traced_peak'])
+            out_file.write(line + '\n')
+            for allocator, size, count in record.get('allocators', []):
+                out_file.write('#   ' + megabytes(size) + ' in ' + str(count) + ' blocks: ' + allocator + '\n')
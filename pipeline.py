@@ -0,0 +1,177 @@
+import argparse
+import os
+import errno
+import sys
+import time
+
+from alignment import align_utterances, write_per_utt_file
+from best_path import SEARCH_ENGINES, LatticeIndex, SearchBudget, find_new_hypotheses, find_new_hypotheses_prefetched, \
+    needs_search, write_utterances_to_file
+from kaldi_lattice import read_symbol_table
+from result_cache import DEFAULT_CACHE_SIZE, ResultCache
+from structured_output import write_structured_results
+from total_error_statistics import ErrorAnalysisStatistics, create_classification_store, error_analysis, \
+    find_error_details, init_references, save_classification_store, sharded_error_analysis, structured_tables, \
+    write_error_stats_to_file
+from vocabulary import Vocabulary
+
+
+def find_all_new_hypotheses(references, hypotheses, lattice_file, search='dfs', word_symbols=None, readers=0, workers=0,
+                            vocabulary=None, cache=None, budget=None):
+    """
+    Finds a new hypothesis for every utterance, the hypothesis is kept for the utterances without a lattice
+    :return: the new hypotheses and the new hypotheses the method was applied to
+    """
+    if readers > 0:
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses_prefetched(
+            references, hypotheses, lattice_file, search, word_symbols, True, readers, workers, out_file=sys.stdout,
+            vocabulary=vocabulary, cache=cache, budget=budget)
+    else:
+        lattices = LatticeIndex(lattice_file, word_symbols, references, needs_search(references, hypotheses))
+        new_hypotheses, applied_to_new, applied_to_old = find_new_hypotheses(references, hypotheses, lattices, search,
+                                                                             vocabulary, cache, budget)
+
+    for utt_id in references:
+        if utt_id not in new_hypotheses:
+            new_hypotheses[utt_id] = hypotheses[utt_id]
+    return new_hypotheses, applied_to_new
+
+
+def run(reference_file, lattice_file, search='dfs', word_symbols=None, readers=0, workers=0, jobs=1, cache=None,
+        budget=None):
+    """
+    Finds the new hypotheses, aligns them to the references and runs the error analysis, without writing
+    and reading the intermediate files between best_path.py, the scorer and total_error_statistics.py
+    :param reference_file: perutt file of the references and the original hypotheses
+    :param lattice_file: a lattice file or a directory of lattice archives, as for best_path.py
+    :param cache: a ResultCache of earlier searches
+    :param budget: a SearchBudget of the search of every utterance
+    :return: the ErrorAnalysisStatistics, the classification of each utterance, and a dictionary of what
+             the steps kept in memory, the vocabulary, and the references, hypotheses, new hypotheses, alignments
+             and error details, where every utterance is an array of word ids from the vocabulary
+    """
+    # every word of the perutt file and the lattices is interned once, so the utterances are kept as arrays
+    # of word ids and compared as arrays by every step
+    vocabulary = Vocabulary()
+    error_stats = ErrorAnalysisStatistics()
+    references, hypotheses, old_error_details = init_references(reference_file, error_stats, vocabulary=vocabulary)
+
+    new_hypotheses, applied_to_new = find_all_new_hypotheses(references, hypotheses, lattice_file, search, word_symbols,
+                                                             readers, workers, vocabulary, cache, budget)
+
+    alignments = align_utterances(references, new_hypotheses)
+    new_error_details = {utt_id: find_error_details(alignments[utt_id][2], True) for utt_id in alignments}
+
+    classifications = {}
+    if jobs > 1:
+        sharded_error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, jobs, jobs,
+                               classifications, vocabulary)
+    else:
+        error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, classifications,
+                       vocabulary)
+
+    corpus = {'vocabulary': vocabulary, 'references': references, 'hypotheses': hypotheses, 'new_hypotheses': new_hypotheses,
+              'applied_to_new': applied_to_new, 'alignments': alignments, 'old_error_details': old_error_details,
+              'new_error_details': new_error_details, 'budget_limited': [] if budget is None else budget.limited}
+    return error_stats, classifications, corpus
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Best path in lattices and error statistics in one process',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='Find the new hypotheses and their error statistics',
+                                       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    run_parser.add_argument('r', type=argparse.FileType('r'), help='Reference file')
+    run_parser.add_argument('w', type=str, help='Kaldi word lattice file or OR a directory of archives of word lattices')
+    run_parser.add_argument('-o', type=str, default='kaldi_new_best_path', help='Output directory')
+    run_parser.add_argument('-s', '--search', type=str, default='dfs', choices=SEARCH_ENGINES,
+                            help='Search used to find the best path with a correct start')
+    run_parser.add_argument('--words', type=str, default=None,
+                            help='Symbol table (words.txt) to map the word ids in Kaldi binary lattice archives to words')
+    run_parser.add_argument('--readers', type=int, default=0,
+                            help='Number of reader threads that prefetch the lattices while the search runs')
+    run_parser.add_argument('--workers', type=int, default=0,
+                            help='Number of search worker processes when prefetching')
+    run_parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes for the error analysis')
+    run_parser.add_argument('--cache', type=str, default=None, help='Database file of earlier search results')
+    run_parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE >> 20,
+                            help='Maximum size of the cache in MB')
+    run_parser.add_argument('--time-budget', type=float, default=None,
+                            help='Time budget of the search of an utterance in seconds, as for best_path.py')
+    run_parser.add_argument('--expansion-budget', type=int, default=None,
+                            help='Number of states the search of an utterance may expand, as for best_path.py')
+    run_parser.add_argument('--write-hypotheses', action='store_true',
+                            help='Also write the new hypotheses and the ones the method was applied to, like best_path.py')
+    run_parser.add_argument('--write-per-utt', action='store_true',
+                            help='Also write the perutt file of the new hypotheses')
+    run_parser.add_argument('--store', type=str, default=None,
+                            help='Also write the classification store total_error_statistics.py --changed reads')
+    run_parser.add_argument('--structured', action='store_true',
+                            help='Also write the classifications and counts as JSON Lines and a NumPy .npz file')
+
+    return parser.parse_args()
+
+
+def main():
+    # run: the steps of best_path.py -n 0, the scorer and total_error_statistics.py in one process,
+    # the error statistics are always written, every other file is optional
+
+    args = parse_args()
+
+    if args.o == 'new_nbest':
+        out_dir = args.o + '_' + time.strftime("%Y%m%d-%H%M%S") + '/'
+    else:
+        out_dir = args.o
+        if not out_dir.endswith('/'):
+            out_dir += '/'
+
+    # allow to overwrite existing directory
+    try:
+        os.mkdir(out_dir)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+        pass
+
+    word_symbols = read_symbol_table(args.words) if args.words is not None else None
+    cache = ResultCache(args.cache, args.cache_size << 20) if args.cache is not None else None
+    budget = None
+    if args.time_budget is not None or args.expansion_budget is not None:
+        budget = SearchBudget(args.time_budget, args.expansion_budget)
+    error_stats, classifications, corpus = run(args.r, args.w, args.search, word_symbols, args.readers, args.workers,
+                                               args.jobs, cache, budget)
+    if cache is not None:
+        cache.write(sys.stdout)
+        cache.close()
+    if budget is not None:
+        budget.write(sys.stdout)
+
+    filename = 'error-results-' + time.strftime('%d-%b-') + time.strftime('%H:%M') + '.txt'
+    write_error_stats_to_file(filename, out_dir, error_stats)
+
+    vocabulary = corpus['vocabulary']
+    if budget is not None:
+        write_utterances_to_file('budget_limited.txt', out_dir, vocabulary.decode_utterances(
+            {utt_id: corpus['new_hypotheses'][utt_id] for utt_id in sorted(corpus['budget_limited'])}))
+    if args.write_hypotheses:
+        write_utterances_to_file('new_hypotheses.txt', out_dir, vocabulary.decode_utterances(corpus['new_hypotheses']))
+        write_utterances_to_file('applied_to_new.txt', out_dir, vocabulary.decode_utterances(corpus['applied_to_new']))
+    if args.write_per_utt:
+        write_per_utt_file(out_dir + 'new_per_utt', corpus['alignments'], vocabulary)
+    if args.store is not None:
+        # total_error_statistics.py keeps the utterances in the store as strings
+        for error in error_stats.utterances_per_error:
+            error_stats.utterances_per_error[error] = vocabulary.decode_utterances(error_stats.utterances_per_error[error])
+        save_classification_store(args.store, create_classification_store(
+            error_stats, vocabulary.decode_utterances(corpus['hypotheses']), corpus['old_error_details'], classifications))
+    if args.structured:
+        write_structured_results(out_dir, filename[:-len('.txt')],
+                                 structured_tables(error_stats, classifications,
+                                                   None if budget is None else set(corpus['budget_limited'])))
+
+
+if __name__ == '__main__':
+    main()
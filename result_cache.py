@@ -0,0 +1,123 @@
+import hashlib
+import sqlite3
+
+from kaldi_lattice import CompactLattice
+
+# changes whenever a change to the search can change the results, so old entries are never used
+CACHE_VERSION = '2'
+DEFAULT_CACHE_SIZE = 256 << 20
+# number of changes to the cache between commits
+COMMIT_INTERVAL = 1000
+
+
+def lattice_digest(lattice):
+    """
+    :param lattice: the lines of a text FST or a CompactLattice
+    :return: a hash object of the content of the lattice
+    """
+    if isinstance(lattice, CompactLattice):
+        content = repr((lattice.start, lattice.arcs, lattice.finals))
+    else:
+        content = '\n'.join(lattice)
+    return hashlib.sha256(content.encode())
+
+
+def cache_key(lattice, correct_start, search):
+    """
+    Creates the key of a search result from everything the result depends on
+    :param lattice: the lines of a text FST or a CompactLattice
+    :param correct_start: the words the path has to start with
+    :param search: the search used, dfs, astar, batch or auto
+    :return: a hex digest
+    """
+    digest = lattice_digest(lattice)
+    digest.update(b'\0' + ' '.join(correct_start).encode())
+    digest.update(b'\0' + str(search).encode() + b'\0' + CACHE_VERSION.encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    A persistent cache of the new hypotheses found by find_best_path, in an SQLite database. The key is a hash of the
+    lattice, the correct start and the search, so an entry is only used for exactly the same search. When the entries
+    take more than max_size bytes the least recently used ones are removed
+    """
+    def __init__(self, filename, max_size=DEFAULT_CACHE_SIZE):
+        """
+        :param filename: the database file, created if it does not exist
+        :param max_size: the maximum size of the hypotheses in the cache in bytes
+        """
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, hypothesis TEXT, cost REAL, '
+                                'size INTEGER NOT NULL, last_used INTEGER NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.max_size = max_size
+        self.size, clock = self.connection.execute('SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) '
+                                                   'FROM results').fetchone()
+        # a counter instead of a time, so the order of use is exact
+        self.clock = clock
+        self.changes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def tick(self):
+        self.clock += 1
+        self.changes += 1
+        if self.changes >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self.changes = 0
+        return self.clock
+
+    def lookup(self, key):
+        """
+        :param key: a key from cache_key
+        :return: True and the new hypothesis if the key is in the cache, where the hypothesis is None if the search
+                 found no path, or False and None if it is not
+        """
+        row = self.connection.execute('SELECT hypothesis FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self.connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (self.tick(), key))
+        return True, row[0]
+
+    def store(self, key, hypothesis, cost=None):
+        """
+        :param key: a key from cache_key
+        :param hypothesis: the new hypothesis, None if the search found no path
+        :param cost: the cost of the path, if the search gives it
+        """
+        size = len(key) + (0 if hypothesis is None else len(hypothesis.encode()))
+        old = self.connection.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+        if old is not None:
+            self.size -= old[0]
+        self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                (key, hypothesis, cost, size, self.tick()))
+        self.size += size
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the entries take at most 90% of max_size,
+        so eviction does not run again for every new entry
+        """
+        target = self.max_size * 9 // 10
+        rows = self.connection.execute('SELECT key, size FROM results ORDER BY last_used')
+        evicted = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((key,))
+            self.size -= size
+        rows.close()
+        self.connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def write(self, out_file):
+        out_file.write('# result cache hits: ' + str(self.hits) + ', misses: ' + str(self.misses) +
+                       ', size: ' + str(self.size) + ' bytes\n')
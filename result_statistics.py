@@ -5,6 +5,13 @@ import time
 
 from pathlib import Path
 
+from sharding import map_shards, split_utterances
+from structured_output import write_structured_results
+
+# the outcome of comparing an utterance, the names of the counts in ErrorAnalysisStatistics
+OUTCOMES = ('all_errors_fixed_no_new_errors', 'all_errors_fixed_new_errors', 'all_errors_not_fixed_no_new_errors',
+            'all_errors_not_fixed_new_errors', 'number_of_hypothesis_not_corrected')
+
 
 class ErrorAnalysisStatistics:
     def __init__(self):
@@ -22,6 +29,22 @@ class ErrorAnalysisStatistics:
 
         self.new_hypotheses_with_ref_and_old_hyp = {}
 
+    def merge(self, other):
+        """
+        Adds the statistics of other to these statistics, e.g. to combine the statistics of parts of a corpus
+        :param other: an ErrorAnalysisStatistics
+        :return: these statistics
+        """
+        self.all_errors_fixed_new_errors += other.all_errors_fixed_new_errors
+        self.all_errors_fixed_no_new_errors += other.all_errors_fixed_no_new_errors
+        self.all_errors_not_fixed_no_new_errors += other.all_errors_not_fixed_no_new_errors
+        self.all_errors_not_fixed_new_errors += other.all_errors_not_fixed_new_errors
+        self.number_of_hypothesis_not_corrected += other.number_of_hypothesis_not_corrected
+        for word in other.words_not_in_path:
+            self.words_not_in_path[word] = self.words_not_in_path.get(word, 0) + other.words_not_in_path[word]
+        self.new_hypotheses_with_ref_and_old_hyp.update(other.new_hypotheses_with_ref_and_old_hyp)
+        return self
+
 
 def created_other_errors(start, end, ref, new_hyp):
     created_new_errors = False
@@ -30,11 +53,13 @@ def created_other_errors(start, end, ref, new_hyp):
     return created_new_errors
 
 
-def init_references_with_n_errors(reference_file, n_errors=None):
+def init_references_with_n_errors(reference_file, n_errors=None, all_errors=False):
     """
     Creates reference file of utterances containing only specific number of errors
     :param      reference_file: perutt file containing all reference utterances and hypothesised recognition
     :param      n_errors: the number of errors per utterance you want to have in your new reference file
+    :param      all_errors: keep the utterances with any number of errors, the error positions are found
+                like for the original errors of n_errors
     :return:    a list of all references with n_errors, a list of all hypotheses with n_errors and
                 then a list of all other references and hypotheses
     """
@@ -62,34 +87,29 @@ def init_references_with_n_errors(reference_file, n_errors=None):
             # remove insertion symbols from hyp to be able to match the original reference from nbest
             utt = ' '.join(utt_arr).replace(replace_symbol, '')
             all_other_hypothesis[utt_id] = utt.strip()
-        elif info == '#csid' and n_errors is not None:
+        elif info == '#csid' and (n_errors is not None or all_errors):
             error_count = 0
             # the first number is the number of correct
             for error in range(1, len(utt_arr)):
                 error_count += int(utt_arr[error])
-            if error_count == n_errors:
+            if all_errors or error_count == n_errors:
                 n_error_references[utt_id] = all_other_references[utt_id]
                 n_error_hypothesis[utt_id] = all_other_hypothesis[utt_id]
                 all_other_references.pop(utt_id, None)
                 all_other_hypothesis.pop(utt_id, None)
         if info == 'op':
-            # find the first n errors and error positions, this is only for results
-            error_count = 1
-            error_type = {}
+            # find the errors and error positions as (type, position) tuples, this is only for results
+            errors = []
             for i in range(len(utt_arr)):
                 if utt_arr[i] != 'C':
-                    if error_count > 1:
-                        # Only check for this if we are looking at the original errors
-                        if error_type[1][0] == 'I' and n_errors is not None:
-                            error_type[error_count] = [utt_arr[i], i-1]
-                        else:
-                            error_type[error_count] = [utt_arr[i], i]
+                    # Only check for this if we are looking at the original errors
+                    if len(errors) >= 1 and errors[0][0] == 'I' and (n_errors is not None or all_errors):
+                        errors.append((utt_arr[i], i-1))
                     else:
-                        error_type[error_count] = [utt_arr[i], i]
-                    error_count += 1
-            error_details[utt_id] = error_type
+                        errors.append((utt_arr[i], i))
+            error_details[utt_id] = tuple(errors)
 
-    if n_errors is not None:
+    if n_errors is not None or all_errors:
         return n_error_references, n_error_hypothesis, error_details
     else:
         return all_other_references, all_other_hypothesis, error_details
@@ -104,92 +124,157 @@ def write_error_stats(stats, number_of_errors):
     print('Number of hypothesis not corrected: ', stats.number_of_hypothesis_not_corrected)
 
 
-def error_analysis(references, new_hypothesis, hypothesis, old_error_details, new_error_details, number_of_errors):
-    stats = ErrorAnalysisStatistics()
+def compare_utterances(references, new_hypothesis, hypothesis, old_error_details, new_error_details, outcomes=None):
+    """
+    Compares the errors of every utterance in the new and old hypotheses
+    :param outcomes: a dictionary to store the outcome of each utterance in, one of OUTCOMES
+    :return: a dictionary of the ErrorAnalysisStatistics per number of errors in the old hypothesis
+    """
+    stats_per_error = {}
 
     for utt_id in references:
+        error = len(old_error_details[utt_id])
+        if error not in stats_per_error:
+            stats_per_error[error] = ErrorAnalysisStatistics()
+        stats = stats_per_error[error]
+
         ref = references[utt_id].split()
         hyp = hypothesis[utt_id].split()
         new_hyp = new_hypothesis[utt_id].split()
         if ref == new_hyp:
             stats.all_errors_fixed_no_new_errors += 1
+            outcome = 'all_errors_fixed_no_new_errors'
         elif new_hyp == hyp:
             # the new hypothesis remains the same because
             # the correct word was not in the lattice
             stats.number_of_hypothesis_not_corrected += 1
+            outcome = 'number_of_hypothesis_not_corrected'
         else:
             # compare the errors
-            if number_of_errors == 2:
-                stats = compare_2_errors_utt(stats, old_error_details[utt_id], new_error_details[utt_id], utt_id, ref, hyp, new_hyp)
-            else:
-                stats = compare_3_errors_utt(stats, old_error_details[utt_id], new_error_details[utt_id], utt_id, ref, hyp, new_hyp)
+            outcome = compare_errors_utt(stats, old_error_details[utt_id], new_error_details[utt_id])
+        if outcomes is not None:
+            outcomes[utt_id] = outcome
 
-    write_error_stats(stats, number_of_errors)
+    return stats_per_error
 
 
-def compare_2_errors_utt(stats, old_error_details, new_error_details, utt_id, reference, hypothesis, new_hypothesis):
-    # remove the first error
-    updated_old_error_details = {1: old_error_details[2]}
-    if updated_old_error_details == new_error_details:
-        # no errors added, no errors fixed
-        stats.all_errors_not_fixed_no_new_errors += 1
-    elif len(new_error_details) > len(updated_old_error_details):
-        # Go through all the error and check if one of the remains the same
-        same_error_count = 0
-        for error in new_error_details:
-            if new_error_details[error] == updated_old_error_details[1]:
-                same_error_count += 1
-        # if the error count is not 0 then the errors were fixed but new errors were introduced
-        if same_error_count == 0:
-            stats.all_errors_fixed_new_errors += 1
-        else:
-            stats.all_errors_not_fixed_new_errors += 1
+def compare_shard(task):
+    """
+    Compares the errors of a shard of the utterances, the task of a worker process
+    :param task: the arguments of compare_utterances for the utterances of the shard
+    :return: the ErrorAnalysisStatistics of the shard per number of errors and the outcomes if they were asked for
+    """
+    outcomes = task[-1]
+    return compare_utterances(*task), outcomes
+
+
+def error_analysis(references, new_hypothesis, hypothesis, old_error_details, new_error_details, jobs=1, outcomes=None):
+    """
+    Compares the errors of every utterance and prints the statistics per number of errors
+    :param jobs: the number of processes
+    :param outcomes: a dictionary to store the outcome of each utterance in
+    :return: a dictionary of the ErrorAnalysisStatistics per number of errors in the old hypothesis
+    """
+    if jobs > 1:
+        # split the utterances into shards by utterance id and merge the statistics of the shards
+        stats_per_error = {}
+        tasks = []
+        for shard in split_utterances(references, jobs):
+            tasks.append(({utt_id: references[utt_id] for utt_id in shard},
+                          {utt_id: new_hypothesis[utt_id] for utt_id in shard},
+                          {utt_id: hypothesis[utt_id] for utt_id in shard},
+                          {utt_id: old_error_details[utt_id] for utt_id in shard if utt_id in old_error_details},
+                          {utt_id: new_error_details[utt_id] for utt_id in shard if utt_id in new_error_details},
+                          {} if outcomes is not None else None))
+        for shard_stats, shard_outcomes in map_shards(compare_shard, tasks, jobs):
+            for error in shard_stats:
+                if error not in stats_per_error:
+                    stats_per_error[error] = ErrorAnalysisStatistics()
+                stats_per_error[error].merge(shard_stats[error])
+            if outcomes is not None:
+                outcomes.update(shard_outcomes)
     else:
-        # the new error does not match either the old errors
-        # but is not error free, so new errors have been introduced
-        stats.all_errors_fixed_new_errors += 1
+        stats_per_error = compare_utterances(references, new_hypothesis, hypothesis, old_error_details, new_error_details,
+                                             outcomes)
 
-    return stats
+    for error in sorted(stats_per_error):
+        write_error_stats(stats_per_error[error], error)
+    return stats_per_error
 
 
-def compare_3_errors_utt(stats, old_error_details, new_error_details, utt_id, reference, hypothesis, new_hypothesis):
-    # remove the first errors
-    updated_old_error_details = {1: old_error_details[2], 2: old_error_details[3]}
-    if updated_old_error_details == new_error_details:
-        # no errors added, no errors fixed
-        stats.all_errors_not_fixed_no_new_errors += 1
-    elif len(new_error_details) < len(updated_old_error_details):
-        # there is only one error
-        if new_error_details[1] == updated_old_error_details[1] or new_error_details[1] == updated_old_error_details[2]:
-            stats.all_errors_not_fixed_no_new_errors += 1
-        else:
-            # the new error does not match either the old errors
-            # but is not error free, so new errors have been introduced
-            stats.all_errors_fixed_new_errors += 1
-    elif len(new_error_details) > len(updated_old_error_details):
-        error_count = 0
-        for error in new_error_details:
-            if new_error_details[error] == updated_old_error_details[1] or new_error_details[error] == updated_old_error_details[2]:
-                error_count += 1
-        # if the error count is not 0 then the errors were fixed but and new errors were introduced
-        if error_count == 0:
-            stats.all_errors_fixed_new_errors += 1
-        else:
-            stats.all_errors_not_fixed_new_errors += 1
-    else:
-        # the error count is the same
-        error_count = 0
-        for error in new_error_details:
-            if new_error_details[error] == updated_old_error_details[1] or new_error_details[error] == updated_old_error_details[2]:
-                error_count += 1
-        if error_count == 0:
-            stats.all_errors_fixed_new_errors += 1
-        elif error_count == 2:
-            stats.all_errors_not_fixed_no_new_errors += 1
+def count_same_errors(old_errors, new_errors):
+    """
+    Counts the errors that are in both lists in a single merge pass, both lists are ordered by position
+    and have at most one error per position
+    :param old_errors: (type, position) tuples
+    :param new_errors: (type, position) tuples
+    :return: the number of errors in both lists
+    """
+    same_error_count = 0
+    i = 0
+    j = 0
+    while i < len(old_errors) and j < len(new_errors):
+        if old_errors[i][1] < new_errors[j][1]:
+            i += 1
+        elif old_errors[i][1] > new_errors[j][1]:
+            j += 1
         else:
-            stats.all_errors_not_fixed_new_errors += 1
+            if old_errors[i][0] == new_errors[j][0]:
+                same_error_count += 1
+            i += 1
+            j += 1
+    return same_error_count
+
+
+def compare_errors_utt(stats, old_error_details, new_error_details):
+    """
+    Compares the errors that remain after the first error is fixed to the errors of the new hypothesis,
+    for any number of errors
+    :param stats: ErrorAnalysisStatistics to count the outcome in
+    :param old_error_details: the errors of the old hypothesis as (type, position) tuples, in order
+    :param new_error_details: the errors of the new hypothesis as (type, position) tuples, in order
+    :return: the outcome, one of OUTCOMES
+    """
+    # remove the first error
+    remaining_errors = old_error_details[1:]
+    same_error_count = count_same_errors(remaining_errors, new_error_details)
+    new_error_count = len(new_error_details) - same_error_count
+
+    if same_error_count == 0:
+        # none of the remaining errors is left
+        if new_error_count == 0:
+            stats.all_errors_fixed_no_new_errors += 1
+            return 'all_errors_fixed_no_new_errors'
+        stats.all_errors_fixed_new_errors += 1
+        return 'all_errors_fixed_new_errors'
+    elif new_error_count == 0:
+        # every error in the new hypothesis is one of the old errors
+        stats.all_errors_not_fixed_no_new_errors += 1
+        return 'all_errors_not_fixed_no_new_errors'
+    stats.all_errors_not_fixed_new_errors += 1
+    return 'all_errors_not_fixed_new_errors'
+
+
+def structured_tables(stats_per_error, old_error_details, outcomes):
+    """
+    Creates the rows of the structured output, a row per utterance with its outcome and a row per number of errors
+    with the count of every outcome
+    :param stats_per_error: the ErrorAnalysisStatistics per number of errors from error_analysis
+    :param old_error_details: the errors of the old hypotheses
+    :param outcomes: the outcome of each utterance from error_analysis
+    :return: a dictionary with the utterance rows and the aggregate rows
+    """
+    utterance_rows = [{'utt_id': utt_id, 'errors': len(old_error_details[utt_id]), 'outcome': outcomes[utt_id]}
+                      for utt_id in sorted(outcomes)]
+
+    aggregate_rows = []
+    for error in sorted(stats_per_error):
+        row = {'errors': error}
+        for outcome in OUTCOMES:
+            row[outcome] = getattr(stats_per_error[error], outcome)
+        aggregate_rows.append(row)
 
-    return stats
+    return {'utterances': utterance_rows, 'aggregates': aggregate_rows}
 
 
 def parse_args():
@@ -198,7 +283,13 @@ def parse_args():
     parser.add_argument('r', type=argparse.FileType('r'), help='Reference file')
     parser.add_argument('w', type=argparse.FileType('r'), help='New Reference file')
     parser.add_argument('-o', type=str, default='kaldi_new_best_path', help='Output directory')
-    parser.add_argument('-n', type=str, default=1, help='Number of errors to look at')
+    parser.add_argument('-n', type=str, default=1, help='Number of errors to look at, all looks at every number of errors '
+                                                        'in one run')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes, the utterances are split into this many shards by utterance id')
+    parser.add_argument('--structured', action='store_true',
+                        help='Also write the outcome of every utterance and the counts as JSON Lines '
+                             'and as a NumPy .npz file with a column per field')
 
     return parser.parse_args()
 
@@ -231,14 +322,21 @@ def main():
             raise
         pass
 
-    number_of_errors = int(args.n)
-
-    references, hypothesis, old_error_details = init_references_with_n_errors(reference_file, number_of_errors)
+    if args.n == 'all':
+        references, hypothesis, old_error_details = init_references_with_n_errors(reference_file, all_errors=True)
+    else:
+        references, hypothesis, old_error_details = init_references_with_n_errors(reference_file, int(args.n))
     old_error_details = trim_error_details(references, old_error_details)
     new_references, new_hypothesis, new_error_details = init_references_with_n_errors(new_reference_file, None)
     new_error_details = trim_error_details(new_references, new_error_details)
 
-    error_analysis(references, new_hypothesis, hypothesis, old_error_details, new_error_details, number_of_errors)
+    outcomes = {} if args.structured else None
+    stats_per_error = error_analysis(references, new_hypothesis, hypothesis, old_error_details, new_error_details,
+                                     args.jobs, outcomes)
+
+    if args.structured:
+        filename = 'result-statistics-' + str(args.n) + '-errors-' + time.strftime('%d-%b-') + time.strftime('%H:%M')
+        write_structured_results(out_dir, filename, structured_tables(stats_per_error, old_error_details, outcomes))
 
 
 if __name__ == '__main__':
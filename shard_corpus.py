@@ -0,0 +1,337 @@
+import argparse
+import json
+import os
+import errno
+import subprocess
+import sys
+
+from best_path import SEARCH_ENGINES, iter_lattices, lattice_size, write_utterances_to_file
+from kaldi_lattice import CompactLattice, read_symbol_table
+from sharding import balance_utterances
+from total_error_statistics import ErrorAnalysisStatistics, load_classification_store, save_classification_store, \
+    write_error_stats_to_file
+
+MANIFEST_FILENAME = 'manifest.json'
+SHARD_PER_UTT_FILENAME = 'per_utt'
+SHARD_LATTICE_FILENAME = 'lattices.txt'
+# the classification store every shard writes when the statistics are computed on the shards
+SHARD_STORE_FILENAME = 'classification.store'
+MERGED_ERROR_STATS_FILENAME = 'error-results-merged.txt'
+# the files of utterances best_path.py and pipeline.py write, every utterance in them has to come from its own shard
+UTTERANCE_FILE_PREFIXES = ('new_hypotheses', 'references', 'old_hypotheses', 'applied_to_new', 'applied_to_old',
+                           'budget_limited')
+# the files best_path.py -n 0 writes for every utterance in the perutt file, new_hypotheses.txt only has the
+# utterances with a lattice
+COMPLETE_UTTERANCE_FILES = ('references.txt', 'old_hypotheses.txt')
+
+
+def make_dir(directory):
+    # allow to overwrite existing directory
+    try:
+        os.mkdir(directory)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def read_per_utt_lines(reference_file):
+    """
+    :param reference_file: perutt file
+    :return: a dictionary of the lines of each utterance, in the order of the file
+    """
+    lines = {}
+    for line in reference_file:
+        if line.strip():
+            lines.setdefault(line.split()[0], []).append(line)
+    return lines
+
+
+def lattice_text_lines(lattice):
+    if isinstance(lattice, CompactLattice):
+        return lattice.to_text_lines()
+    return lattice
+
+
+def shard_corpus(reference_file, lattice_input, number_of_shards, out_dir, word_symbols=None):
+    """
+    Splits a perutt file and its lattices into shards with about the same number of lattice arcs each, and writes
+    the perutt file and a text FST archive of every shard with a manifest of the split. The lattices are read twice,
+    once to measure them and once to write them, so they are never all in memory
+    :param reference_file: perutt file
+    :param lattice_input: a lattice file or a directory of lattice archives, as for best_path.py
+    :param number_of_shards: the number of shards
+    :param out_dir: the directory to write a directory per shard and the manifest to
+    :param word_symbols: a dictionary from word id to word for binary lattice archives
+    :return: the manifest
+    """
+    per_utt_lines = read_per_utt_lines(reference_file)
+    sizes = {utt_id: 0 for utt_id in per_utt_lines}
+    skipped = set()
+    for utt_id, lattice in iter_lattices(lattice_input, word_symbols):
+        if utt_id in sizes:
+            sizes[utt_id] += lattice_size(lattice)
+        else:
+            # best_path.py only searches the lattices of utterances in the perutt file
+            skipped.add(utt_id)
+
+    shards, totals = balance_utterances(sizes, number_of_shards)
+    shard_of = {}
+    manifest = {'per_utt': os.path.abspath(reference_file.name), 'lattices': os.path.abspath(lattice_input),
+                'number_of_shards': number_of_shards, 'utterances': len(sizes), 'arcs': sum(totals),
+                'skipped_lattices': len(skipped), 'shards': []}
+    for shard in range(number_of_shards):
+        shard_dir = os.path.join(out_dir, 'shard-%03d' % shard)
+        make_dir(shard_dir)
+        for utt_id in shards[shard]:
+            shard_of[utt_id] = shard
+        manifest['shards'].append({'name': 'shard-%03d' % shard, 'directory': os.path.abspath(shard_dir),
+                                   'per_utt': os.path.abspath(os.path.join(shard_dir, SHARD_PER_UTT_FILENAME)),
+                                   'lattices': os.path.abspath(os.path.join(shard_dir, SHARD_LATTICE_FILENAME)),
+                                   'arcs': totals[shard], 'utt_ids': sorted(shards[shard])})
+
+    per_utt_files = [open(shard['per_utt'], 'w') for shard in manifest['shards']]
+    for utt_id in per_utt_lines:
+        per_utt_files[shard_of[utt_id]].writelines(per_utt_lines[utt_id])
+    for per_utt_file in per_utt_files:
+        per_utt_file.close()
+
+    lattice_files = [open(shard['lattices'], 'w') for shard in manifest['shards']]
+    for utt_id, lattice in iter_lattices(lattice_input, word_symbols):
+        if utt_id in shard_of:
+            lattice_file = lattice_files[shard_of[utt_id]]
+            lattice_file.write(utt_id + '\n')
+            for line in lattice_text_lines(lattice):
+                lattice_file.write(line + '\n')
+            lattice_file.write('\n')
+    for lattice_file in lattice_files:
+        lattice_file.close()
+
+    with open(os.path.join(out_dir, MANIFEST_FILENAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    return manifest
+
+
+def read_manifest(filename):
+    with open(filename) as manifest_file:
+        return json.load(manifest_file)
+
+
+def read_utterance_file(filename):
+    """
+    :param filename: a file written by write_utterances_to_file
+    :return: a list of the utterance ids and utterances in the file
+    """
+    utterances = []
+    with open(filename) as utterance_file:
+        for line in utterance_file:
+            line = line.rstrip('\n')
+            if line:
+                utt_id, _, utterance = line.partition(' ')
+                utterances.append((utt_id, utterance))
+    return utterances
+
+
+def merge_utterance_files(manifest, shard_out_dirs, out_dir):
+    """
+    Merges the files of utterances that have the same name in the output directories of the shards, checking that
+    every utterance comes from the shard it was assigned to and appears once, and that the files best_path.py
+    writes for every utterance contain every utterance of the manifest
+    :return: a dictionary of the number of utterances in each merged file
+    """
+    shard_of = {}
+    for shard, shard_manifest in enumerate(manifest['shards']):
+        for utt_id in shard_manifest['utt_ids']:
+            shard_of[utt_id] = shard
+
+    filenames = set()
+    for shard_out_dir in shard_out_dirs:
+        filenames.update(filename for filename in os.listdir(shard_out_dir)
+                         if filename.endswith('.txt') and filename.startswith(UTTERANCE_FILE_PREFIXES))
+
+    merged_counts = {}
+    for filename in sorted(filenames):
+        merged = {}
+        for shard, shard_out_dir in enumerate(shard_out_dirs):
+            if not os.path.exists(os.path.join(shard_out_dir, filename)):
+                continue
+            for utt_id, utterance in read_utterance_file(os.path.join(shard_out_dir, filename)):
+                if shard_of.get(utt_id) != shard:
+                    raise ValueError(filename + ' of ' + manifest['shards'][shard]['name'] + ' contains ' + utt_id +
+                                     ', which is not in that shard')
+                if utt_id in merged:
+                    raise ValueError(utt_id + ' appears more than once in ' + filename)
+                merged[utt_id] = utterance
+        if filename in COMPLETE_UTTERANCE_FILES and len(merged) != len(shard_of):
+            missing = sorted(utt_id for utt_id in shard_of if utt_id not in merged)
+            raise ValueError(str(len(missing)) + ' utterances are missing from ' + filename + ', e.g. ' + missing[0])
+        write_utterances_to_file(filename, out_dir, merged)
+        merged_counts[filename] = len(merged)
+    return merged_counts
+
+
+def merge_classification_stores(manifest, shard_out_dirs):
+    """
+    Merges the statistics and the classified utterances of the classification stores of the shards,
+    every utterance has to be classified by exactly one shard
+    :return: the merged store, or None if the shards did not write a store
+    """
+    stores = [os.path.join(shard_out_dir, SHARD_STORE_FILENAME) for shard_out_dir in shard_out_dirs]
+    if not any(os.path.exists(store) for store in stores):
+        return None
+    if not all(os.path.exists(store) for store in stores):
+        raise ValueError('Only some shards wrote a ' + SHARD_STORE_FILENAME)
+
+    error_stats = ErrorAnalysisStatistics()
+    utterances = {}
+    for store_filename in stores:
+        store = load_classification_store(store_filename)
+        for utt_id in store['utterances']:
+            if utt_id in utterances:
+                raise ValueError(utt_id + ' was classified by more than one shard')
+        utterances.update(store['utterances'])
+        error_stats.merge(store['error_stats'])
+    missing = [utt_id for shard in manifest['shards'] for utt_id in shard['utt_ids'] if utt_id not in utterances]
+    if missing:
+        raise ValueError(str(len(missing)) + ' utterances were not classified by any shard, e.g. ' + missing[0])
+    return {'error_stats': error_stats, 'utterances': utterances}
+
+
+def merge_shards(manifest, shard_out_dirs, out_dir):
+    """
+    Merges the outputs of the shards into the outputs of a run over the whole corpus
+    :param manifest: the manifest written by shard_corpus
+    :param shard_out_dirs: the output directory of every shard, in the order of the shards in the manifest
+    :param out_dir: the directory to write the merged outputs to
+    """
+    if len(shard_out_dirs) != len(manifest['shards']):
+        raise ValueError('The manifest has ' + str(len(manifest['shards'])) + ' shards but ' +
+                         str(len(shard_out_dirs)) + ' output directories were given')
+    if not out_dir.endswith('/'):
+        out_dir += '/'
+    make_dir(out_dir)
+
+    for filename, count in merge_utterance_files(manifest, shard_out_dirs, out_dir).items():
+        print('# ' + filename + ': ' + str(count) + ' utterances')
+
+    store = merge_classification_stores(manifest, shard_out_dirs)
+    if store is not None:
+        save_classification_store(out_dir + SHARD_STORE_FILENAME, store)
+        write_error_stats_to_file(MERGED_ERROR_STATS_FILENAME, out_dir, store['error_stats'])
+        print('# ' + SHARD_STORE_FILENAME + ': ' + str(len(store['utterances'])) + ' classified utterances')
+
+
+def shard_command(shard_manifest, out_dir, search='dfs', number_of_errors=0, statistics=False, time_budget=None,
+                  expansion_budget=None):
+    """
+    :return: the command that runs the search of a shard, pipeline.py run if the statistics are computed
+             on the shards and best_path.py if not
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    budget_options = []
+    if time_budget is not None:
+        budget_options += ['--time-budget', str(time_budget)]
+    if expansion_budget is not None:
+        budget_options += ['--expansion-budget', str(expansion_budget)]
+    if statistics:
+        return [sys.executable, os.path.join(script_dir, 'pipeline.py'), 'run', shard_manifest['per_utt'],
+                shard_manifest['lattices'], '-o', out_dir, '-s', search, '--write-hypotheses',
+                '--store', os.path.join(out_dir, SHARD_STORE_FILENAME)] + budget_options
+    return [sys.executable, os.path.join(script_dir, 'best_path.py'), shard_manifest['per_utt'],
+            shard_manifest['lattices'], '-o', out_dir, '-s', search, '-n', str(number_of_errors)] + budget_options
+
+
+def run_shards_locally(manifest, search='dfs', number_of_errors=0, statistics=False, time_budget=None,
+                       expansion_budget=None):
+    """
+    Runs every shard in its own process at the same time, standing in for the machines of a cluster
+    :param time_budget: the time budget of the search of an utterance in seconds, see best_path.py
+    :param expansion_budget: the number of states the search of an utterance may expand, see best_path.py
+    :return: the output directory of every shard
+    """
+    shard_out_dirs = [os.path.join(shard['directory'], 'out') for shard in manifest['shards']]
+    processes = []
+    for shard, shard_out_dir in zip(manifest['shards'], shard_out_dirs):
+        log = open(os.path.join(shard['directory'], 'log.txt'), 'w')
+        command = shard_command(shard, shard_out_dir, search, number_of_errors, statistics, time_budget, expansion_budget)
+        processes.append((subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log))
+    failed = []
+    for (process, log), shard in zip(processes, manifest['shards']):
+        if process.wait() != 0:
+            failed.append(shard['name'])
+        log.close()
+    if failed:
+        raise RuntimeError('The search failed on ' + ', '.join(failed) + ', see log.txt in their directories')
+    return shard_out_dirs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Split a corpus run into shards and merge the outputs of the shards',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    shard_parser = subparsers.add_parser('shard', help='Split the perutt file and the lattices into shards',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    shard_parser.add_argument('r', type=argparse.FileType('r'), help='Reference file')
+    shard_parser.add_argument('w', type=str, help='Kaldi word lattice file or OR a directory of archives of word lattices')
+    shard_parser.add_argument('-n', '--shards', type=int, required=True, help='Number of shards')
+    shard_parser.add_argument('-o', type=str, default='shards', help='Output directory')
+    shard_parser.add_argument('--words', type=str, default=None,
+                              help='Symbol table (words.txt) to map the word ids in Kaldi binary lattice archives to words')
+
+    merge_parser = subparsers.add_parser('merge', help='Merge the outputs of the shards',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    merge_parser.add_argument('manifest', type=str, help='The manifest written by shard')
+    merge_parser.add_argument('outputs', type=str, nargs='+', help='The output directory of every shard, in order')
+    merge_parser.add_argument('-o', type=str, default='merged', help='Output directory')
+
+    local_parser = subparsers.add_parser('local', help='Shard, run every shard in its own process and merge',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    local_parser.add_argument('r', type=argparse.FileType('r'), help='Reference file')
+    local_parser.add_argument('w', type=str, help='Kaldi word lattice file or OR a directory of archives of word lattices')
+    local_parser.add_argument('-n', '--shards', type=int, required=True, help='Number of shards and of processes')
+    local_parser.add_argument('-o', type=str, default='shards', help='Output directory')
+    local_parser.add_argument('--words', type=str, default=None,
+                              help='Symbol table (words.txt) to map the word ids in Kaldi binary lattice archives to words')
+    local_parser.add_argument('-s', '--search', type=str, default='dfs', choices=SEARCH_ENGINES,
+                              help='Search used to find the best path with a correct start')
+    local_parser.add_argument('-e', '--errors', type=int, default=0, help='Number of errors to look at, as best_path.py -n')
+    local_parser.add_argument('--statistics', action='store_true',
+                              help='Run pipeline.py on the shards, so the error statistics are merged too')
+    local_parser.add_argument('--time-budget', type=float, default=None,
+                              help='Time budget of the search of an utterance in seconds, as for best_path.py')
+    local_parser.add_argument('--expansion-budget', type=int, default=None,
+                              help='Number of states the search of an utterance may expand, as for best_path.py')
+
+    return parser.parse_args()
+
+
+def main():
+    # shard: split the perutt file and the lattices into shards with about the same number of arcs, run
+    #        best_path.py or pipeline.py run on every shard and merge the output directories of the shards
+    # merge: combine the utterance files and classification stores of the shards, checking that every utterance
+    #        comes from exactly one shard
+    # local: shard, run every shard in a process of its own and merge, to try a split on one machine
+
+    args = parse_args()
+    if args.command == 'merge':
+        merge_shards(read_manifest(args.manifest), args.outputs, args.o)
+        return
+
+    if args.command == 'local' and args.statistics and args.errors != 0:
+        raise ValueError('--statistics runs pipeline.py, which looks at every utterance')
+
+    make_dir(args.o)
+    word_symbols = read_symbol_table(args.words) if args.words is not None else None
+    manifest = shard_corpus(args.r, args.w, args.shards, args.o, word_symbols)
+    for shard in manifest['shards']:
+        print('# ' + shard['name'] + ': ' + str(len(shard['utt_ids'])) + ' utterances, ' + str(shard['arcs']) + ' arcs')
+
+    if args.command == 'local':
+        shard_out_dirs = run_shards_locally(manifest, args.search, args.errors, args.statistics, args.time_budget,
+                                            args.expansion_budget)
+        merge_shards(manifest, shard_out_dirs, os.path.join(args.o, 'merged'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import heapq
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+def utterance_shard(utt_id, number_of_shards):
+    """
+    Assigns an utterance to a shard by a hash of its id, the same utterance always ends up in the same shard
+    :param utt_id: the utterance id
+    :param number_of_shards: the number of shards
+    :return: the shard index
+    """
+    return zlib.crc32(utt_id.encode()) % number_of_shards
+
+
+def split_utterances(utt_ids, number_of_shards):
+    """
+    Splits utterances into shards by utterance id
+    :param utt_ids: the utterance ids
+    :param number_of_shards: the number of shards
+    :return: a list of the utterance ids in each shard
+    """
+    shards = [[] for i in range(number_of_shards)]
+    for utt_id in utt_ids:
+        shards[utterance_shard(utt_id, number_of_shards)].append(utt_id)
+    return shards
+
+
+def balance_utterances(sizes, number_of_shards):
+    """
+    Splits utterances into shards of about the same total size, the largest utterances first, each to the shard
+    with the smallest total so far. Utterances of the same size are taken in the order of the hash of their id,
+    so the split only depends on the utterances and their sizes
+    :param sizes: a dictionary of the size of each utterance, e.g. the number of arcs in its lattice
+    :param number_of_shards: the number of shards
+    :return: a list of the utterance ids in each shard and a list of the total size of each shard
+    """
+    shards = [[] for i in range(number_of_shards)]
+    totals = [0] * number_of_shards
+    smallest = [(0, shard) for shard in range(number_of_shards)]
+    for utt_id in sorted(sizes, key=lambda utt_id: (-sizes[utt_id], zlib.crc32(utt_id.encode()), utt_id)):
+        total, shard = heapq.heappop(smallest)
+        shards[shard].append(utt_id)
+        totals[shard] = total + sizes[utt_id]
+        heapq.heappush(smallest, (totals[shard], shard))
+    return shards, totals
+
+
+def map_shards(function, tasks, workers=1):
+    """
+    Applies a function to the task of every shard, in a process pool if there is more than one worker
+    :param function: a picklable function of a single task
+    :param tasks: a list of picklable tasks
+    :param workers: the number of worker processes
+    :return: a list of the results, in the order of the tasks
+    """
+    if workers <= 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, tasks))
@@ -0,0 +1,83 @@
+import json
+import struct
+import sys
+import zipfile
+
+from array import array
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_ALIGNMENT = 64
+BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+
+def write_jsonl(filename, rows):
+    """
+    Writes rows as JSON Lines, one JSON object per line
+    :param filename: name of the file to write to
+    :param rows: a list of dictionaries
+    """
+    with open(filename, 'w') as out_file:
+        for row in rows:
+            out_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def column_to_npy(values):
+    """
+    Encodes a column as a .npy array, the type is found from the values: booleans, integers,
+    floats or strings, where None in a string column is written as an empty string
+    :param values: the values of the column
+    :return: the .npy header description and the array data
+    """
+    if all(isinstance(value, bool) for value in values):
+        return "'|b1'", bytes(values)
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return "'" + BYTE_ORDER + "i8'", array('q', values).tobytes()
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return "'" + BYTE_ORDER + "f8'", array('d', values).tobytes()
+
+    strings = ['' if value is None else str(value) for value in values]
+    length = max([len(string) for string in strings] + [1])
+    data = b''.join(string.ljust(length, '\0').encode('utf-32-le') for string in strings)
+    return "'<U" + str(length) + "'", data
+
+
+def npy_bytes(values):
+    """
+    Creates a one dimensional array in the NumPy .npy format, version 1.0
+    :param values: the values of the column
+    :return: the bytes of the .npy file
+    """
+    descr, data = column_to_npy(values)
+    header = "{'descr': " + descr + ", 'fortran_order': False, 'shape': (" + str(len(values)) + ",), }"
+    # the header is padded with spaces and a newline so the data starts at a multiple of the alignment
+    padding = NPY_ALIGNMENT - (len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGNMENT
+    header = (header + ' ' * (padding % NPY_ALIGNMENT) + '\n').encode('latin1')
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header + data
+
+
+def write_npz(filename, tables):
+    """
+    Writes tables as a compressed NumPy .npz file with one array per column, which numpy.load reads
+    without any text parsing. The arrays are named table/column, e.g. utterances/utt_id
+    :param filename: name of the file to write to
+    :param tables: a dictionary from table name to a list of rows, every row of a table has the same keys
+    """
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as npz:
+        for table in tables:
+            rows = tables[table]
+            if len(rows) == 0:
+                continue
+            for column in rows[0]:
+                npz.writestr(table + '/' + column + '.npy', npy_bytes([row[column] for row in rows]))
+
+
+def write_structured_results(out_dir, name, tables):
+    """
+    Writes every table to a JSON Lines file and all of them to a single .npz file
+    :param out_dir: location of output folder
+    :param name: the start of the file names, e.g. error-results
+    :param tables: a dictionary from table name to a list of rows
+    """
+    for table in tables:
+        write_jsonl(out_dir + name + '-' + table + '.jsonl', tables[table])
+    write_npz(out_dir + name + '.npz', tables)
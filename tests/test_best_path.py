@@ -0,0 +1,30 @@
+from best_path import LatticeBatch, batch_search_with_correct_starts, search_correct_start
+
+CYCLIC_LATTICE = ['0 1 a 1,1,1', '1 2 b 1,1,1', '2 1 c 1,1,1', '2 3 d 1,1,1', '3']
+# two paths with the correct start a end in state 1, the one found last is the more expensive one
+TWO_PREFIXES_LATTICE = ['0 1 a 1,0,', '0 2 <eps> 0,0,', '2 1 a 5,0,', '0 3 a 3,0,', '1 4 b 0,0,', '3 4 c 0,0,', '4']
+# parallel arcs between states 1 and 2, the first one in the file is the more expensive one
+PARALLEL_ARCS_LATTICE = ['0 1 a 1,0,', '1 2 b 3,0,', '1 2 c 1,0,', '2']
+
+
+def test_empty_batch_has_no_paths():
+    batch = LatticeBatch()
+    assert batch.best_paths(vectorized=True) == []
+    assert batch.best_paths(vectorized=False) == []
+
+
+def test_cyclic_lattice_is_searched_with_dfs():
+    for search in ('batch', 'auto', 'astar'):
+        assert search_correct_start(['a', 'b'], CYCLIC_LATTICE, search)[0] == 'a b d'
+    assert batch_search_with_correct_starts([(['a', 'b'], CYCLIC_LATTICE)]) == [('a b d', None)]
+
+
+def test_every_search_finds_the_cheapest_path():
+    for search in ('dfs', 'astar', 'batch', 'auto'):
+        assert search_correct_start(['a'], TWO_PREFIXES_LATTICE, search)[0] == 'a b'
+
+
+def test_parallel_arcs_give_the_word_of_the_cheapest_arc():
+    # the search before init_best_arcs took the word of the first arc in the file, 'a b'
+    for search in ('dfs', 'astar', 'batch', 'auto'):
+        assert search_correct_start(['a'], PARALLEL_ARCS_LATTICE, search)[0] == 'a c'
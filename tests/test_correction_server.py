@@ -0,0 +1,65 @@
+import http.client
+import json
+import threading
+
+from http.server import HTTPServer
+
+import pytest
+
+from correction_server import CorrectionRequestHandler, CorrectionService
+
+LATTICES = {'utt1': ['0 1 a 1,0,', '1 2 b 3,0,', '1 2 c 1,0,', '2 3 d 1,0,', '3']}
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), CorrectionRequestHandler)
+    server.service = CorrectionService(LATTICES)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_correction_of_a_prefix(server):
+    status, content = request(server, 'GET', '/correct?utt_id=utt1&prefix=a+b')
+    assert status == 200
+    assert content['hypothesis'] == 'a b d'
+
+    status, content = request(server, 'POST', '/correct', json.dumps({'utt_id': 'utt1', 'corrections': [[1, 'b']]}))
+    assert status == 200
+    assert content['hypothesis'] == 'a b d'
+
+    status, content = request(server, 'GET', '/stats')
+    assert status == 200
+    assert content['lattices'] == 1
+
+
+@pytest.mark.parametrize('body', ['[1, 2]', '"utt1"', 'null', '{"utt_id": ["utt1"], "prefix": "a"}',
+                                  '{"utt_id": "utt1", "prefix": 1}', 'not json'])
+def test_invalid_body_is_a_bad_request(server, body):
+    status, content = request(server, 'POST', '/correct', body)
+    assert status == 400
+    assert 'error' in content
+
+
+@pytest.mark.parametrize('length', ['abc', '-1'])
+def test_invalid_content_length_is_a_bad_request(server, length):
+    status, content = request(server, 'POST', '/correct', b'{}', {'Content-Length': length})
+    assert status == 400
+
+
+def test_unknown_utterance_is_not_found(server):
+    status, content = request(server, 'POST', '/correct', json.dumps({'utt_id': 'utt2', 'prefix': 'a'}))
+    assert status == 404
@@ -0,0 +1,63 @@
+from best_path import LatticeIndex, init_lattices, init_lattices_with_n_errors, iter_lattices, search_correct_start
+from kaldi_lattice import BINARY_MARKER, COMPACT_LATTICE_ARC, COMPACT_LATTICE_ARC_TYPE, COMPACT_LATTICE_WEIGHT, \
+    FST_HEADER, FST_MAGIC_NUMBER, INT32, INT64, CompactLattice
+
+WORD_SYMBOLS = {1: 'a', 2: 'b', 3: 'c'}
+# the arcs of every state as (next state, word id, graph cost, acoustic cost), state 3 is final
+ARCS = [[(1, 1, 0.5, 0.5)], [(2, 2, 1.0, 2.0), (2, 3, 0.5, 0.5)], [(3, 1, 0.25, 0.75)], []]
+FINALS = [False, False, False, True]
+
+
+def string(data):
+    return INT32.pack(len(data)) + data
+
+
+def compact_lattice_entry(utt_id, start, arcs, finals):
+    """
+    :return: the bytes of a lattice in a Kaldi binary archive, with a transition id on every arc
+    """
+    data = utt_id.encode() + b' ' + BINARY_MARKER + INT32.pack(FST_MAGIC_NUMBER) + string(b'vector') + \
+        string(COMPACT_LATTICE_ARC_TYPE) + FST_HEADER.pack(2, 0, 0, start, len(arcs), sum(len(a) for a in arcs))
+    for state in range(len(arcs)):
+        final = 0.0 if finals[state] else float('inf')
+        data += COMPACT_LATTICE_WEIGHT.pack(final, final, 0) + INT64.pack(len(arcs[state]))
+        for next_state, word_id, graph_cost, acoustic_cost in arcs[state]:
+            data += COMPACT_LATTICE_ARC.pack(word_id, word_id, graph_cost, acoustic_cost, 1) + INT32.pack(7) + \
+                INT32.pack(next_state)
+    return data
+
+
+def test_binary_lattice_round_trip(tmp_path):
+    archive = tmp_path / 'lat.1.ark'
+    archive.write_bytes(compact_lattice_entry('utt1', 0, ARCS, FINALS))
+    (utt_id, lattice), = iter_lattices(str(archive), WORD_SYMBOLS)
+    assert utt_id == 'utt1'
+    assert isinstance(lattice, CompactLattice)
+    assert lattice.arcs[1] == [(2, 3.0, 'b'), (2, 1.0, 'c')]
+    assert lattice.finals == FINALS
+    for search in ('dfs', 'astar', 'batch', 'auto'):
+        assert search_correct_start(['a'], lattice, search)[0] == 'a c a'
+        assert search_correct_start(['a'], lattice.to_text_lines(), search)[0] == 'a c a'
+
+
+def test_lattice_split_over_binary_archives_is_joined(tmp_path):
+    # the arcs of states 0 and 1 in one archive, the rest of the lattice in the other
+    head = [ARCS[0], ARCS[1], [], []]
+    tail = [[], [], ARCS[2], ARCS[3]]
+    (tmp_path / 'lat.1.ark').write_bytes(compact_lattice_entry('utt1', 0, head, [False] * 4))
+    (tmp_path / 'lat.2.ark').write_bytes(compact_lattice_entry('utt1', 0, tail, FINALS))
+
+    joined = [init_lattices(str(tmp_path), WORD_SYMBOLS)['utt1'],
+              init_lattices_with_n_errors(str(tmp_path), {'utt1': 'a b a'}, WORD_SYMBOLS)['utt1'],
+              LatticeIndex(str(tmp_path), WORD_SYMBOLS)['utt1']]
+    for lattice in joined:
+        assert isinstance(lattice, CompactLattice)
+        assert lattice.size() == 4
+        assert lattice.finals == FINALS
+        assert search_correct_start(['a'], lattice, 'dfs')[0] == 'a c a'
+
+
+def test_compact_lattice_joined_with_text_lines():
+    lattice = CompactLattice(0, [[(1, 1.0, 'a')], []], [False, False])
+    assert lattice + ['1 2 b 1,0,', '2'] == ['0 1 a 1.0,0,', '1 2 b 1,0,', '2']
+    assert ['1 2 b 1,0,'] + lattice == ['1 2 b 1,0,', '0 1 a 1.0,0,']
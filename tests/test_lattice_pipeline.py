@@ -0,0 +1,31 @@
+import time
+
+import pytest
+
+from lattice_pipeline import PrefetchPipeline
+
+# the first archive is the slowest to read, so with more than one reader the later archives are read first
+ARCHIVES = {'a': [('utt1', ['0 1 a 1,1,1']), ('utt2', ['0 1 b 1,1,1', '1'])],
+            'b': [('utt1', ['1'])],
+            'c': [('utt3', ['0 1 c 1,1,1', '1'])]}
+
+
+def read_archive(archive):
+    if archive == 'a':
+        time.sleep(0.1)
+    return ARCHIVES[archive]
+
+
+def test_blocks_come_in_the_order_of_the_archives():
+    for readers in (1, 3):
+        pipeline = PrefetchPipeline(['a', 'b', 'c'], read_archive, readers, queue_size=1)
+        assert list(pipeline) == ARCHIVES['a'] + ARCHIVES['b'] + ARCHIVES['c']
+        assert pipeline.statistics.archives_read == 3
+
+
+def test_error_of_a_reader_is_raised():
+    def fail(archive):
+        raise IOError(archive)
+
+    with pytest.raises(IOError, match='a'):
+        list(PrefetchPipeline(['a', 'b'], fail, 2))
@@ -0,0 +1,57 @@
+import result_cache
+
+from best_path import find_best_path
+from result_cache import ResultCache, cache_key
+
+LATTICE = ['0 1 a 1,0,', '1 2 b 3,0,', '1 2 c 1,0,', '2 3 d 1,0,', '3']
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    key = cache_key(LATTICE, ['a'], 'dfs')
+    assert cache.lookup(key) == (False, None)
+    cache.store(key, 'a c d', 3.0)
+    assert cache.lookup(key) == (True, 'a c d')
+    # a search that found no path is cached too
+    no_path_key = cache_key(LATTICE, ['x'], 'dfs')
+    cache.store(no_path_key, None)
+    assert cache.lookup(no_path_key) == (True, None)
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.close()
+
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    assert cache.lookup(key) == (True, 'a c d')
+    cache.close()
+
+
+def test_key_depends_on_lattice_correct_start_and_search():
+    key = cache_key(LATTICE, ['a'], 'dfs')
+    assert cache_key(list(LATTICE), ['a'], 'dfs') == key
+    assert cache_key(LATTICE[:1] + ['1 2 b 2,0,'] + LATTICE[2:], ['a'], 'dfs') != key
+    assert cache_key(LATTICE, ['a', 'b'], 'dfs') != key
+    assert cache_key(LATTICE, ['a'], 'astar') != key
+
+
+def test_version_bump_invalidates_the_entries(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    key = cache_key(LATTICE, ['a'], 'dfs')
+    cache.store(key, 'a b d')
+    cache.close()
+
+    monkeypatch.setattr(result_cache, 'CACHE_VERSION', result_cache.CACHE_VERSION + '.1')
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    assert cache.lookup(cache_key(LATTICE, ['a'], 'dfs')) == (False, None)
+    cache.close()
+
+
+def test_search_is_looked_up_in_the_cache(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    assert find_best_path('x y z', LATTICE, 'a c x', cache=cache) == 'a c d'
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert find_best_path('x y z', LATTICE, 'a c x', cache=cache) == 'a c d'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a cached result is used as it is, even when the lattice would give another one
+    cache.store(cache_key(LATTICE, ['a'], 'dfs'), 'a b d')
+    assert find_best_path('x y z', LATTICE, 'a c x', cache=cache) == 'a b d'
+    cache.close()
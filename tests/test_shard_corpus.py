@@ -0,0 +1,78 @@
+import random
+
+from alignment import align_utterances, write_per_utt_file
+from shard_corpus import MERGED_ERROR_STATS_FILENAME, SHARD_STORE_FILENAME, merge_shards
+from sharding import split_utterances
+from total_error_statistics import ErrorAnalysisStatistics, create_classification_store, error_analysis, \
+    init_references, load_classification_store, save_classification_store, write_error_stats_to_file
+
+WORDS = ['w' + str(i) for i in range(8)]
+
+
+def edit(rng, words):
+    words = list(words)
+    for i in range(rng.randint(0, 3)):
+        position = rng.randrange(len(words) + 1)
+        if position < len(words) and rng.random() < 0.7:
+            words[position] = rng.choice(WORDS)
+        else:
+            words.insert(position, rng.choice(WORDS))
+    return words
+
+
+def classify(directory, references, hypotheses, new_hypotheses):
+    """
+    Runs the error analysis like total_error_statistics.py with --store
+    :return: the classification store
+    """
+    write_per_utt_file(str(directory / 'per_utt'), align_utterances(references, hypotheses))
+    write_per_utt_file(str(directory / 'new_per_utt'), align_utterances(references, new_hypotheses))
+    error_stats = ErrorAnalysisStatistics()
+    with open(str(directory / 'per_utt')) as f:
+        references, hypotheses, old_error_details = init_references(f, error_stats)
+    with open(str(directory / 'new_per_utt')) as f:
+        new_references, new_hypotheses, new_error_details = init_references(f, ErrorAnalysisStatistics(), True)
+    classifications = {}
+    error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, classifications)
+    return create_classification_store(error_stats, hypotheses, old_error_details, classifications)
+
+
+def test_merged_shards_give_the_statistics_of_an_unsharded_run(tmp_path):
+    rng = random.Random(0)
+    references = {}
+    hypotheses = {}
+    new_hypotheses = {}
+    for utterance in range(300):
+        utt_id = 'utt%03d' % utterance
+        references[utt_id] = ' '.join(rng.choice(WORDS) for i in range(rng.randint(1, 10)))
+        hypotheses[utt_id] = ' '.join(edit(rng, references[utt_id].split()))
+        new_hypotheses[utt_id] = ' '.join(edit(rng, references[utt_id].split()))
+
+    whole = tmp_path / 'whole'
+    whole.mkdir()
+    store = classify(whole, references, hypotheses, new_hypotheses)
+    write_error_stats_to_file(MERGED_ERROR_STATS_FILENAME, str(whole) + '/', store['error_stats'])
+
+    manifest = {'shards': []}
+    shard_out_dirs = []
+    for shard, utt_ids in enumerate(split_utterances(sorted(references), 3)):
+        shard_dir = tmp_path / ('shard-%03d' % shard)
+        shard_dir.mkdir()
+        shard_store = classify(shard_dir, {utt_id: references[utt_id] for utt_id in utt_ids},
+                               {utt_id: hypotheses[utt_id] for utt_id in utt_ids},
+                               {utt_id: new_hypotheses[utt_id] for utt_id in utt_ids})
+        save_classification_store(str(shard_dir / SHARD_STORE_FILENAME), shard_store)
+        manifest['shards'].append({'name': shard_dir.name, 'utt_ids': utt_ids})
+        shard_out_dirs.append(str(shard_dir))
+
+    merged = tmp_path / 'merged'
+    merge_shards(manifest, shard_out_dirs, str(merged))
+    merged_store = load_classification_store(str(merged / SHARD_STORE_FILENAME))
+
+    assert merged_store['utterances'] == store['utterances']
+    merged_stats = merged_store['error_stats']
+    assert list(merged_stats.counts) == list(store['error_stats'].counts)
+    assert list(merged_stats.sums) == list(store['error_stats'].sums)
+    assert merged_stats.words_not_in_lattice.top() == store['error_stats'].words_not_in_lattice.top()
+    assert merged_stats.substitutions.top() == store['error_stats'].substitutions.top()
+    assert (merged / MERGED_ERROR_STATS_FILENAME).read_text() == (whole / MERGED_ERROR_STATS_FILENAME).read_text()
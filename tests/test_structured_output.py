@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from structured_output import write_structured_results
+
+TABLES = {'utterances': [{'utt_id': 'utt1', 'errors': 2, 'cost': 1.5, 'fixed': True, 'word': 'één'},
+                         {'utt_id': 'utt2', 'errors': 0, 'cost': 3, 'fixed': False, 'word': None}],
+          'aggregates': [{'category': 'utterances', 'count': 2}],
+          'empty': []}
+
+
+def test_jsonl_has_a_row_per_line(tmp_path):
+    write_structured_results(str(tmp_path) + '/', 'results', TABLES)
+    with open(str(tmp_path / 'results-utterances.jsonl'), encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == TABLES['utterances']
+    assert (tmp_path / 'results-empty.jsonl').read_text() == ''
+
+
+def test_npz_is_read_by_numpy(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    write_structured_results(str(tmp_path) + '/', 'results', TABLES)
+    with numpy.load(str(tmp_path / 'results.npz')) as npz:
+        assert sorted(npz.files) == ['aggregates/category', 'aggregates/count', 'utterances/cost', 'utterances/errors',
+                                     'utterances/fixed', 'utterances/utt_id', 'utterances/word']
+        assert npz['utterances/utt_id'].tolist() == ['utt1', 'utt2']
+        assert npz['utterances/errors'].dtype == numpy.int64
+        assert npz['utterances/errors'].tolist() == [2, 0]
+        assert npz['utterances/cost'].dtype == numpy.float64
+        assert npz['utterances/cost'].tolist() == [1.5, 3.0]
+        assert npz['utterances/fixed'].dtype == numpy.bool_
+        assert npz['utterances/fixed'].tolist() == [True, False]
+        assert npz['utterances/word'].tolist() == ['één', '']
+        assert npz['aggregates/count'].tolist() == [2]
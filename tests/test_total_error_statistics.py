@@ -0,0 +1,70 @@
+import random
+
+from alignment import align_utterances, write_per_utt_file
+from heavy_hitters import SpaceSaving
+from total_error_statistics import ErrorAnalysisStatistics, create_classification_store, error_analysis, \
+    init_references, update_error_analysis
+
+WORDS = ['w' + str(i) for i in range(6)]
+
+
+def edit(rng, words):
+    words = list(words)
+    for i in range(rng.randint(0, 3)):
+        position = rng.randrange(len(words) + 1)
+        if position < len(words) and rng.random() < 0.7:
+            words[position] = rng.choice(WORDS)
+        else:
+            words.insert(position, rng.choice(WORDS))
+    return words
+
+
+def write_corpus(path, references, hypotheses):
+    write_per_utt_file(str(path), align_utterances(references, hypotheses))
+    return path
+
+
+def full_run(reference_file, new_reference_file, capacity):
+    error_stats = ErrorAnalysisStatistics()
+    # a small capacity so words are dropped from the heavy hitters
+    error_stats.words_not_in_lattice = SpaceSaving(capacity)
+    error_stats.words_next_error_not_fixed = SpaceSaving(capacity)
+    with open(str(reference_file)) as f:
+        references, hypotheses, old_error_details = init_references(f, error_stats)
+    with open(str(new_reference_file)) as f:
+        new_references, new_hypotheses, new_error_details = init_references(f, ErrorAnalysisStatistics(), True)
+    classifications = {}
+    error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, classifications)
+    return error_stats, hypotheses, old_error_details, classifications
+
+
+def test_update_gives_the_statistics_of_a_full_run(tmp_path):
+    rng = random.Random(0)
+    references = {}
+    hypotheses = {}
+    new_hypotheses = {}
+    changed_hypotheses = {}
+    for utterance in range(200):
+        utt_id = 'utt%03d' % utterance
+        references[utt_id] = ' '.join(rng.choice(WORDS) for i in range(rng.randint(1, 8)))
+        hypotheses[utt_id] = ' '.join(edit(rng, references[utt_id].split()))
+        new_hypotheses[utt_id] = ' '.join(edit(rng, references[utt_id].split()))
+        changed_hypotheses[utt_id] = (' '.join(edit(rng, references[utt_id].split())) if rng.random() < 0.3
+                                      else new_hypotheses[utt_id])
+    reference_file = write_corpus(tmp_path / 'per_utt', references, hypotheses)
+    new_reference_file = write_corpus(tmp_path / 'new_per_utt', references, new_hypotheses)
+    changed_reference_file = write_corpus(tmp_path / 'changed_per_utt', references, changed_hypotheses)
+
+    store = create_classification_store(*full_run(reference_file, new_reference_file, 3))
+    changed = {utt_id for utt_id in references if changed_hypotheses[utt_id] != new_hypotheses[utt_id]}
+    with open(str(changed_reference_file)) as f:
+        changed_references, changed_new_hypotheses, changed_error_details = init_references(
+            f, ErrorAnalysisStatistics(), True, changed)
+    assert update_error_analysis(store, changed_new_hypotheses, changed_error_details) == len(changed)
+
+    error_stats = full_run(reference_file, changed_reference_file, 3)[0]
+    updated_stats = store['error_stats']
+    assert list(updated_stats.counts) == list(error_stats.counts)
+    assert list(updated_stats.sums) == list(error_stats.sums)
+    assert updated_stats.words_not_in_lattice.top() == error_stats.words_not_in_lattice.top()
+    assert updated_stats.words_next_error_not_fixed.top() == error_stats.words_next_error_not_fixed.top()
@@ -1,63 +1,132 @@
 import argparse
 import os
+import pickle
 import errno
 import time
 
+from array import array
+
+from heavy_hitters import SpaceSaving
+from sharding import map_shards, split_utterances
+from structured_output import write_structured_results
+from vocabulary import utterance_words
+
+# Every category is counted per number of errors in the original hypothesis. Besides the number of utterances
+# a sum over the utterances is kept, the utterance length or the number of errors remaining after the correction
+UTTERANCES = 0
+CORRECTION_NOT_IN_LATTICE = 1
+ALL_ERRORS_FIXED = 2
+NEXT_ERROR_FIXED = 3
+NEXT_ERROR_NOT_FIXED = 4
+NEW_ERRORS_ADDED = 5
+N_ERRORS_FIXED = 6
+N_ERRORS_NOT_FIXED = 7
+NEXT_ERROR_FIXED_NO_NEW_ERRORS = 8
+NEXT_ERROR_FIXED_NEW_ERRORS = 9
+NEXT_ERROR_NOT_FIXED_NO_NEW_ERRORS = 10
+NEXT_ERROR_NOT_FIXED_NEW_ERRORS = 11
+N_ERRORS_FIXED_NO_NEW_ERRORS = 12
+N_ERRORS_FIXED_NEW_ERRORS = 13
+N_ERRORS_NOT_FIXED_NO_NEW_ERRORS = 14
+N_ERRORS_NOT_FIXED_NEW_ERRORS = 15
+ERRORS_ADDED_BEFORE_NEXT_ERROR = 16
+NUMBER_OF_CATEGORIES = 17
+# the names of the categories in the structured output
+CATEGORY_NAMES = ('utterances', 'correction_not_in_lattice', 'all_errors_fixed', 'next_error_fixed', 'next_error_not_fixed',
+                  'new_errors_added', 'n_errors_fixed', 'n_errors_not_fixed', 'next_error_fixed_no_new_errors',
+                  'next_error_fixed_new_errors', 'next_error_not_fixed_no_new_errors', 'next_error_not_fixed_new_errors',
+                  'n_errors_fixed_no_new_errors', 'n_errors_fixed_new_errors', 'n_errors_not_fixed_no_new_errors',
+                  'n_errors_not_fixed_new_errors', 'errors_added_before_next_error')
+# the format of the classification store, a store without it was written before the heavy hitters were tracked
+CLASSIFICATION_STORE_VERSION = 2
+
+LARGE_ERRORS = 15
+LARGE_ERRORS_KEY = '15-32'
+# the number of most frequent words and substitutions written with the statistics
+HEAVY_HITTERS_REPORTED = 20
+
 
 class ErrorAnalysisStatistics:
     def __init__(self):
-        self.number_of_utterances_per_error = {}
-
-        self.number_of_correction_not_contained_in_lattice = {}
-
-        self.utterance_average_length = {'total': 0}
+        # the counts and sums of every category and error count, the ones for utterances with error errors
+        # in category are at index error * NUMBER_OF_CATEGORIES + category
+        self.counts = array('q')
+        self.sums = array('q')
 
         self.utterances_per_error = {}
-        
-        self.all_errors_fixed_in_utterances_per_error = {}
-        self.next_error_fixed_in_utt_per_error = {}
-        self.next_error_NOT_fixed_in_utt_per_error = {}
-        self.new_errors_added_in_utt_per_error = {}
-        self.n_errors_fixed_in_utt_per_error = {}
-        self.n_errors_NOT_fixed_in_utt_per_error = {}
-
-        self.next_error_fixed_no_new_errors = {}
-        self.next_error_fixed_no_new_errors_no_errors = {}
-
-        self.next_error_fixed_new_errors = {}
-        self.next_error_fixed_new_errors_no_errors = {}
-
-        self.next_error_not_fixed_no_new_errors = {}
-        self.next_error_not_fixed_no_new_errors_no_errors = {}
-
-        self.next_error_not_fixed_new_errors = {}
-        self.next_error_not_fixed_new_errors_no_errors = {}
-
-        self.n_errors_fixed_no_new_errors = {}
-        self.n_errors_fixed_no_new_errors_no_errors = {}
-
-        self.n_errors_fixed_new_errors = {}
-        self.n_errors_fixed_new_errors_no_errors = {}
-
-        self.n_errors_not_fixed_no_new_errors = {}
-        self.n_errors_not_fixed_no_new_errors_no_errors = {}
-
-        self.n_errors_not_fixed_new_errors = {}
-        self.n_errors_not_fixed_new_errors_no_errors = {}
-
-        self.number_of_errors_added_before_second_error = {}
-
-        self.words_not_in_lattice = {}
 
-        self.words_next_error_not_fixed = {}
-        self.words_next_error_not_fixed_arr = []
+        # the most frequent words and substitutions, counted in fixed memory
+        self.words_not_in_lattice = SpaceSaving()
+        self.words_next_error_not_fixed = SpaceSaving()
+        # (reference word, hypothesis word) of the substitutions in the original hypotheses
+        self.substitutions = SpaceSaving()
+
+    def add_error(self, category, error, error_cnt=0, count=1):
+        index = error * NUMBER_OF_CATEGORIES + category
+        if index >= len(self.counts):
+            self.resize(error + 1)
+        self.counts[index] += count
+        self.sums[index] += count * error_cnt
+
+    def resize(self, number_of_errors):
+        size = number_of_errors * NUMBER_OF_CATEGORIES
+        self.counts.extend([0] * (size - len(self.counts)))
+        self.sums.extend([0] * (size - len(self.sums)))
+
+    def count(self, category):
+        """
+        :param category: one of the categories, e.g. NEXT_ERROR_FIXED
+        :return: a dictionary of the number of utterances in the category per error count
+        """
+        indices = range(category, len(self.counts), NUMBER_OF_CATEGORIES)
+        return {error: self.counts[index] for error, index in enumerate(indices) if self.counts[index] != 0}
+
+    def sum(self, category):
+        """
+        :param category: one of the categories, e.g. NEXT_ERROR_FIXED_NEW_ERRORS
+        :return: a dictionary of the sum over the utterances in the category per error count
+        """
+        indices = range(category, len(self.counts), NUMBER_OF_CATEGORIES)
+        return {error: self.sums[index] for error, index in enumerate(indices) if self.counts[index] != 0}
+
+    def merge(self, other):
+        """
+        Adds the statistics of other to these statistics, e.g. to combine the statistics of parts of a corpus
+        :param other: an ErrorAnalysisStatistics
+        :return: these statistics
+        """
+        if len(other.counts) > len(self.counts):
+            self.resize(len(other.counts) // NUMBER_OF_CATEGORIES)
+        for index in range(len(other.counts)):
+            self.counts[index] += other.counts[index]
+            self.sums[index] += other.sums[index]
+
+        for error in other.utterances_per_error:
+            if error not in self.utterances_per_error:
+                self.utterances_per_error[error] = {}
+            self.utterances_per_error[error].update(other.utterances_per_error[error])
+        self.words_not_in_lattice.merge(other.words_not_in_lattice)
+        self.words_next_error_not_fixed.merge(other.words_next_error_not_fixed)
+        self.substitutions.merge(other.substitutions)
+        return self
+
+
+class ErrorClassification:
+    def __init__(self):
+        self.has_new_error = False
+        self.next_error = None
+        self.next_error_fixed = False
+        self.n_errors_fixed = False
+        self.error_added_before_next = False
 
 
-def init_references(reference_file, error_stats, isNew=False):
+def init_references(reference_file, error_stats, isNew=False, utt_ids=None, vocabulary=None):
     """
     Creates reference file of utterances containing only specific number of errors
     :param      error_stats:
     :param      reference_file: perutt file containing all reference utterances and hypothesised recognition
+    :param      utt_ids: only the utterances with these ids are read, all are read if not given
+    :param      vocabulary: a Vocabulary, if given the references and hypotheses are kept as arrays of word ids
     :return:    a list of all references with n_errors, a list of all hypotheses with n_errors and
                 then a list of all other references and hypotheses
     """
@@ -65,224 +134,400 @@ def init_references(reference_file, error_stats, isNew=False):
     hypothesis = {}
 
     error_details = {}
-
-    total_number_large_errors = 0
-    large_errors_key = '15-32'
+    # the aligned words of the utterance, with *** for insertions and deletions
+    aligned = {}
 
     for line in reference_file.readlines():
         utt_id, info, *utt_arr = line.split()
+        if utt_ids is not None and utt_id not in utt_ids:
+            continue
+        if info in ('ref', 'hyp'):
+            aligned[info] = utt_arr
         if info == 'ref':
             # remove insertion symbols from ref to be able to match the original reference from nbest
             utt = ' '.join(utt_arr).replace('***', '')
-            references[utt_id] = utt.strip()
+            references[utt_id] = utt.strip() if vocabulary is None else vocabulary.encode(utt)
         elif info == 'hyp':
             # remove insertion symbols from hyp to be able to match the original reference from nbest
             utt = ' '.join(utt_arr).replace('***', '')
-            hypothesis[utt_id] = utt.strip()
+            hypothesis[utt_id] = utt.strip() if vocabulary is None else vocabulary.encode(utt)
         elif info == '#csid':
             error_count = 0
             # the first number is the number of correct
             for error in range(1, len(utt_arr)):
                 error_count += int(utt_arr[error])
 
-            utt_length = len(references[utt_id].split())
-            if error_count not in error_stats.number_of_utterances_per_error:
-                error_stats.number_of_utterances_per_error[error_count] = 1
-                error_stats.utterance_average_length[error_count] = utt_length
+            utt_length = len(utterance_words(references[utt_id]))
+            error_stats.add_error(UTTERANCES, error_count, utt_length)
+            if error_count not in error_stats.utterances_per_error:
                 error_stats.utterances_per_error[error_count] = {utt_id: references[utt_id]}
             else:
-                error_stats.number_of_utterances_per_error[error_count] += 1
-                error_stats.utterance_average_length[error_count] += utt_length
                 error_stats.utterances_per_error[error_count][utt_id] = references[utt_id]
+        if info == 'op':
+            error_details[utt_id] = find_error_details(utt_arr, isNew)
+            if not isNew and len(aligned.get('ref', [])) == len(utt_arr) == len(aligned.get('hyp', [])):
+                for position in range(len(utt_arr)):
+                    if utt_arr[position] == 'S':
+                        error_stats.substitutions.add((aligned['ref'][position], aligned['hyp'][position]))
+            aligned = {}
+
+    return references, hypothesis, error_details
+
+
+def find_error_details(ops, isNew=False):
+    """
+    Finds the errors and error positions of an utterance from the operations of its alignment
+    :param ops: the C, S, I and D operations, as on the op line of a perutt file
+    :param isNew: the operations are of a new hypothesis, the positions of the original errors
+                  are moved back by one after a first insertion
+    :return: the errors as (type, position) tuples
+    """
+    errors = []
+    for i in range(len(ops)):
+        if ops[i] != 'C':
+            if not isNew and len(errors) >= 1 and errors[0][0] == 'I':
+                # Only check for this if we are looking at the original errors
+                errors.append((ops[i], i-1))
+            else:
+                errors.append((ops[i], i))
+    return tuple(errors)
+
+
+def compute_average_length(error_stats):
+    """
+    Computes the average utterance length from the summed lengths, per error count, for the utterances
+    with LARGE_ERRORS or more errors and for all utterances
+    :param error_stats: an ErrorAnalysisStatistics
+    :return: a dictionary of average lengths
+    """
+    number_of_utterances = error_stats.count(UTTERANCES)
+    utterance_length = error_stats.sum(UTTERANCES)
+
+    average_length = {'total': sum(utterance_length.values()) / max(1, sum(number_of_utterances.values()))}
+    for error in number_of_utterances:
+        average_length[error] = utterance_length[error] / number_of_utterances[error]
+
+    number_of_large_errors = sum(number_of_utterances[error] for error in number_of_utterances if error >= LARGE_ERRORS)
+    if number_of_large_errors != 0:
+        large_errors_length = sum(utterance_length[error] for error in utterance_length if error >= LARGE_ERRORS)
+        average_length[LARGE_ERRORS_KEY] = large_errors_length / number_of_large_errors
+    return average_length
+
+
+def classify_errors(old_errors, new_errors):
+    """
+    Compares the errors that remain in the old hypothesis after the first error is fixed to the errors
+    in the new hypothesis. The errors are hashable (type, position) tuples, so every comparison is a set operation
+    :param old_errors: the errors of the old hypothesis, in order
+    :param new_errors: the errors of the new hypothesis, in order
+    :return: an ErrorClassification
+    """
+    remaining_errors = frozenset(old_errors[1:])
+    new_error_set = frozenset(new_errors)
+
+    classification = ErrorClassification()
+    # errors are unique per utterance, so new errors were added if any error in the new hypothesis is not an old one
+    classification.has_new_error = not new_error_set <= remaining_errors
+    if len(old_errors) > 1:
+        classification.next_error = old_errors[1]
+        classification.next_error_fixed = old_errors[1] not in new_error_set
+        classification.n_errors_fixed = remaining_errors.isdisjoint(new_error_set)
+        # the errors are ordered by position, so only the first new error can come before the next error
+        classification.error_added_before_next = len(new_errors) != 0 and new_errors[0][1] < old_errors[1][1]
+    return classification
+
+
+def classify_utterance(error, reference, hypothesis, new_hypothesis, old_errors, new_errors, vocabulary=None):
+    """
+    Finds every category an utterance is counted in
+    :param error: the number of errors in the hypothesis
+    :param reference: the reference
+    :param hypothesis: the old hypothesis
+    :param new_hypothesis: the new hypothesis
+    :param old_errors: the errors of the old hypothesis as (type, position) tuples
+    :param new_errors: the errors of the new hypothesis as (type, position) tuples
+    :param vocabulary: a Vocabulary, if given the utterances are arrays of word ids from it
+    :return: a list of the categories with the number of errors in the new hypothesis to add to their sums, the word
+             of the first error if the correction was not in the lattice and the word of the next error if it was not fixed
+    """
+    categories = []
+    word_not_in_lattice = None
+    word_next_error_not_fixed = None
+
+    ref_arr = utterance_words(reference)
+    new_hyp_arr = utterance_words(new_hypothesis)
+    hyp_arr = utterance_words(hypothesis)
+
+    new_hyp_error_cnt = len(new_errors)
+
+    # count all errors fixed
+    if ref_arr == new_hyp_arr:
+        categories.append((ALL_ERRORS_FIXED, 0))
+
+    # only check if the hypothesis was changed
+    if ref_arr == new_hyp_arr and error > 1:
+        categories.append((NEXT_ERROR_FIXED, 0))
 
-            if error_count >= 15:
-                total_number_large_errors += 1
-                if large_errors_key not in error_stats.utterance_average_length:
-                    error_stats.utterance_average_length[large_errors_key] = utt_length
+        categories.append((NEXT_ERROR_FIXED_NO_NEW_ERRORS, new_hyp_error_cnt))
+
+        categories.append((N_ERRORS_FIXED, 0))
+
+        categories.append((N_ERRORS_FIXED_NO_NEW_ERRORS, new_hyp_error_cnt))
+
+    elif new_hyp_arr != hyp_arr:
+        classification = classify_errors(old_errors, new_errors)
+        has_new_error = classification.has_new_error
+        if error > 1:
+            next_error_in_hyp = classification.next_error
+
+            # count is next error fixed
+            if classification.next_error_fixed:
+                categories.append((NEXT_ERROR_FIXED, 0))
+               # check if other errors are added
+                if has_new_error:
+                    categories.append((NEXT_ERROR_FIXED_NEW_ERRORS, new_hyp_error_cnt))
                 else:
-                    error_stats.utterance_average_length[large_errors_key] += utt_length
+                    categories.append((NEXT_ERROR_FIXED_NO_NEW_ERRORS, new_hyp_error_cnt))
+            else:
+                categories.append((NEXT_ERROR_NOT_FIXED, 0))
 
-            error_stats.utterance_average_length['total'] += utt_length
-        if info == 'op':
-            # find the first n errors and error positions, this is only for results
-            error_count = 0
-            error_type = {}
-            for i in range(len(utt_arr)):
-                if utt_arr[i] != 'C':
-                    if not isNew and error_count >= 1 and error_type[0][0] == 'I':
-                        # Only check for this if we are looking at the original errors
-                        error_type[error_count] = [utt_arr[i], i-1]
-                    elif isNew:
-                        # For easier comparison the new error starts at 1 not zero
-                        error_type[error_count+1] = [utt_arr[i], i]
-                    else:
-                        error_type[error_count] = [utt_arr[i], i]
-                    error_count += 1
-            error_details[utt_id] = error_type
-
-    compute_average_length(error_stats, len(references), total_number_large_errors)
+                # check if other errors are added
+                if has_new_error:
+                    categories.append((NEXT_ERROR_NOT_FIXED_NEW_ERRORS, new_hyp_error_cnt))
+                else:
+                    categories.append((NEXT_ERROR_NOT_FIXED_NO_NEW_ERRORS, new_hyp_error_cnt))
+
+                # obtain the word at the error index in the reference that is not fixed
+                # if the reference is shorter than the error index, There is an insertion error at the end
+                if len(ref_arr)-1 >= next_error_in_hyp[1]:
+                    word_next_error_not_fixed = ref_arr[next_error_in_hyp[1]]
+
+            # count if n errors are fixed
+            if classification.n_errors_fixed:
+                categories.append((N_ERRORS_FIXED, 0))
+                # check if others were added
+                if has_new_error:
+                    categories.append((N_ERRORS_FIXED_NEW_ERRORS, new_hyp_error_cnt))
+                else:
+                    categories.append((N_ERRORS_FIXED_NO_NEW_ERRORS, new_hyp_error_cnt))
+            else:
+                categories.append((N_ERRORS_NOT_FIXED, 0))
+                # check if others were added
+                if has_new_error:
+                    categories.append((N_ERRORS_NOT_FIXED_NEW_ERRORS, new_hyp_error_cnt))
+                else:
+                    categories.append((N_ERRORS_NOT_FIXED_NO_NEW_ERRORS, new_hyp_error_cnt))
 
-    return references, hypothesis, error_details
+            if classification.error_added_before_next:
+                categories.append((ERRORS_ADDED_BEFORE_NEXT_ERROR, 0))
+
+        # count if new errors are added
+        if has_new_error:
+            categories.append((NEW_ERRORS_ADDED, 0))
+    elif new_hyp_arr == hyp_arr and ref_arr != hyp_arr:
+        categories.append((CORRECTION_NOT_IN_LATTICE, 0))
+        # create a list of the words not presented in the lattices
+        word_not_in_lattice = find_correct_start(ref_arr, hyp_arr)[1]
 
+    if vocabulary is not None:
+        # the words are kept as words, so the classification does not depend on the vocabulary
+        if isinstance(word_not_in_lattice, int):
+            # find_correct_start gives an empty string if the hypothesis only has words after the reference
+            word_not_in_lattice = vocabulary.word(word_not_in_lattice)
+        if word_next_error_not_fixed is not None:
+            word_next_error_not_fixed = vocabulary.word(word_next_error_not_fixed)
 
-def compute_average_length(error_stats, number_of_utterances, total_number_large_errors):
-    for error in error_stats.number_of_utterances_per_error:
-        error_stats.utterance_average_length[error] = error_stats.utterance_average_length[error] / error_stats.number_of_utterances_per_error[error]
-    error_stats.utterance_average_length['total'] = error_stats.utterance_average_length['total'] / number_of_utterances
-    error_stats.utterance_average_length['15-32'] = error_stats.utterance_average_length['15-32'] / total_number_large_errors
-    return error_stats
+    return categories, word_not_in_lattice, word_next_error_not_fixed
 
 
-def are_n_error_fixed(new_error_details, old_error_details):
-    # check if every error in the old error details are fixed
-    number_of_errors_not_fixed = 0
-    for old_error in old_error_details:
-        for new_error in new_error_details:
-            if new_error_details[new_error] == old_error_details[old_error]:
-                number_of_errors_not_fixed += 1
-                break
-    return True if number_of_errors_not_fixed == 0 else False
+def count_utterance(error_stats, error, classification, count=1, words=True):
+    """
+    Counts an utterance in the categories it was classified in
+    :param error_stats: an ErrorAnalysisStatistics
+    :param error: the number of errors in the hypothesis
+    :param classification: the classification of the utterance from classify_utterance
+    :param count: 1 to add the utterance, -1 to remove it again
+    :param words: also count the words of the classification in the heavy hitters
+    """
+    categories = classification[0]
+    for category, error_cnt in categories:
+        error_stats.add_error(category, error, error_cnt, count)
 
+    if words:
+        count_words(error_stats, classification, count)
 
-def is_next_error_fixed(new_error_details, next_error):
-    for error in new_error_details:
-        if new_error_details[error] == next_error:
-            return False
-    return True
+
+def count_words(error_stats, classification, count=1):
+    """
+    Counts the word of the correction that is not in the lattice and of the next error that is not fixed
+    of an utterance in the heavy hitters
+    """
+    categories, word_not_in_lattice, word_next_error_not_fixed = classification
+    if word_not_in_lattice is not None:
+        error_stats.words_not_in_lattice.add(word_not_in_lattice, count)
+    if word_next_error_not_fixed is not None:
+        error_stats.words_next_error_not_fixed.add(word_next_error_not_fixed, count)
 
 
-def new_errors_added(new_error_details, old_error_details):
+def error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, classifications=None,
+                   vocabulary=None):
     """
-    Checks if new error details contain new errors
-    :param new_error_details:
-    :param old_error_details:
-    :return:
+    Counts every utterance in the categories it is classified in
+    :param classifications: a dictionary to store the classification of each utterance in, e.g. for update_error_analysis
+    :param vocabulary: a Vocabulary, if given the utterances are arrays of word ids from it
     """
-    if len(new_error_details) > len(old_error_details):
-        return True
-    elif new_error_details == old_error_details:
-        return False
+    for error in error_stats.utterances_per_error:
+        for utt_id in error_stats.utterances_per_error[error]:
+            classification = classify_utterance(error, error_stats.utterances_per_error[error][utt_id], hypotheses[utt_id],
+                                                new_hypotheses[utt_id], old_error_details[utt_id], new_error_details[utt_id],
+                                                vocabulary)
+            count_utterance(error_stats, error, classification)
+            if classifications is not None:
+                classifications[utt_id] = classification
 
-    for new_error in new_error_details:
-        is_new_error = True
-        for old_error in old_error_details:
-            if new_error_details[new_error] == old_error_details[old_error]:
-                is_new_error = False
-                break
-        if is_new_error:
-            # it is enough that one new error is added
-            return True
-    return False
 
+def analyse_shard(task):
+    """
+    Runs the error analysis on a shard of the utterances, the task of a worker process
+    :param task: an ErrorAnalysisStatistics with the utterances of the shard, and the new hypotheses,
+                 hypotheses, old error details and new error details of those utterances and the vocabulary
+    :return: the ErrorAnalysisStatistics of the shard and the classification of each utterance in it
+    """
+    shard_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, vocabulary = task
+    classifications = {}
+    error_analysis(shard_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, classifications,
+                   vocabulary)
+    return shard_stats, classifications
 
-def add_error(error_type, error, error_cnt_stats=None, error_cnt=0):
-    if error not in error_type:
-        error_type[error] = 1
-    else:
-        error_type[error] += 1
 
-    if error_cnt_stats is not None:
-        if error not in error_cnt_stats:
-            error_cnt_stats[error] = error_cnt
-        else:
-            error_cnt_stats[error] += error_cnt
+def sharded_error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details, number_of_shards,
+                           workers, classifications=None, vocabulary=None):
+    """
+    Splits the utterances into shards by utterance id, runs the error analysis of every shard in a process pool
+    and merges the statistics of the shards into error_stats. The result is the same as from error_analysis
+    :param number_of_shards: the number of shards to split the utterances into
+    :param workers: the number of worker processes
+    :param classifications: a dictionary to store the classification of each utterance in
+    :param vocabulary: a Vocabulary, if given the utterances are arrays of word ids from it
+    """
+    utt_errors = {}
+    for error in error_stats.utterances_per_error:
+        for utt_id in error_stats.utterances_per_error[error]:
+            utt_errors[utt_id] = error
+
+    tasks = []
+    for shard in split_utterances(utt_errors, number_of_shards):
+        shard_stats = ErrorAnalysisStatistics()
+        for utt_id in shard:
+            error = utt_errors[utt_id]
+            if error not in shard_stats.utterances_per_error:
+                shard_stats.utterances_per_error[error] = {}
+            shard_stats.utterances_per_error[error][utt_id] = error_stats.utterances_per_error[error][utt_id]
+        tasks.append((shard_stats,
+                      {utt_id: new_hypotheses[utt_id] for utt_id in shard},
+                      {utt_id: hypotheses[utt_id] for utt_id in shard},
+                      {utt_id: old_error_details[utt_id] for utt_id in shard},
+                      {utt_id: new_error_details[utt_id] for utt_id in shard},
+                      vocabulary))
+
+    for shard_stats, shard_classifications in map_shards(analyse_shard, tasks, workers):
+        error_stats.merge(shard_stats)
+        if classifications is not None:
+            classifications.update(shard_classifications)
+    return error_stats
 
 
-def error_analysis(error_stats, new_hypotheses, hypotheses, old_error_details, new_error_details):
+def create_classification_store(error_stats, hypotheses, old_error_details, classifications):
+    """
+    Creates a store of the statistics and of what is needed to classify each utterance again
+    :param error_stats: the ErrorAnalysisStatistics after the error analysis
+    :param hypotheses: the old hypotheses
+    :param old_error_details: the errors of the old hypotheses
+    :param classifications: the classification of each utterance from error_analysis
+    :return: a dictionary with the statistics and the number of errors, old hypothesis, old errors
+             and classification of each utterance
+    """
+    utterances = {}
     for error in error_stats.utterances_per_error:
         for utt_id in error_stats.utterances_per_error[error]:
+            utterances[utt_id] = (error, hypotheses[utt_id], old_error_details[utt_id], classifications[utt_id])
+    return {'error_stats': error_stats, 'utterances': utterances}
+
+
+def save_classification_store(filename, store):
+    # the fields of the statistics are stored instead of the object, so the store can be read
+    # whether this module was run as a script or imported
+    with open(filename, 'wb') as f:
+        pickle.dump({'version': CLASSIFICATION_STORE_VERSION, 'error_stats': vars(store['error_stats']),
+                     'utterances': store['utterances']}, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_classification_store(filename):
+    with open(filename, 'rb') as f:
+        store = pickle.load(f)
+    version = store.pop('version', 1)
+    if version != CLASSIFICATION_STORE_VERSION:
+        raise ValueError('The store ' + filename + ' has format version ' + str(version) + ', this version reads format ' +
+                         str(CLASSIFICATION_STORE_VERSION) + ', regenerate it with a full run with --store')
+    error_stats = ErrorAnalysisStatistics()
+    vars(error_stats).update(store['error_stats'])
+    store['error_stats'] = error_stats
+    return store
 
-            ref_arr = error_stats.utterances_per_error[error][utt_id].split()
-            new_hyp_arr = new_hypotheses[utt_id].split()
-            hyp_arr = hypotheses[utt_id].split()
-
-            new_hyp_error_cnt = len(new_error_details[utt_id])
-
-            # count all errors fixed
-            if ref_arr == new_hyp_arr:
-                add_error(error_stats.all_errors_fixed_in_utterances_per_error, error)
-
-            # only check if the hypothesis was changed
-            if ref_arr == new_hyp_arr and error > 1:
-                add_error(error_stats.next_error_fixed_in_utt_per_error, error)
-
-                add_error(error_stats.next_error_fixed_no_new_errors, error, error_stats.next_error_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
-
-                add_error(error_stats.n_errors_fixed_in_utt_per_error, error)
-
-                add_error(error_stats.n_errors_fixed_no_new_errors, error, error_stats.n_errors_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
-
-            elif new_hyp_arr != hyp_arr:
-                old_error_details[utt_id].pop(0, None)
-                has_new_error = new_errors_added(new_error_details[utt_id], old_error_details[utt_id])
-                if error > 1:
-                    next_error_in_hyp = old_error_details[utt_id][1]
-                    next_error_fixed = is_next_error_fixed(new_error_details[utt_id], next_error_in_hyp)
-                    if error > 2:
-                        n_errors_fixed = are_n_error_fixed(new_error_details[utt_id], old_error_details[utt_id])
-                    else:
-                        n_errors_fixed = True if next_error_fixed else False
-
-                    # count is next error fixed
-                    if next_error_fixed:
-                        add_error(error_stats.next_error_fixed_in_utt_per_error, error)
-                       # check if other errors are added
-                        if has_new_error:
-                            add_error(error_stats.next_error_fixed_new_errors, error, error_stats.next_error_fixed_new_errors_no_errors, new_hyp_error_cnt)
-                        else:
-                            add_error(error_stats.next_error_fixed_no_new_errors, error, error_stats.next_error_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
-                    else:
-                        add_error(error_stats.next_error_NOT_fixed_in_utt_per_error, error)
-
-                        # check if other errors are added
-                        if has_new_error:
-                            add_error(error_stats.next_error_not_fixed_new_errors, error, error_stats.next_error_not_fixed_new_errors_no_errors, new_hyp_error_cnt)
-                        else:
-                            add_error(error_stats.next_error_not_fixed_no_new_errors, error, error_stats.next_error_not_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
-
-                        # obtain the word at the error index in the reference that is not fixed
-                        # if the reference is shorter than the error index, There is an insertion error at the end
-                        if len(ref_arr)-1 >= next_error_in_hyp[1]:
-                            error_stats.words_next_error_not_fixed_arr.append(ref_arr[next_error_in_hyp[1]])
-
-                    # count if n errors are fixed
-                    if n_errors_fixed:
-                        add_error(error_stats.n_errors_fixed_in_utt_per_error, error)
-                        # check if others were added
-                        if has_new_error:
-                            add_error(error_stats.n_errors_fixed_new_errors, error, error_stats.n_errors_fixed_new_errors_no_errors, new_hyp_error_cnt)
-                        else:
-                            add_error(error_stats.n_errors_fixed_no_new_errors, error, error_stats.n_errors_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
-                    else:
-                        add_error(error_stats.n_errors_NOT_fixed_in_utt_per_error, error)
-                        # check if others were added
-                        if has_new_error:
-                            add_error(error_stats.n_errors_not_fixed_new_errors, error, error_stats.n_errors_not_fixed_new_errors_no_errors, new_hyp_error_cnt)
-                        else:
-                            add_error(error_stats.n_errors_not_fixed_no_new_errors, error, error_stats.n_errors_not_fixed_no_new_errors_no_errors, new_hyp_error_cnt)
-
-                if error > 1:
-                    if check_if_error_added_before_next(new_error_details[utt_id], old_error_details[utt_id]):
-                        add_error(error_stats.number_of_errors_added_before_second_error, error)
-
-                # count if new errors are added
-                compute_new_errors_added_stats(old_error_details[utt_id], new_error_details[utt_id], has_new_error, error_stats, error)
-            elif new_hyp_arr == hyp_arr and ref_arr != hyp_arr:
-                add_error(error_stats.number_of_correction_not_contained_in_lattice, error)
-                # create a list of the words not presented in the lattices
-                mismatch = find_correct_start(ref_arr, hyp_arr)
-                if mismatch[1] not in error_stats.words_not_in_lattice:
-                    error_stats.words_not_in_lattice[mismatch[1]] = 1
-                else:
-                    error_stats.words_not_in_lattice[mismatch[1]] += 1
 
+def read_changed_utterances(changed_files):
+    """
+    Reads the ids of the utterances that changed, e.g. from the applied_to_new_*.txt files written by best_path.py
+    :param changed_files: files with an utterance id at the start of each line
+    :return: a set of utterance ids
+    """
+    utt_ids = set()
+    for changed_file in changed_files:
+        for line in changed_file:
+            if line.strip():
+                utt_ids.add(line.split()[0])
+    return utt_ids
 
-def check_if_error_added_before_next(new_errors, old_errors):
-    first_old_error = old_errors[1][1]
-    for error in new_errors:
-        if new_errors[error][1] < first_old_error:
-            return True
-    return False
+
+def update_error_analysis(store, new_hypotheses, new_error_details):
+    """
+    Classifies the utterances with a new hypothesis again and updates the statistics in the store,
+    the utterance is removed from the categories of its old classification and added to the new ones
+    :param store: a store from create_classification_store or load_classification_store
+    :param new_hypotheses: the new hypotheses of the changed utterances
+    :param new_error_details: the errors of the new hypotheses of the changed utterances
+    :return: the number of utterances classified again
+    """
+    error_stats = store['error_stats']
+    utterances = store['utterances']
+    updated = 0
+    for utt_id in new_hypotheses:
+        if utt_id not in utterances:
+            continue
+        error, hypothesis, old_errors, old_classification = utterances[utt_id]
+        classification = classify_utterance(error, error_stats.utterances_per_error[error][utt_id], hypothesis,
+                                            new_hypotheses[utt_id], old_errors, new_error_details[utt_id])
+        count_utterance(error_stats, error, old_classification, -1, words=False)
+        count_utterance(error_stats, error, classification, words=False)
+        utterances[utt_id] = (error, hypothesis, old_errors, classification)
+        updated += 1
+    if updated > 0:
+        recount_words(error_stats, utterances)
+    return updated
+
+
+def recount_words(error_stats, utterances):
+    """
+    Counts the words of the classification of every utterance in the store in new heavy hitters. A word the heavy
+    hitters dropped can not be removed again, so removing the old classification of a changed utterance would make
+    the counts differ from those of a full run. The utterances are counted in the order a full run counts them
+    :param error_stats: an ErrorAnalysisStatistics
+    :param utterances: the utterances of a store from create_classification_store
+    """
+    error_stats.words_not_in_lattice = SpaceSaving(error_stats.words_not_in_lattice.capacity)
+    error_stats.words_next_error_not_fixed = SpaceSaving(error_stats.words_next_error_not_fixed.capacity)
+    for error, hypothesis, old_errors, classification in utterances.values():
+        count_words(error_stats, classification)
 
 
 def find_correct_start(reference, hypothesis):
@@ -300,19 +545,6 @@ def find_correct_start(reference, hypothesis):
     return mismatch
 
 
-def compute_new_errors_added_stats(old_error_details, new_error_details, has_new_error, error_stats, error):
-    if len(old_error_details) > len(new_error_details):
-        # if there are fewer errors in the new hyp, check if they are the same or if new were added
-        if has_new_error:
-            add_error(error_stats.new_errors_added_in_utt_per_error, error)
-    elif len(old_error_details) < len(new_error_details):
-        # if the error count in the new hyp is larger, new errors were definetely added
-        add_error(error_stats.new_errors_added_in_utt_per_error, error)
-    elif old_error_details != new_error_details:
-        # if the error count is the same, check if the errors are the same
-        add_error(error_stats.new_errors_added_in_utt_per_error, error)
-
-
 def write_error_stats_to_file(filename, out_dir, error_stats):
     """
     Writes a dictionary of utterances to file
@@ -321,57 +553,125 @@ def write_error_stats_to_file(filename, out_dir, error_stats):
     :param out_dir: location of output folder
     """
     with open(out_dir + filename, 'w') as out_file:
-        out_file.write('# errors per utt: ' + str(error_stats.number_of_utterances_per_error) + '\n\n')
-        out_file.write('# all errors fixed, per error: ' + str(error_stats.all_errors_fixed_in_utterances_per_error) + '\n\n')
-        out_file.write('# next error also fixed, per error: ' + str(error_stats.next_error_fixed_in_utt_per_error) + '\n\n')
-        out_file.write('# next error NOT fixed, per error: ' + str(error_stats.next_error_NOT_fixed_in_utt_per_error) + '\n\n')
-        out_file.write('# n errors fixed, per error: ' + str(error_stats.n_errors_fixed_in_utt_per_error) + '\n\n')
-        out_file.write('# n errors NOT fixed, per error: ' + str(error_stats.n_errors_NOT_fixed_in_utt_per_error) + '\n\n')
-        out_file.write('# new errors added, per error: ' + str(error_stats.new_errors_added_in_utt_per_error) + '\n\n')
-        out_file.write('# new errors added between first and second error, per error: ' + str(error_stats.number_of_errors_added_before_second_error) + '\n\n')
-        out_file.write('# average length, per error, in words: ' + str(error_stats.utterance_average_length) + '\n\n')
-        out_file.write('# correction not contained in lattice: ' + str(error_stats.number_of_correction_not_contained_in_lattice) + '\n\n')
+        out_file.write('# errors per utt: ' + str(error_stats.count(UTTERANCES)) + '\n\n')
+        out_file.write('# all errors fixed, per error: ' + str(error_stats.count(ALL_ERRORS_FIXED)) + '\n\n')
+        out_file.write('# next error also fixed, per error: ' + str(error_stats.count(NEXT_ERROR_FIXED)) + '\n\n')
+        out_file.write('# next error NOT fixed, per error: ' + str(error_stats.count(NEXT_ERROR_NOT_FIXED)) + '\n\n')
+        out_file.write('# n errors fixed, per error: ' + str(error_stats.count(N_ERRORS_FIXED)) + '\n\n')
+        out_file.write('# n errors NOT fixed, per error: ' + str(error_stats.count(N_ERRORS_NOT_FIXED)) + '\n\n')
+        out_file.write('# new errors added, per error: ' + str(error_stats.count(NEW_ERRORS_ADDED)) + '\n\n')
+        out_file.write('# new errors added between first and second error, per error: ' + str(error_stats.count(ERRORS_ADDED_BEFORE_NEXT_ERROR)) + '\n\n')
+        out_file.write('# average length, per error, in words: ' + str(compute_average_length(error_stats)) + '\n\n')
+        out_file.write('# correction not contained in lattice: ' + str(error_stats.count(CORRECTION_NOT_IN_LATTICE)) + '\n\n')
         out_file.write('\n---Is next error fixed---\n')
-        out_file.write('# Second error fixed and no new errors added:  ' + str(error_stats.next_error_fixed_no_new_errors) + '\n')
-        out_file.write('# Second error fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.next_error_fixed_no_new_errors_no_errors) + '\n\n')
+        out_file.write('# Second error fixed and no new errors added:  ' + str(error_stats.count(NEXT_ERROR_FIXED_NO_NEW_ERRORS)) + '\n')
+        out_file.write('# Second error fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(NEXT_ERROR_FIXED_NO_NEW_ERRORS)) + '\n\n')
 
-        out_file.write('# Second error fixed and new errors added:  ' + str(error_stats.next_error_fixed_new_errors) + '\n')
-        out_file.write('# Second error fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.next_error_fixed_new_errors_no_errors) + '\n\n')
+        out_file.write('# Second error fixed and new errors added:  ' + str(error_stats.count(NEXT_ERROR_FIXED_NEW_ERRORS)) + '\n')
+        out_file.write('# Second error fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(NEXT_ERROR_FIXED_NEW_ERRORS)) + '\n\n')
 
-        out_file.write('# Second error NOT fixed and no new errors added:  ' + str(error_stats.next_error_not_fixed_no_new_errors) + '\n')
-        out_file.write('# Second error NOT fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.next_error_not_fixed_no_new_errors_no_errors) + '\n\n')
+        out_file.write('# Second error NOT fixed and no new errors added:  ' + str(error_stats.count(NEXT_ERROR_NOT_FIXED_NO_NEW_ERRORS)) + '\n')
+        out_file.write('# Second error NOT fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(NEXT_ERROR_NOT_FIXED_NO_NEW_ERRORS)) + '\n\n')
 
-        out_file.write('# Second error NOT fixed and new errors added:  ' + str(error_stats.next_error_not_fixed_new_errors) + '\n')
-        out_file.write('# Second error NOT fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.next_error_not_fixed_new_errors_no_errors) + '\n\n')
+        out_file.write('# Second error NOT fixed and new errors added:  ' + str(error_stats.count(NEXT_ERROR_NOT_FIXED_NEW_ERRORS)) + '\n')
+        out_file.write('# Second error NOT fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(NEXT_ERROR_NOT_FIXED_NEW_ERRORS)) + '\n\n')
         out_file.write('\n---Are n errors fixed---\n')
-        out_file.write('# n errors fixed and no new errors added:  ' + str(error_stats.n_errors_fixed_no_new_errors) + '\n')
-        out_file.write('# n errors fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.n_errors_fixed_no_new_errors_no_errors) + '\n\n')
+        out_file.write('# n errors fixed and no new errors added:  ' + str(error_stats.count(N_ERRORS_FIXED_NO_NEW_ERRORS)) + '\n')
+        out_file.write('# n errors fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(N_ERRORS_FIXED_NO_NEW_ERRORS)) + '\n\n')
+
+        out_file.write('# n errors fixed and new errors added:  ' + str(error_stats.count(N_ERRORS_FIXED_NEW_ERRORS)) + '\n')
+        out_file.write('# n errors fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(N_ERRORS_FIXED_NEW_ERRORS)) + '\n\n')
+
+        out_file.write('# n errors NOT fixed and no new errors added:  ' + str(error_stats.count(N_ERRORS_NOT_FIXED_NO_NEW_ERRORS)) + '\n')
+        out_file.write('# n errors NOT fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(N_ERRORS_NOT_FIXED_NO_NEW_ERRORS)) + '\n\n')
+
+        out_file.write('# n errors NOT fixed and new errors added:  ' + str(error_stats.count(N_ERRORS_NOT_FIXED_NEW_ERRORS)) + '\n')
+        out_file.write('# n errors NOT fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.sum(N_ERRORS_NOT_FIXED_NEW_ERRORS)) + '\n\n')
 
-        out_file.write('# n errors fixed and new errors added:  ' + str(error_stats.n_errors_fixed_new_errors) + '\n')
-        out_file.write('# n errors fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.n_errors_fixed_new_errors_no_errors) + '\n\n')
+        out_file.write('\n---Most frequent words, count (at most error too high)---\n')
+        for name, tracker in heavy_hitter_trackers(error_stats):
+            out_file.write('# ' + name + ': ' + ', '.join(
+                (heavy_hitter_name(item) or '<none>') + ' ' + str(count) + ('' if error == 0 else ' (' + str(error) + ')')
+                for item, count, error in tracker.top(HEAVY_HITTERS_REPORTED)) + '\n\n')
 
-        out_file.write('# n errors NOT fixed and no new errors added:  ' + str(error_stats.n_errors_not_fixed_no_new_errors) + '\n')
-        out_file.write('# n errors NOT fixed and no new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.n_errors_not_fixed_no_new_errors_no_errors) + '\n\n')
 
-        out_file.write('# n errors NOT fixed and new errors added:  ' + str(error_stats.n_errors_not_fixed_new_errors) + '\n')
-        out_file.write('# n errors NOT fixed and new errors added TOTAL ERRORS REMAINING:  ' + str(error_stats.n_errors_not_fixed_new_errors_no_errors) + '\n\n')
+def heavy_hitter_trackers(error_stats):
+    return (('words not in lattice', error_stats.words_not_in_lattice),
+            ('words of the next error not fixed', error_stats.words_next_error_not_fixed),
+            ('substitutions', error_stats.substitutions))
 
-    # oov_filename = out_dir + 'next_error_not_fixed_words_array'
-    # with open(oov_filename, 'w') as out_file:
-    #     # out_file.write('words when next error is not fixed: ' + str(error_stats.words_next_error_not_fixed) + '\n\n')
-    #     for word in error_stats.words_next_error_not_fixed_arr:
-    #         out_file.write(word + '\n')
+
+def heavy_hitter_name(item):
+    # a substitution is written as the reference word and the hypothesis word
+    return ' -> '.join(item) if isinstance(item, tuple) else str(item)
+
+
+def structured_tables(error_stats, classifications, budget_limited=None):
+    """
+    Creates the rows of the structured output, a row per utterance with its classification and a row per
+    number of errors and category with the count and sum
+    :param error_stats: an ErrorAnalysisStatistics
+    :param classifications: the classification of each utterance from error_analysis
+    :param budget_limited: the utterances whose search was over its budget, marked in their rows if given
+    :return: a dictionary with the utterance rows and the aggregate rows
+    """
+    utterance_rows = []
+    for error in sorted(error_stats.utterances_per_error):
+        for utt_id in error_stats.utterances_per_error[error]:
+            categories, word_not_in_lattice, word_next_error_not_fixed = classifications[utt_id]
+            row = {'utt_id': utt_id, 'errors': error}
+            for category in range(1, NUMBER_OF_CATEGORIES):
+                row[CATEGORY_NAMES[category]] = False
+            for category, error_cnt in categories:
+                row[CATEGORY_NAMES[category]] = True
+            row['word_not_in_lattice'] = word_not_in_lattice
+            row['word_next_error_not_fixed'] = word_next_error_not_fixed
+            if budget_limited is not None:
+                row['budget_limited'] = utt_id in budget_limited
+            utterance_rows.append(row)
+
+    aggregate_rows = []
+    for index in range(len(error_stats.counts)):
+        if error_stats.counts[index] != 0:
+            error, category = divmod(index, NUMBER_OF_CATEGORIES)
+            aggregate_rows.append({'errors': error, 'category': CATEGORY_NAMES[category],
+                                   'count': error_stats.counts[index], 'sum': error_stats.sums[index]})
+
+    heavy_hitter_rows = []
+    for name, tracker in heavy_hitter_trackers(error_stats):
+        for item, count, error in tracker.top():
+            heavy_hitter_rows.append({'tracker': name, 'item': heavy_hitter_name(item), 'count': count, 'error': error})
+
+    return {'utterances': utterance_rows, 'aggregates': aggregate_rows, 'heavy_hitters': heavy_hitter_rows}
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Best path in lattices',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('r', type=argparse.FileType('r'), help='Reference file')
-    parser.add_argument('w', type=argparse.FileType('r'), help='New Reference file')
+    parser.add_argument('r', type=argparse.FileType('r'), nargs='?', default=None,
+                        help='Reference file, with --changed it is not read and only the new reference file is given')
+    parser.add_argument('w', type=argparse.FileType('r'), nargs='?', default=None, help='New Reference file')
     parser.add_argument('-o', type=str, default='kaldi_new_best_path', help='Output directory')
     parser.add_argument('-n', type=str, default=0, help='Number of errors to look at')
-
-    return parser.parse_args()
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes, the utterances are split into this many shards by utterance id')
+    parser.add_argument('--store', type=str, default=None,
+                        help='File to keep the classification of every utterance in. A full run writes it, a run with '
+                             '--changed reads it and only classifies the changed utterances again')
+    parser.add_argument('--changed', type=argparse.FileType('r'), action='append', default=None,
+                        help='File listing the utterances whose new hypothesis changed since the store was written, '
+                             'e.g. applied_to_new_*.txt of both the previous and the new experiment, given once per file')
+    parser.add_argument('--structured', action='store_true',
+                        help='Also write the classification of every utterance and the counts as JSON Lines '
+                             'and as a NumPy .npz file with a column per field')
+
+    args = parser.parse_args()
+    if args.changed is not None and args.w is None:
+        # the reference file is classified in the store, only the new reference file is read
+        args.r, args.w = None, args.r
+    if args.w is None:
+        parser.error('the reference file and the new reference file are required without --changed')
+    return args
 
 
 def main():
@@ -394,18 +694,44 @@ def main():
             raise
         pass
 
-    error_stats = ErrorAnalysisStatistics()
+    if args.changed is not None:
+        if args.store is None:
+            raise ValueError('--changed needs the --store of an earlier run')
+        store = load_classification_store(args.store)
+        changed = read_changed_utterances(args.changed)
+
+        new_references, new_hypothesis, new_error_details = init_references(
+            new_reference_file, ErrorAnalysisStatistics(), True, changed)
+        updated = update_error_analysis(store, new_hypothesis, new_error_details)
+        print('Classified ' + str(updated) + ' changed utterances again')
+
+        error_stats = store['error_stats']
+        classifications = {utt_id: store['utterances'][utt_id][-1] for utt_id in store['utterances']}
+        save_classification_store(args.store, store)
+    else:
+        error_stats = ErrorAnalysisStatistics()
+
+        references, hypothesis, old_error_details = init_references(reference_file, error_stats)
 
-    references, hypothesis, old_error_details = init_references(reference_file, error_stats)
+        new_error_stats = ErrorAnalysisStatistics()
 
-    new_error_stats = ErrorAnalysisStatistics()
+        new_references, new_hypothesis, new_error_details = init_references(new_reference_file, new_error_stats, True)
 
-    new_references, new_hypothesis, new_error_details = init_references(new_reference_file, new_error_stats, True)
+        classifications = {} if args.store is not None or args.structured else None
+        if args.jobs > 1:
+            sharded_error_analysis(error_stats, new_hypothesis, hypothesis, old_error_details, new_error_details, args.jobs,
+                                   args.jobs, classifications)
+        else:
+            error_analysis(error_stats, new_hypothesis, hypothesis, old_error_details, new_error_details, classifications)
 
-    error_analysis(error_stats, new_hypothesis, hypothesis, old_error_details, new_error_details)
+        if args.store is not None:
+            save_classification_store(args.store, create_classification_store(
+                error_stats, hypothesis, old_error_details, classifications))
 
     filename = 'error-results-' + time.strftime('%d-%b-') + time.strftime('%H:%M') + '.txt'
     write_error_stats_to_file(filename, out_dir, error_stats)
+    if args.structured:
+        write_structured_results(out_dir, filename[:-len('.txt')], structured_tables(error_stats, classifications))
 
 
 if __name__ == '__main__':
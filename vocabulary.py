@@ -0,0 +1,76 @@
+from array import array
+
+EPSILON = '<eps>'
+# the id of the epsilon word, interned first by every vocabulary
+EPSILON_ID = 0
+# array type code of the word ids, a 32 bit signed integer
+WORD_ID_TYPE = 'i'
+
+
+class Vocabulary:
+    """
+    Interns every word once and gives it an integer id, so utterances and lattice arcs can be stored
+    as arrays of word ids and compared as arrays instead of as lists of strings
+    """
+    def __init__(self):
+        self.word_ids = {}
+        self.words = []
+        self.intern(EPSILON)
+
+    def __len__(self):
+        return len(self.words)
+
+    def intern(self, word):
+        """
+        :param word: a word
+        :return: the id of the word, a new id if the word has not been seen before
+        """
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            self.word_ids[word] = word_id
+            self.words.append(word)
+        return word_id
+
+    def word(self, word_id):
+        return self.words[word_id]
+
+    def encode(self, utterance):
+        """
+        :param utterance: a string of words separated by whitespace
+        :return: an array of the ids of the words
+        """
+        return array(WORD_ID_TYPE, [self.intern(word) for word in utterance.split()])
+
+    def decode(self, word_ids):
+        """
+        :param word_ids: a sequence of word ids
+        :return: the words as a string separated by single spaces, without epsilons
+        """
+        return ' '.join(self.words[word_id] for word_id in word_ids if word_id != EPSILON_ID)
+
+    def encode_utterances(self, utterances):
+        """
+        :param utterances: a dictionary of utterances as strings
+        :return: a dictionary of the utterances as arrays of word ids
+        """
+        return {utt_id: self.encode(utterances[utt_id]) for utt_id in utterances}
+
+    def decode_utterances(self, utterances):
+        """
+        :param utterances: a dictionary of utterances as arrays of word ids
+        :return: a dictionary of the utterances as strings
+        """
+        return {utt_id: self.decode(utterances[utt_id]) for utt_id in utterances}
+
+
+def utterance_words(utterance):
+    """
+    :param utterance: a string of words, or a sequence of words or word ids
+    :return: the words of a string, or the sequence itself
+    """
+    return utterance.split() if isinstance(utterance, str) else utterance
+
+
+def is_epsilon(word):
+    return word == EPSILON or word == EPSILON_ID